@@ -0,0 +1,195 @@
+# Extract the part of the river network upstream of one or more outlets
+# Creates a reduced mizuRoute topology file that only contains the segments upstream of the given outlet segment(s) and
+# the routing HRUs that drain into these segments (via 'hruToSegId'). The downstream ID of each outlet is set to 0. If
+# the control file specifies that routing basins need to be remapped ('river_basin_needs_remap'), the remapping file is
+# reduced to the same routing HRUs. The SUMMA attributes, initial conditions and trial parameter files are reduced to
+# the GRUs that contribute runoff to the extracted routing HRUs (and the HRUs in those GRUs).
+#
+# Upstream segments are found with an index that lists for each segment the segments that directly drain into it, stored
+# as a compressed sparse row (CSR) structure: the upstream segments of segment i are upstream[indptr[i]:indptr[i+1]].
+# Building this index takes a time proportional to the number of segments and is done once. Tracing upstream from the
+# outlets then only visits the extracted segments, so that extracting a small basin from a large network is fast.
+#
+# Reduced files are stored with their original names in the output folder. Forcing files are not reduced.
+#
+# Usage: python MIZUROUTE_extract_subnetwork.py [outlet segment ID(s), e.g. X or X,Y,Z] [output folder]
+
+# modules
+import sys
+import time
+import numpy as np
+import pandas as pd
+import netCDF4 as nc4
+from pathlib import Path
+from datetime import datetime
+
+# --- Control file handling
+# Easy access to control file folder
+controlFolder = Path('../0_control_files')
+
+# Store the name of the 'active' file in a variable
+controlFile = 'control_active.txt'
+
+# Function to extract a given setting from the control file
+def read_from_control( file, setting ):
+
+    # Open 'control_active.txt' and ...
+    with open(file) as contents:
+        for line in contents:
+
+            # ... find the line with the requested setting
+            if setting in line and not line.startswith('#'):
+                break
+
+    # Extract the setting's value
+    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
+    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
+    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
+
+    # Return this value
+    return substring
+
+# Function to specify a default path
+def make_default_path(suffix):
+
+    # Get the root path
+    rootPath = Path( read_from_control(controlFolder/controlFile,'root_path') )
+
+    # Get the domain folder
+    domainName = read_from_control(controlFolder/controlFile,'domain_name')
+    domainFolder = 'domain_' + domainName
+
+    # Specify the forcing path
+    defaultPath = rootPath / domainFolder / suffix
+
+    return defaultPath
+
+
+# --- Function definitions
+# Builds the upstream index (CSR) of a river network. Returns the index of each segment's downstream segment (-1 if
+# none) and the arrays indptr and upstream
+def build_upstream_index(seg_ids, down_ids):
+    down_index = pd.Index(seg_ids).get_indexer(down_ids)
+    has_down = down_index >= 0
+    upstream = np.flatnonzero(has_down)[np.argsort(down_index[has_down], kind='stable')]
+    indptr = np.zeros(len(seg_ids)+1, dtype='int64')
+    indptr[1:] = np.cumsum(np.bincount(down_index[has_down], minlength=len(seg_ids)))
+    return down_index, indptr, upstream
+
+# Finds the indices of all segments upstream of (and including) the outlet segments. Each step adds the segments that
+# directly drain into the previous step's segments. Segments that were found before are not visited again, so that the
+# tracing ends even if the network contains cycles.
+def trace_upstream(indptr, upstream, outlet_index):
+    found = np.zeros(len(indptr)-1, dtype=bool)
+    found[outlet_index] = True
+    front = np.unique(outlet_index)
+    while len(front) > 0:
+        counts = indptr[front+1] - indptr[front]
+        total = counts.sum()
+        if total == 0:
+            break
+        offsets = np.repeat(indptr[front] - np.cumsum(counts) + counts, counts)
+        front = upstream[offsets + np.arange(total)]
+        front = front[~found[front]]
+        found[front] = True
+    return np.flatnonzero(found)
+
+# Copies a netCDF file, keeping only the selected elements along the given dimensions
+def subset_file(src_file, des_file, keep, new_values=None):
+    with nc4.Dataset(src_file) as src, nc4.Dataset(des_file, 'w', format='NETCDF4') as des:
+        des.setncatts(src.__dict__)
+        des.setncattr('History', 'Created ' + datetime.now().strftime('%Y/%m/%d %H:%M:%S') + ' as subset of ' + str(src_file))
+        for name,dim in src.dimensions.items():
+            size = len(keep[name]) if name in keep else len(dim)
+            des.createDimension(name, None if dim.isunlimited() else size)
+        for name,var in src.variables.items():
+            fill_value = var.getncattr('_FillValue') if '_FillValue' in var.ncattrs() else False
+            des.createVariable(name, var.datatype, var.dimensions, fill_value=fill_value)
+            des[name].setncatts({att: var.getncattr(att) for att in var.ncattrs() if att != '_FillValue'})
+            values = var[:]
+            for axis,dim in enumerate(var.dimensions):
+                if dim in keep:
+                    values = np.take(values, keep[dim], axis=axis)
+            if new_values is not None and name in new_values:
+                values = new_values[name](values)
+            des[name][:] = values
+
+
+# --- Main code
+if __name__ == '__main__':
+
+    # Arguments
+    if len(sys.argv) != 3:
+        sys.exit('Usage: python MIZUROUTE_extract_subnetwork.py [outlet segment ID(s), e.g. X or X,Y,Z] [output folder]')
+    outlet_ids = np.array([int(outlet_id) for outlet_id in sys.argv[1].split(',')])
+    output_path = Path(sys.argv[2])
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    # --- Find the mizuRoute and SUMMA settings files
+    # mizuRoute settings path
+    mizu_path = read_from_control(controlFolder/controlFile,'settings_mizu_path')
+    if mizu_path == 'default':
+        mizu_path = make_default_path('settings/mizuRoute') # outputs a Path()
+    else:
+        mizu_path = Path(mizu_path) # make sure a user-specified path is a Path()
+    topology_name = read_from_control(controlFolder/controlFile,'settings_mizu_topology')
+    remap_flag    = read_from_control(controlFolder/controlFile,'river_basin_needs_remap')
+    remap_name    = read_from_control(controlFolder/controlFile,'settings_mizu_remap')
+
+    # SUMMA settings path
+    summa_path = read_from_control(controlFolder/controlFile,'settings_summa_path')
+    if summa_path == 'default':
+        summa_path = make_default_path('settings/SUMMA') # outputs a Path()
+    else:
+        summa_path = Path(summa_path) # make sure a user-specified path is a Path()
+    attribute_name = read_from_control(controlFolder/controlFile,'settings_summa_attributes')
+    summa_names = [read_from_control(controlFolder/controlFile,'settings_summa_coldstate'),
+                   read_from_control(controlFolder/controlFile,'settings_summa_trialParams')]
+
+    # --- Extract the river network
+    # Build the upstream index
+    with nc4.Dataset(mizu_path/topology_name) as topo:
+        seg_ids = topo['segId'][:].astype('int64')
+        down_ids = topo['downSegId'][:].astype('int64')
+        hru_ids = topo['hruId'][:].astype('int64')
+        hru_to_seg = topo['hruToSegId'][:].astype('int64')
+    started = time.time()
+    down_index, indptr, upstream = build_upstream_index(seg_ids, down_ids)
+    print('Built upstream index of {} segments in {:.3f} s'.format(len(seg_ids), time.time()-started))
+
+    # Trace upstream from the outlets
+    started = time.time()
+    outlet_index = pd.Index(seg_ids).get_indexer(outlet_ids)
+    if (outlet_index < 0).any():
+        sys.exit('Error: outlet segment(s) {} not found in {}'.format(outlet_ids[outlet_index < 0], topology_name))
+    keep_seg = trace_upstream(indptr, upstream, outlet_index)
+    keep_hru = np.flatnonzero(np.isin(hru_to_seg, seg_ids[keep_seg]))
+    print('Found {} segments and {} routing HRUs upstream of {} outlet(s) in {:.3f} s'.format(len(keep_seg), len(keep_hru), len(outlet_ids), time.time()-started))
+
+    # Store the reduced topology; outlets drain nowhere
+    is_outlet = np.isin(seg_ids[keep_seg], outlet_ids)
+    subset_file(mizu_path/topology_name, output_path/topology_name, {'seg': keep_seg, 'hru': keep_hru},
+                new_values={'downSegId': lambda values: np.where(is_outlet, 0, values)})
+
+    # --- Find the contributing SUMMA GRUs and reduce the remapping file
+    if remap_flag.lower() == 'yes':
+        with nc4.Dataset(mizu_path/remap_name) as remap:
+            rn_hru_ids = remap['RN_hruId'][:].astype('int64')
+            overlaps = remap['nOverlaps'][:].astype('int64')
+            hm_gru_ids = remap['HM_hruId'][:].astype('int64')
+        keep_rn_hru = np.isin(rn_hru_ids, hru_ids[keep_hru])
+        keep_data = np.repeat(keep_rn_hru, overlaps)
+        subset_file(mizu_path/remap_name, output_path/remap_name, {'hru': np.flatnonzero(keep_rn_hru), 'data': np.flatnonzero(keep_data)})
+        gru_ids = np.unique(hm_gru_ids[keep_data])
+    else:
+        gru_ids = hru_ids[keep_hru]
+
+    # --- Reduce the SUMMA files
+    with nc4.Dataset(summa_path/attribute_name) as att:
+        keep_gru = np.flatnonzero(np.isin(att['gruId'][:].astype('int64'), gru_ids))
+        keep_summa_hru = np.flatnonzero(np.isin(att['hru2gruId'][:].astype('int64'), gru_ids))
+    if len(keep_gru) < len(gru_ids):
+        print('Warning: {} routing HRU(s) have no matching GRU in {}'.format(len(gru_ids)-len(keep_gru), attribute_name))
+    for name in [attribute_name] + summa_names:
+        subset_file(summa_path/name, output_path/name, {'gru': keep_gru, 'hru': keep_summa_hru})
+    print('Reduced files for {} GRUs and {} HRUs stored in {}'.format(len(keep_gru), len(keep_summa_hru), output_path))
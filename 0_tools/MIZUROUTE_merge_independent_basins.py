@@ -0,0 +1,171 @@
+# Merge the outputs of mizuRoute runs for groups of independent basins into files for the full river network
+# MIZUROUTE_split_into_independent_basins.py divides the river network into groups of basins that are routed by separate
+# mizuRoute runs with case names [case_name]_G[group]. This script combines their output files ([case_name]_G[group].h.
+# [time stamp].nc) into files with the name that a single run for the full network would produce ([case_name].h.[time
+# stamp].nc). Segments and routing HRUs are stored in the order of the full topology file, based on the 'reachID' and
+# 'basinID' variables in the group outputs. Segments or HRUs that are not part of any group are given fill values.
+#
+# Data is copied in blocks of time steps, so that memory use is limited for large networks and long output files. The
+# output files of a time stamp are only merged if all groups have one.
+#
+# Usage: python MIZUROUTE_merge_independent_basins.py [optional: delete group outputs after merging, 'yes' or 'no' (default)]
+
+# modules
+import os
+import sys
+import glob
+import numpy as np
+import pandas as pd
+import netCDF4 as nc4
+from pathlib import Path
+from datetime import datetime
+
+# --- Control file handling
+# Easy access to control file folder
+controlFolder = Path('../0_control_files')
+
+# Store the name of the 'active' file in a variable
+controlFile = 'control_active.txt'
+
+# Function to extract a given setting from the control file
+def read_from_control( file, setting ):
+
+    # Open 'control_active.txt' and ...
+    with open(file) as contents:
+        for line in contents:
+
+            # ... find the line with the requested setting
+            if setting in line and not line.startswith('#'):
+                break
+
+    # Extract the setting's value
+    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
+    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
+    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
+
+    # Return this value
+    return substring
+
+# Function to specify a default path
+def make_default_path(suffix):
+
+    # Get the root path
+    rootPath = Path( read_from_control(controlFolder/controlFile,'root_path') )
+
+    # Get the domain folder
+    domainName = read_from_control(controlFolder/controlFile,'domain_name')
+    domainFolder = 'domain_' + domainName
+
+    # Specify the forcing path
+    defaultPath = rootPath / domainFolder / suffix
+
+    return defaultPath
+
+
+# --- Function definitions
+# Merges the output files of all groups for one time stamp
+def merge_group_outputs(group_files, output_file, seg_ids, hru_ids, max_values=5e7):
+    srcs = [nc4.Dataset(file) for file in group_files]
+    try:
+        # Position of each group's segments and HRUs in the full network
+        positions = []
+        for src in srcs:
+            position = {'seg': pd.Index(seg_ids).get_indexer(src['reachID'][:].astype('int64'))}
+            if 'hru' in src.dimensions:
+                position['hru'] = pd.Index(hru_ids).get_indexer(src['basinID'][:].astype('int64'))
+            positions.append(position)
+        sizes = {'seg': len(seg_ids), 'hru': len(hru_ids)}
+
+        # Create the output file from the first group's file
+        first = srcs[0]
+        with nc4.Dataset(output_file, 'w', format='NETCDF4') as des:
+            des.setncatts(first.__dict__)
+            des.setncattr('History', 'Created ' + datetime.now().strftime('%Y/%m/%d %H:%M:%S') + ' by merging outputs of {} groups of independent basins'.format(len(srcs)))
+            for name,dim in first.dimensions.items():
+                size = sizes[name] if name in sizes else len(dim)
+                des.createDimension(name, None if dim.isunlimited() else size)
+
+            for name,var in first.variables.items():
+                fill_value = var.getncattr('_FillValue') if '_FillValue' in var.ncattrs() else nc4.default_fillvals.get(var.dtype.str[1:])
+                des.createVariable(name, var.datatype, var.dimensions, fill_value=fill_value)
+                des[name].setncatts({att: var.getncattr(att) for att in var.ncattrs() if att != '_FillValue'})
+                spatial = [dim for dim in var.dimensions if dim in sizes]
+
+                # Variables without a spatial dimension (e.g. time) are the same in all groups
+                if len(spatial) == 0:
+                    des[name][:] = var[:]
+                    continue
+
+                # ID variables
+                if name in ['reachID','basinID']:
+                    des[name][:] = seg_ids if spatial[0] == 'seg' else hru_ids
+                    continue
+
+                # Spatial variables are copied in blocks of time steps, if they have a time dimension
+                axis = var.dimensions.index(spatial[0])
+                shape = [sizes[dim] if dim in sizes else len(first.dimensions[dim]) for dim in var.dimensions]
+                if axis == 0:
+                    blocks = [slice(None)]
+                else:
+                    step = max(1, int(max_values // np.prod(shape[1:])))
+                    blocks = [slice(start, min(start+step, shape[0])) for start in range(0, shape[0], step)]
+                for block in blocks:
+                    values = None
+                    for src,position in zip(srcs, positions):
+                        data = np.ma.filled(src[name][block], fill_value)
+                        if values is None:
+                            values = np.full(data.shape[:axis] + (shape[axis],) + data.shape[axis+1:], fill_value, dtype=var.dtype)
+                        values[(slice(None),)*axis + (position[spatial[0]],)] = data
+                    des[name][block] = values
+    finally:
+        for src in srcs:
+            src.close()
+
+
+# --- Main code
+if __name__ == '__main__':
+
+    # Arguments
+    delete_groups = len(sys.argv) > 1 and sys.argv[1].lower() == 'yes'
+
+    # --- Find the settings and output folders
+    mizu_path = read_from_control(controlFolder/controlFile,'settings_mizu_path')
+    if mizu_path == 'default':
+        mizu_path = make_default_path('settings/mizuRoute') # outputs a Path()
+    else:
+        mizu_path = Path(mizu_path) # make sure a user-specified path is a Path()
+    topology_name = read_from_control(controlFolder/controlFile,'settings_mizu_topology')
+    case_name = read_from_control(controlFolder/controlFile,'experiment_id')
+
+    output_path = read_from_control(controlFolder/controlFile,'experiment_output_mizuRoute')
+    if output_path == 'default':
+        output_path = make_default_path('simulations/' + case_name + '/mizuRoute') # outputs a Path()
+    else:
+        output_path = Path(output_path) # make sure a user-specified path is a Path()
+
+    # Segments and HRUs of the full network, and the number of groups
+    with nc4.Dataset(mizu_path/topology_name) as topo:
+        seg_ids = topo['segId'][:].astype('int64')
+        hru_ids = topo['hruId'][:].astype('int64')
+    num_groups = pd.read_csv(mizu_path/'independent_basins'/'basin_groups.csv')['group'].max()
+
+    # --- Find the time stamps of all group outputs and merge them
+    stamps = {}
+    for file in glob.glob(str(output_path / '{}_G*.h.*.nc'.format(case_name))):
+        group,stamp = Path(file).name[len(case_name)+2:].split('.h.',1)
+        if group.isdigit():
+            stamps.setdefault(stamp, {})[int(group)] = file
+    if len(stamps) == 0:
+        sys.exit('Error: no group outputs found in {}'.format(output_path))
+
+    for stamp in sorted(stamps):
+        if len(stamps[stamp]) < num_groups:
+            print('Skipping time stamp {}: output found for {} out of {} groups'.format(stamp, len(stamps[stamp]), num_groups))
+            continue
+        group_files = [stamps[stamp][group] for group in sorted(stamps[stamp])]
+        output_file = output_path / '{}.h.{}'.format(case_name, stamp)
+        merge_group_outputs(group_files, output_file, seg_ids, hru_ids)
+        print('Merged {} group outputs into {}'.format(num_groups, output_file))
+        if delete_groups:
+            for file in group_files:
+                os.remove(file)
@@ -0,0 +1,190 @@
+# Split the river network into groups of independent drainage basins that can be routed in parallel
+# Large river networks often consist of many drainage basins that do not exchange water. These can be routed by
+# separate mizuRoute processes. This script finds the drainage basins in the mizuRoute topology file (all segments that
+# drain to the same outlet form one basin), divides these into a given number of groups with a similar load and creates
+# mizuRoute input files for each group:
+# - Topology file: the segments of all basins in the group and the routing HRUs that drain into these segments;
+# - Remapping file: the routing HRUs of the group (only if 'river_basin_needs_remap' is 'yes');
+# - Control file: a copy of the mizuRoute control file that uses the group's topology and remapping file, and case
+#   name [case_name]_G[group]. All groups use the same SUMMA output as input.
+# Files are stored in subfolder 'independent_basins' of the mizuRoute settings folder. The group of each segment is
+# stored in 'basin_groups.csv' in the same folder.
+#
+# The load of a basin is its number of segments (default) or total segment length. Basins are assigned to groups from
+# largest to smallest, each to the group with the lowest load so far. Routing time of the groups will therefore be
+# similar unless a single basin is larger than the average load of a group.
+#
+# Run mizuRoute with each control file (e.g. as an array job) and use MIZUROUTE_merge_independent_basins.py to combine
+# the group outputs into files for the full network.
+#
+# Usage: python MIZUROUTE_split_into_independent_basins.py [number of groups] [optional: load measure 'count' or 'length']
+
+# modules
+import re
+import sys
+import heapq
+import numpy as np
+import pandas as pd
+import netCDF4 as nc4
+from pathlib import Path
+from MIZUROUTE_extract_subnetwork import subset_file
+
+# --- Control file handling
+# Easy access to control file folder
+controlFolder = Path('../0_control_files')
+
+# Store the name of the 'active' file in a variable
+controlFile = 'control_active.txt'
+
+# Function to extract a given setting from the control file
+def read_from_control( file, setting ):
+
+    # Open 'control_active.txt' and ...
+    with open(file) as contents:
+        for line in contents:
+
+            # ... find the line with the requested setting
+            if setting in line and not line.startswith('#'):
+                break
+
+    # Extract the setting's value
+    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
+    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
+    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
+
+    # Return this value
+    return substring
+
+# Function to specify a default path
+def make_default_path(suffix):
+
+    # Get the root path
+    rootPath = Path( read_from_control(controlFolder/controlFile,'root_path') )
+
+    # Get the domain folder
+    domainName = read_from_control(controlFolder/controlFile,'domain_name')
+    domainFolder = 'domain_' + domainName
+
+    # Specify the forcing path
+    defaultPath = rootPath / domainFolder / suffix
+
+    return defaultPath
+
+
+# --- Function definitions
+# Finds the index of the outlet each segment drains to. Each step replaces each segment's pointer by the pointer of the
+# segment it points to, so that the number of steps grows with the logarithm of the longest flow path. Pointers of
+# segments in a cycle never reach an outlet: they either keep changing or settle on a segment that still has a
+# downstream segment (e.g. for cycles with a length that is a power of 2, or a segment that drains into itself).
+def find_outlets(seg_ids, down_ids):
+    down_index = pd.Index(seg_ids).get_indexer(down_ids)
+    outlet = np.where(down_index >= 0, down_index, np.arange(len(seg_ids)))
+    for _ in range(64):
+        next_outlet = outlet[outlet]
+        if np.array_equal(next_outlet, outlet):
+            break
+        outlet = next_outlet
+    if not (down_index[outlet] < 0).all():
+        sys.exit('Error: river network contains cycles. Use MIZUROUTE_validate_network_topology.py to find and repair these.')
+    return outlet
+
+# Divides basins over groups; largest basins first, each to the group with the lowest load so far
+def assign_groups(load, num_groups):
+    groups = [(0., group) for group in range(num_groups)]
+    assigned = np.zeros(len(load), dtype='int64')
+    for basin in np.argsort(-load, kind='stable'):
+        group_load, group = heapq.heappop(groups)
+        assigned[basin] = group
+        heapq.heappush(groups, (group_load + load[basin], group))
+    return assigned
+
+# Writes a copy of a mizuRoute control file with new values for the given settings
+def write_control_file(template, file, settings):
+    with open(template) as src:
+        lines = src.readlines()
+    with open(file, 'w') as des:
+        for line in lines:
+            match = re.match(r'(<\w+>)(\s+)(\S+)', line)
+            if match and match.group(1) in settings:
+                line = line.replace(match.group(0), match.group(1) + match.group(2) + '{:{}}'.format(settings[match.group(1)], len(match.group(3))), 1)
+            des.write(line)
+
+
+# --- Main code
+if __name__ == '__main__':
+
+    # Arguments
+    if len(sys.argv) < 2:
+        sys.exit('Usage: python MIZUROUTE_split_into_independent_basins.py [number of groups] [optional: load measure count or length]')
+    num_groups = int(sys.argv[1])
+    load_measure = sys.argv[2] if len(sys.argv) > 2 else 'count'
+    if load_measure not in ['count','length']:
+        sys.exit('Error: load measure must be count or length, not {}'.format(load_measure))
+
+    # --- Find the mizuRoute settings files
+    mizu_path = read_from_control(controlFolder/controlFile,'settings_mizu_path')
+    if mizu_path == 'default':
+        mizu_path = make_default_path('settings/mizuRoute') # outputs a Path()
+    else:
+        mizu_path = Path(mizu_path) # make sure a user-specified path is a Path()
+    topology_name = read_from_control(controlFolder/controlFile,'settings_mizu_topology')
+    remap_flag    = read_from_control(controlFolder/controlFile,'river_basin_needs_remap')
+    remap_name    = read_from_control(controlFolder/controlFile,'settings_mizu_remap')
+    control_name  = read_from_control(controlFolder/controlFile,'settings_mizu_control_file')
+    case_name     = read_from_control(controlFolder/controlFile,'experiment_id')
+
+    # Output folder
+    split_folder = 'independent_basins'
+    split_path = mizu_path / split_folder
+    split_path.mkdir(parents=True, exist_ok=True)
+
+    # --- Find the basins and divide them over the groups
+    with nc4.Dataset(mizu_path/topology_name) as topo:
+        seg_ids = topo['segId'][:].astype('int64')
+        down_ids = topo['downSegId'][:].astype('int64')
+        seg_length = topo['length'][:].astype('float64')
+        hru_ids = topo['hruId'][:].astype('int64')
+        hru_to_seg = topo['hruToSegId'][:].astype('int64')
+    outlet = find_outlets(seg_ids, down_ids)
+    basin_outlets, basin = np.unique(outlet, return_inverse=True)
+    if load_measure == 'count':
+        load = np.bincount(basin).astype('float64')
+    else:
+        load = np.bincount(basin, weights=seg_length)
+    num_groups = min(num_groups, len(basin_outlets))
+    basin_group = assign_groups(load, num_groups)
+    seg_group = basin_group[basin] + 1
+    group_load = np.bincount(basin_group, weights=load, minlength=num_groups)
+    print('Divided {} segments in {} basins over {} groups. Largest basin: {:.0f}; average group load: {:.0f}; largest group load: {:.0f} ({})'.format(
+          len(seg_ids), len(basin_outlets), num_groups, load.max(), group_load.mean(), group_load.max(), load_measure))
+
+    # Store the group of each segment
+    pd.DataFrame({'segId': seg_ids, 'outletSegId': seg_ids[outlet], 'group': seg_group}).to_csv(split_path/'basin_groups.csv', index=False)
+
+    # Routing HRUs of each group
+    hru_group = np.zeros(len(hru_ids), dtype='int64')
+    hru_seg = pd.Index(seg_ids).get_indexer(hru_to_seg)
+    hru_group[hru_seg >= 0] = seg_group[hru_seg[hru_seg >= 0]]
+    if (hru_seg < 0).any():
+        print('Warning: {} routing HRU(s) drain to a segment that is not in the network and are not part of any group'.format((hru_seg < 0).sum()))
+    if remap_flag.lower() == 'yes':
+        with nc4.Dataset(mizu_path/remap_name) as remap:
+            rn_hru_group = pd.Series(hru_group, index=hru_ids).reindex(remap['RN_hruId'][:].astype('int64')).fillna(0).values.astype('int64')
+            data_group = np.repeat(rn_hru_group, remap['nOverlaps'][:].astype('int64'))
+
+    # --- Write the files of each group
+    for group in range(1, num_groups+1):
+        group_topology = 'topology_G{}.nc'.format(group)
+        subset_file(mizu_path/topology_name, split_path/group_topology,
+                    {'seg': np.flatnonzero(seg_group == group), 'hru': np.flatnonzero(hru_group == group)})
+        settings = {'<fname_ntopOld>': split_folder + '/' + group_topology,
+                    '<case_name>': '{}_G{}'.format(case_name, group)}
+        if remap_flag.lower() == 'yes':
+            group_remap = 'remap_G{}.nc'.format(group)
+            subset_file(mizu_path/remap_name, split_path/group_remap,
+                        {'hru': np.flatnonzero(rn_hru_group == group), 'data': np.flatnonzero(data_group == group)})
+            settings['<fname_remap>'] = split_folder + '/' + group_remap
+        control_file = split_path / '{}_G{}{}'.format(Path(control_name).stem, group, Path(control_name).suffix)
+        write_control_file(mizu_path/control_name, control_file, settings)
+
+    print('Files for {} groups stored in {}'.format(num_groups, split_path))
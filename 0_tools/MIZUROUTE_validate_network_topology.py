@@ -0,0 +1,249 @@
+# Check a river network shapefile for connections that mizuRoute cannot handle, and optionally repair them.
+#
+# The river network is treated as a graph in which each segment has at most one downstream segment. The script finds:
+# - Cycles: segments that (eventually) drain into themselves. This includes, but is not limited to, segments whose
+#   downstream ID equals their own ID (see MERIT_fix_circular_downstream_ids.py);
+# - Dangling downstream IDs: downstream IDs > 0 that do not exist in the shapefile;
+# - Outlets and disconnected components: each segment drains to exactly one outlet (downstream ID <= 0, a dangling
+#   downstream ID or a cycle). Segments that drain to the same outlet form one component. Outlets that are not listed
+#   in the control file setting 'settings_mizu_make_outlet' are reported as unexpected. If no outlets are listed, only
+#   the outlet of the largest component is expected.
+# All checks take a time proportional to the number of segments, so that large networks can be checked quickly.
+#
+# If 'repair' is given as argument, problems are fixed in the way 'settings_mizu_make_outlet' is applied when the
+# topology file is created, i.e. by setting the downstream ID of a segment to 0 so that it becomes an outlet:
+# - Segments listed in 'settings_mizu_make_outlet' become outlets;
+# - Segments with a dangling downstream ID become outlets;
+# - Each remaining cycle is broken by turning the cycle segment with the most upstream segments into an outlet.
+# Unexpected outlets cannot be connected to the rest of the network without further information and are only reported.
+#
+# A table of all segments with a problem is stored next to the river network shapefile.
+#
+# !!! With 'repair', the source file is replaced - use with caution !!!
+#
+# Usage: python MIZUROUTE_validate_network_topology.py [optional: 'repair']
+
+# modules
+import sys
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from pathlib import Path
+
+# --- Control file handling
+# Easy access to control file folder
+controlFolder = Path('../0_control_files')
+
+# Store the name of the 'active' file in a variable
+controlFile = 'control_active.txt'
+
+# Function to extract a given setting from the control file
+def read_from_control( file, setting ):
+
+    # Open 'control_active.txt' and ...
+    with open(file) as contents:
+        for line in contents:
+
+            # ... find the line with the requested setting
+            if setting in line and not line.startswith('#'):
+                break
+
+    # Extract the setting's value
+    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
+    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
+    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
+
+    # Return this value
+    return substring
+
+# Function to specify a default path
+def make_default_path(suffix):
+
+    # Get the root path
+    rootPath = Path( read_from_control(controlFolder/controlFile,'root_path') )
+
+    # Get the domain folder
+    domainName = read_from_control(controlFolder/controlFile,'domain_name')
+    domainFolder = 'domain_' + domainName
+
+    # Specify the forcing path
+    defaultPath = rootPath / domainFolder / suffix
+
+    return defaultPath
+
+
+# --- Function definitions
+# Finds the index of each segment's downstream segment: -1 for outlets (downstream ID <= 0), -2 for dangling IDs
+def downstream_index(seg_ids, down_ids):
+    down_index = pd.Index(seg_ids).get_indexer(down_ids)
+    down_index[(down_index == -1) & (down_ids > 0)] = -2
+    down_index[down_ids <= 0] = -1
+    return down_index
+
+# Orders segments from headwaters to outlets by repeatedly removing segments without (remaining) upstream segments.
+# Segments that are never removed are part of a cycle: each segment has at most one downstream segment, so segments
+# that drain into a cycle are removed but the segments in the cycle always keep one upstream segment.
+# Returns the order, the number of segments upstream of each segment (including itself) and a cycle mask.
+def topological_order(down_index):
+    num_seg = len(down_index)
+    down_list = down_index.tolist() # plain lists are much faster than arrays for element-wise access
+    num_up = np.bincount(down_index[down_index >= 0], minlength=num_seg).tolist()
+    upstream_count = [1] * num_seg
+    order = []
+    stack = np.flatnonzero(np.array(num_up) == 0).tolist()
+    while stack:
+        seg = stack.pop()
+        order.append(seg)
+        down = down_list[seg]
+        if down >= 0:
+            upstream_count[down] += upstream_count[seg]
+            num_up[down] -= 1
+            if num_up[down] == 0:
+                stack.append(down)
+    on_cycle = np.ones(num_seg, dtype=bool)
+    on_cycle[order] = False
+    return np.array(order, dtype='int64'), np.array(upstream_count, dtype='int64'), on_cycle
+
+# Assigns a number to each cycle
+def label_cycles(down_index, on_cycle):
+    cycle_label = np.full(len(down_index), -1, dtype='int64')
+    num_cycles = 0
+    for seg in np.flatnonzero(on_cycle):
+        if cycle_label[seg] >= 0:
+            continue
+        while cycle_label[seg] < 0:
+            cycle_label[seg] = num_cycles
+            seg = down_index[seg]
+        num_cycles += 1
+    return cycle_label, num_cycles
+
+# Finds the segment each segment drains to: an outlet, a segment with a dangling downstream ID, or the first segment
+# of a cycle. Segments are visited from outlets to headwaters, so that each downstream segment is done first.
+def find_terminal(down_index, order, on_cycle, cycle_label):
+    terminal = np.arange(len(down_index))
+    cycle_segs = np.flatnonzero(on_cycle)
+    if len(cycle_segs) > 0:
+        first_of_cycle = pd.Series(cycle_segs).groupby(cycle_label[cycle_segs]).transform('first').values
+        terminal[cycle_segs] = first_of_cycle
+    terminal = terminal.tolist()
+    down_list = down_index.tolist()
+    for seg in order[::-1].tolist():
+        if down_list[seg] >= 0:
+            terminal[seg] = terminal[down_list[seg]]
+    terminal = np.array(terminal)
+    return terminal
+
+# Runs all checks and returns a table with one row per segment
+def check_network(seg_ids, down_ids):
+    down_index = downstream_index(seg_ids, down_ids)
+    order, upstream_count, on_cycle = topological_order(down_index)
+    cycle_label, num_cycles = label_cycles(down_index, on_cycle)
+    terminal = find_terminal(down_index, order, on_cycle, cycle_label)
+    network = pd.DataFrame({'seg_id': seg_ids,
+                            'down_seg_id': down_ids,
+                            'dangling_down_id': down_index == -2,
+                            'cycle': cycle_label,
+                            'upstream_segments': upstream_count,
+                            'outlet_seg_id': seg_ids[terminal]})
+    network['component_size'] = network.groupby('outlet_seg_id')['seg_id'].transform('size')
+    return network
+
+# Finds new downstream IDs that repair the network
+def repair_network(seg_ids, down_ids, outlet_ids):
+    down_ids = down_ids.copy()
+
+    # Requested outlets and dangling downstream IDs
+    down_ids[np.isin(seg_ids, outlet_ids)] = 0
+    down_index = downstream_index(seg_ids, down_ids)
+    down_ids[down_index == -2] = 0
+
+    # Remaining cycles; the segment with the most upstream segments becomes the outlet
+    down_index[down_index == -2] = -1
+    _, upstream_count, on_cycle = topological_order(down_index)
+    cycle_label, num_cycles = label_cycles(down_index, on_cycle)
+    if num_cycles > 0:
+        cycle_segs = pd.DataFrame({'seg': np.flatnonzero(on_cycle),
+                                   'cycle': cycle_label[on_cycle],
+                                   'upstream_segments': upstream_count[on_cycle]})
+        new_outlets = cycle_segs.loc[cycle_segs.groupby('cycle')['upstream_segments'].idxmax(), 'seg'].values
+        down_ids[new_outlets] = 0
+
+    return down_ids
+
+
+# --- Main code
+if __name__ == '__main__':
+
+    # Arguments
+    repair = len(sys.argv) > 1 and sys.argv[1] == 'repair'
+    if len(sys.argv) > 1 and not repair:
+        sys.exit('Usage: python MIZUROUTE_validate_network_topology.py [optional: repair]')
+
+    # --- Find location of river network shapefile
+    # River network shapefile path & name
+    river_network_path = read_from_control(controlFolder/controlFile,'river_network_shp_path')
+    river_network_name = read_from_control(controlFolder/controlFile,'river_network_shp_name')
+
+    # Specify default path if needed
+    if river_network_path == 'default':
+        river_network_path = make_default_path('shapefiles/river_network') # outputs a Path()
+    else:
+        river_network_path = Path(river_network_path) # make sure a user-specified path is a Path()
+
+    # Find the field names we're after
+    river_seg_id      = read_from_control(controlFolder/controlFile,'river_network_shp_segid')
+    river_down_seg_id = read_from_control(controlFolder/controlFile,'river_network_shp_downsegid')
+
+    # --- Find if we need to enforce any segments as outlet(s)
+    river_outlet_ids = read_from_control(controlFolder/controlFile,'settings_mizu_make_outlet')
+    if 'n/a' in river_outlet_ids:
+        river_outlet_ids = []
+    else:
+        river_outlet_ids = [int(outlet_id) for outlet_id in river_outlet_ids.split(',')]
+
+    # --- Check the network
+    # Load the data
+    shp = gpd.read_file(river_network_path/river_network_name)
+    seg_ids = shp[river_seg_id].values.astype('int64')
+    down_ids = shp[river_down_seg_id].values.astype('int64')
+    if len(np.unique(seg_ids)) < len(seg_ids):
+        sys.exit('Error: {} contains duplicate values of {}'.format(river_network_name, river_seg_id))
+    for outlet_id in river_outlet_ids:
+        if outlet_id not in seg_ids:
+            print('outlet_id {} not found in {}'.format(outlet_id,river_seg_id))
+
+    # Run the checks
+    network = check_network(seg_ids, down_ids)
+    is_outlet = (network['seg_id'].values == network['outlet_seg_id'].values) & (network['cycle'].values < 0)
+    if len(river_outlet_ids) > 0:
+        is_unexpected = is_outlet & ~np.isin(seg_ids, river_outlet_ids)
+    else:
+        is_unexpected = is_outlet.copy()
+        if is_outlet.any():
+            is_unexpected[network.loc[is_outlet,'component_size'].idxmax()] = False
+    network['unexpected_outlet'] = is_unexpected
+    print('Checked {} segments in {}/{}:'.format(len(shp), river_network_path, river_network_name))
+    print(' - {} segment(s) in {} cycle(s)'.format((network['cycle'] >= 0).sum(), network['cycle'].max()+1))
+    print(' - {} segment(s) with a dangling downstream ID'.format(network['dangling_down_id'].sum()))
+    print(' - {} component(s) draining to an outlet, of which {} to an unexpected outlet'.format(
+          is_outlet.sum(), is_unexpected.sum()))
+    largest = network[is_outlet].sort_values('component_size', ascending=False).head(5)
+    for seg_id,size in zip(largest['seg_id'], largest['component_size']):
+        print('   outlet {} drains {} segment(s)'.format(seg_id, size))
+
+    # Store the segments with a problem
+    problems = network[(network['cycle'] >= 0) | network['dangling_down_id'] | network['unexpected_outlet']]
+    problems_file = river_network_path / (Path(river_network_name).stem + '_network_problems.csv')
+    problems.to_csv(problems_file, index=False)
+    print('Segments with a problem stored in {}'.format(problems_file))
+
+    # --- Repair the network
+    if repair:
+        new_down_ids = repair_network(seg_ids, down_ids, river_outlet_ids)
+        changed = new_down_ids != down_ids
+        if changed.any():
+            print('About to set the downstream ID of {} segment(s) to 0 in {}/{}.'.format(changed.sum(),river_network_path,river_network_name))
+            shp[river_down_seg_id] = new_down_ids.astype(shp[river_down_seg_id].dtype)
+            shp.to_file(river_network_path/river_network_name)
+        else:
+            print('No repairs needed in {}/{}.'.format(river_network_path,river_network_name))
@@ -0,0 +1,201 @@
+# Check that the HRU and GRU IDs in all SUMMA inputs are consistent.
+# Reads only the ID variables from the attributes, initial conditions, trial parameter and forcing files
+# and checks that:
+# - hruId and gruId values in the attributes file are unique;
+# - every HRU belongs to a GRU in the attributes file (hru2gruId) and every GRU contains at least one HRU;
+# - the HRUs of each GRU are stored contiguously and in the same order as the GRUs (warning only);
+# - downHRUindex points to 0 or to an HRU inside the same GRU;
+# - hruId (and gruId where present) in the initial conditions and trial parameter files match the 
+#   attributes file in both values and order;
+# - every file in the forcing file list exists and has the same hruId values in the same order.
+#
+# Usage: python SUMMA_check_input_consistency.py
+# Locations are taken from control_active.txt. The script exits with a non-zero status if any check 
+# fails, so it can be used to stop a job submission script before any array tasks are started.
+
+# modules
+import sys
+import numpy as np
+import netCDF4 as nc4
+from pathlib import Path
+
+# --- Control file handling
+# Easy access to control file folder
+controlFolder = Path('../0_control_files')
+
+# Store the name of the 'active' file in a variable
+controlFile = 'control_active.txt'
+
+# Function to extract a given setting from the control file
+def read_from_control( file, setting ):
+    
+    # Open 'control_active.txt' and ...
+    with open(file) as contents:
+        for line in contents:
+            
+            # ... find the line with the requested setting
+            if setting in line and not line.startswith('#'):
+                break
+    
+    # Extract the setting's value
+    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
+    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
+    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
+       
+    # Return this value    
+    return substring
+    
+# Function to specify a default path
+def make_default_path(suffix):
+    
+    # Get the root path
+    rootPath = Path( read_from_control(controlFolder/controlFile,'root_path') )
+    
+    # Get the domain folder
+    domainName = read_from_control(controlFolder/controlFile,'domain_name')
+    domainFolder = 'domain_' + domainName
+    
+    # Specify the forcing path
+    defaultPath = rootPath / domainFolder / suffix
+    
+    return defaultPath
+
+
+# --- Find the SUMMA input files
+# Settings path
+settings_path = read_from_control(controlFolder/controlFile,'settings_summa_path')
+
+# Specify default path if needed
+if settings_path == 'default':
+    settings_path = make_default_path('settings/SUMMA') # outputs a Path()
+else:
+    settings_path = Path(settings_path) # make sure a user-specified path is a Path()
+    
+# Forcing path
+forcing_path = read_from_control(controlFolder/controlFile,'forcing_summa_path')
+
+# Specify default path if needed
+if forcing_path == 'default':
+    forcing_path = make_default_path('forcing/4_SUMMA_input') # outputs a Path()
+else:
+    forcing_path = Path(forcing_path) # make sure a user-specified path is a Path()
+    
+# File names
+attribute_name  = read_from_control(controlFolder/controlFile,'settings_summa_attributes')
+coldstate_name  = read_from_control(controlFolder/controlFile,'settings_summa_coldstate')
+trialParam_name = read_from_control(controlFolder/controlFile,'settings_summa_trialParams')
+forcing_list    = read_from_control(controlFolder/controlFile,'settings_summa_forcing_list')
+
+
+# --- Function definition
+# Keeps track of failed checks; warnings are reported but do not count as failures
+errors = []
+def report(ok, message, warning_only=False):
+    if ok:
+        print('  OK     ' + message)
+    elif warning_only:
+        print('  WARN   ' + message)
+    else:
+        print('  ERROR  ' + message)
+        errors.append(message)
+    return ok
+
+# Reads only the requested ID variables from a netCDF file; returns None for variables that do not exist
+def read_ids(file, variables):
+    with nc4.Dataset(file) as src:
+        return [np.asarray(src[var][:]).astype('int64') if var in src.variables else None for var in variables]
+
+# Describes how two ID arrays differ
+def describe_difference(ids, reference):
+    missing = np.setdiff1d(reference, ids)
+    extra = np.setdiff1d(ids, reference)
+    if len(missing) > 0 or len(extra) > 0 or len(ids) != len(reference):
+        return '{} IDs missing (e.g. {}), {} unknown IDs (e.g. {}), {} values vs {} in attributes'.format(
+               len(missing), missing[:5].tolist(), len(extra), extra[:5].tolist(), len(ids), len(reference))
+    first = np.flatnonzero(ids != reference)[0]
+    return 'same IDs but different order; first difference at index {} ({} vs {} in attributes)'.format(
+           first, ids[first], reference[first])
+
+# Compares an ID array with the reference from the attributes file
+def check_same_ids(ids, reference, name):
+    same = len(ids) == len(reference) and np.array_equal(ids, reference)
+    if same:
+        return report(True, name + ' matches attributes')
+    return report(False, name + ': ' + describe_difference(ids, reference))
+
+
+# --- Attributes file
+print('Checking {}'.format(settings_path/attribute_name))
+hru_ids, gru_ids, hru2gru, down_hru = read_ids(settings_path/attribute_name, ['hruId','gruId','hru2gruId','downHRUindex'])
+
+# Unique IDs
+report(len(np.unique(hru_ids)) == len(hru_ids), 'hruId values are unique ({} HRUs)'.format(len(hru_ids)))
+report(len(np.unique(gru_ids)) == len(gru_ids), 'gruId values are unique ({} GRUs)'.format(len(gru_ids)))
+
+# GRU/HRU nesting
+report(np.isin(hru2gru, gru_ids).all(), 
+       'all hru2gruId values are GRUs in gruId ({} are not)'.format((~np.isin(hru2gru, gru_ids)).sum()))
+report(np.isin(gru_ids, hru2gru).all(), 
+       'all GRUs contain at least one HRU ({} do not)'.format((~np.isin(gru_ids, hru2gru)).sum()))
+
+# HRUs of each GRU should be contiguous and in GRU order, so that a subset of GRUs (SUMMA's -g option) 
+# corresponds to a contiguous block of HRUs in the forcing files
+gru_order = np.argsort(gru_ids)
+gru_pos = gru_order[np.searchsorted(gru_ids[gru_order], hru2gru).clip(0, len(gru_ids)-1)]
+report((np.diff(gru_pos) >= 0).all(), 'HRUs are grouped by GRU in the same order as gruId', warning_only=True)
+
+# downHRUindex is either 0 or an HRU inside the same GRU
+if down_hru is not None:
+    hru_order = np.argsort(hru_ids)
+    down_pos = hru_order[np.searchsorted(hru_ids[hru_order], down_hru).clip(0, len(hru_ids)-1)]
+    is_valid = (down_hru == 0) | ((hru_ids[down_pos] == down_hru) & (hru2gru[down_pos] == hru2gru))
+    report(is_valid.all(), 'downHRUindex is 0 or an HRU in the same GRU ({} are not)'.format((~is_valid).sum()))
+
+    
+# --- Initial conditions and trial parameters
+for name in [coldstate_name, trialParam_name]:
+    print('Checking {}'.format(settings_path/name))
+    if not report((settings_path/name).is_file(), name + ' exists'):
+        continue
+    file_hru, file_gru = read_ids(settings_path/name, ['hruId','gruId'])
+    if report(file_hru is not None, name + ' contains hruId'):
+        check_same_ids(file_hru, hru_ids, name + ' hruId')
+    if file_gru is not None:
+        check_same_ids(file_gru, gru_ids, name + ' gruId')
+        
+        
+# --- Forcing files
+print('Checking forcing files in {}'.format(settings_path/forcing_list))
+with open(settings_path/forcing_list) as f:
+    forcing_files = [line.strip().strip("'").strip('"') for line in f if line.strip()]
+report(len(forcing_files) > 0, '{} files in forcing file list'.format(len(forcing_files)))
+
+# Check that all files exist
+is_present = np.array([(forcing_path/file).is_file() for file in forcing_files], dtype=bool)
+report(is_present.all(), 'all forcing files exist in {} ({} missing{})'.format(
+       forcing_path, (~is_present).sum(), ', e.g. ' + forcing_files[np.flatnonzero(~is_present)[0]] if not is_present.all() else ''))
+
+# Check the hruId order in each file; files with the same IDs as the previous file are not reported separately
+previous, previous_ok = None, False
+num_ok = 0
+for file in np.array(forcing_files)[is_present]:
+    file_hru, = read_ids(forcing_path/file, ['hruId'])
+    if file_hru is None:
+        is_ok = report(False, file + ' has no hruId variable')
+    elif previous is not None and np.array_equal(file_hru, previous):
+        is_ok = previous_ok
+    else:
+        is_ok = check_same_ids(file_hru, hru_ids, file)
+    num_ok += is_ok
+    previous, previous_ok = file_hru, is_ok
+report(num_ok == is_present.sum(), '{} out of {} forcing files have the same hruId order as attributes'.format(num_ok, is_present.sum()))
+
+
+# --- Summary
+if errors:
+    print('\n{} check(s) failed:'.format(len(errors)))
+    for message in errors:
+        print('  ' + message)
+    sys.exit(1)
+else:
+    print('\nAll checks passed.')
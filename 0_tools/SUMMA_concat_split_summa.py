@@ -1,8 +1,15 @@
 # concatenate the outputs of a split domain summa run
 # written originally by Manab Saharia, updated by Hongli Liu and Andy Wood
 # modified by W. Knoben (2021)
+#
+# The output file is created once, with the gru and hru dimensions sized from the headers of all input files. The
+# gru and hru variables of each input file are then copied straight into their place in the output file, in blocks of
+# time steps, so that memory use is limited to one block of one variable regardless of the number and size of the
+# input files. Input files are ordered by their first GRU (from the _G[start]-[end] part of SUMMA's file names) if all
+# names have this, and by name otherwise. Files of blocks that were re-run in smaller blocks are skipped, and the script
+# stops if the GRU ranges of the remaining files overlap or leave gaps.
 
-
+import re
 import sys
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
@@ -11,100 +18,118 @@ from glob import glob
 import netCDF4 as nc
 import numpy as np
 
-# --- check args
-if len(sys.argv) != 4:
-    print("Usage: %s <summa_output_dir> <summa_output_file_pattern> <summa_output_filename>" % sys.argv[0])
-    sys.exit(0)
-# otherwise continue
-ncdir        = sys.argv[1]  # eg './v1/06280300/'
-file_pattern = sys.argv[2]  # eg '*_G*_day.nc'
-summa_runoff = sys.argv[3]  # eg 'gage_06280300_day.nc'
-
-# get list of split summa output files (hardwired pattern)
-outfilelist = glob((ncdir+'/'+file_pattern))
-outfilelist.sort()   # not needed, perhaps
-
-# count the number of gru and hru
-gru_num = 0
-hru_num = 0
-for file in outfilelist:
-    # f = nc.Dataset(os.path.join(ncdir, file))
-    f = nc.Dataset(file)
-    gru_num = gru_num+len(f.dimensions['gru'])
-    hru_num = hru_num+len(f.dimensions['hru'])
-
-# write output    
-# with nc.Dataset(os.path.join(ncdir, outfilelist[0])) as src:
-with nc.Dataset(outfilelist[0]) as src:
-    with nc.Dataset(os.path.join(ncdir, summa_runoff), "w") as dst:
+# --- Function definitions
+# Orders split output files by their first GRU, or by name if the GRUs cannot be found in all file names.
+# Files of a block that was re-run in smaller blocks (e.g. _G7-9 next to _G7-7, _G8-8 and _G9-9) are skipped if the
+# smaller blocks cover all its GRUs. Stops if the remaining GRU ranges overlap or leave gaps between them.
+def sort_split_files(files):
+    names = [re.search(r'_G(\d+)-(\d+)', os.path.basename(file)) for file in files]
+    if not all(names):
+        return sorted(files)
+    ranges = sorted((int(name.group(1)), int(name.group(2)), file) for name,file in zip(names, files))
+
+    # Skip files whose GRUs are all covered by files of smaller blocks
+    kept = []
+    for start,end,file in ranges:
+        covered = np.zeros(end-start+1, dtype=bool)
+        for other_start,other_end,other in ranges:
+            if other_end-other_start < end-start and other_start <= end and other_end >= start:
+                covered[max(other_start,start)-start:min(other_end,end)-start+1] = True
+        if covered.all():
+            print('Skipping %s: its GRUs are in files of smaller blocks that were run again' % file)
+        else:
+            kept.append((start,end,file))
+
+    # Check that the remaining files follow on from each other
+    for (_,end,file),(start,_,next_file) in zip(kept[:-1], kept[1:]):
+        if start <= end:
+            sys.exit('Error: GRU ranges of %s and %s overlap. Remove the file that should not be used.' % (file, next_file))
+        if start > end+1:
+            sys.exit('Error: GRUs %d-%d are missing between %s and %s' % (end+1, start-1, file, next_file))
+    return [file for _,_,file in kept]
+
+# Copies a variable into the output variable at the given offset along one axis, in blocks along the first axis
+def copy_into(src_var, dst_var, axis, offset, max_values=5e7):
+    shape = src_var.shape
+    count = shape[axis]
+    if axis == 0 or len(shape) == 1:
+        blocks = [slice(None)]
+    else:
+        step = max(1, int(max_values // np.prod(shape[1:])))
+        blocks = [slice(start, min(start+step, shape[0])) for start in range(0, shape[0], step)]
+    for block in blocks:
+        target = [slice(None)] * len(shape)
+        target[axis] = slice(offset, offset+count)
+        if axis != 0:
+            target[0] = block
+        dst_var[tuple(target)] = src_var[block]
+
+# Concatenates split output files along the gru and hru dimensions
+def concat_split_files(files, output_file, max_values=5e7):
+
+    # count the number of gru and hru in each file
+    gru_count = []
+    hru_count = []
+    for file in files:
+        with nc.Dataset(file) as f:
+            gru_count.append(len(f.dimensions['gru']))
+            hru_count.append(len(f.dimensions['hru']))
+    offsets = {'gru': np.concatenate([[0], np.cumsum(gru_count)]),
+               'hru': np.concatenate([[0], np.cumsum(hru_count)])}
+
+    # create the output file from the first file's header
+    with nc.Dataset(files[0]) as src, nc.Dataset(output_file, "w") as dst:
 
         # copy dimensions
+        dst.setncatts(src.__dict__)
         for name, dimension in src.dimensions.items():
-            if name == 'gru':
-                dst.createDimension(name, gru_num)
-            elif name == 'hru':
-                dst.createDimension(name, hru_num)
+            if name in offsets:
+                dst.createDimension(name, offsets[name][-1])
             else:
                 dst.createDimension(name, (len(dimension) if not dimension.isunlimited() else None))
 
-        # copy variable attributes all at once via dictionary
-        gru_vars = [] # variable name, gru axis in variable dimension for concatenation. 
-        hru_vars = []
+        # create variables; variables without gru or hru dimension (e.g. time) are the same in all files
+        split_vars = [] # variable name, concatenation dimension, axis of that dimension
         for name, variable in src.variables.items():
-            x = dst.createVariable(name, variable.datatype, variable.dimensions)               
-            dst[name].setncatts(src[name].__dict__)
-            # Note here the variable dimension name is the same, but size has been updated for gru and hru.
-            
-            # Assign different values depending on dimension
+            fill_value = variable.getncattr('_FillValue') if '_FillValue' in variable.ncattrs() else None
+            dst.createVariable(name, variable.datatype, variable.dimensions, fill_value=fill_value)
+            dst[name].setncatts({att: variable.getncattr(att) for att in variable.ncattrs() if att != '_FillValue'})
             dims = variable.dimensions
             if 'gru' in dims:
-                gru_vars.append([name,dims.index('gru')])                
+                split_vars.append([name, 'gru', dims.index('gru')])
             elif 'hru' in dims:
-                hru_vars.append([name,dims.index('hru')]) 
+                split_vars.append([name, 'hru', dims.index('hru')])
             else:
-                dst[name][:]=src[name][:]                
-
-        # read values for gru and hru dimensioned variables
-        Dict = {} 
-        gru_vars_num = len(gru_vars)
-        hru_vars_num = len(hru_vars)
-        for i,file in enumerate(outfilelist):
-            
+                dst[name][:] = src[name][:]
+
+        # copy the gru and hru variables of each file into place
+        for i,file in enumerate(files):
             print("combining file %d %s" % (i,file))
-            # f = nc.Dataset(os.path.join(ncdir, file))
-            f = nc.Dataset(file)
-            for j in range(gru_vars_num):
-                gru_var_name = gru_vars[j][0]
-                dim_index = gru_vars[j][1]
-                data=f[gru_var_name][:]
-                if i == 0:
-                    Dict[gru_var_name]=data
-                else:
-                    Dict[gru_var_name]=np.concatenate((Dict[gru_var_name],data),axis=dim_index)
-
-            for j in range(hru_vars_num):
-                hru_var_name = hru_vars[j][0]
-                dim_index = hru_vars[j][1]
-                data=f[hru_var_name][:]
-                if i == 0:
-                    Dict[hru_var_name]=data
-                else:
-                    Dict[hru_var_name]=np.concatenate((Dict[hru_var_name],data),axis=dim_index)
-                    
-        # assign values for gru and hru dimensioned variables
-        for j in range(gru_vars_num):
-            dst.variables[gru_vars[j][0]][:] = Dict[gru_vars[j][0]]
-        for j in range(hru_vars_num):
-            dst.variables[hru_vars[j][0]][:] = Dict[hru_vars[j][0]]
-        
-        # Temporarily create gruId from hruId
-        #if gru_num == hru_num:
-        #    gruId = dst.createVariable('gruId', dst['hruId'].datatype, ('gru',))
-        #    gruId.long_name = "ID of group of response unit (GRU)"
-        #    gruId.units = dst['hruId'].units
-        #    dst.variables['gruId'][:] = dst.variables['hruId'][:] 
-        #else:
-        #    print('Warning: gruId variable cannot be created since it has different size from hruId')  
-            
-print("wrote output: %s" % (ncdir+summa_runoff))
-print('Done')
+            with nc.Dataset(file) as f:
+                for name, dim, axis in split_vars:
+                    copy_into(f[name], dst[name], axis, offsets[dim][i], max_values)
+
+
+# --- Main code
+if __name__ == '__main__':
+
+    # --- check args
+    if len(sys.argv) != 4:
+        print("Usage: %s <summa_output_dir> <summa_output_file_pattern> <summa_output_filename>" % sys.argv[0])
+        sys.exit(0)
+    # otherwise continue
+    ncdir        = sys.argv[1]  # eg './v1/06280300/'
+    file_pattern = sys.argv[2]  # eg '*_G*_day.nc'
+    summa_runoff = sys.argv[3]  # eg 'gage_06280300_day.nc'
+
+    # get list of split summa output files, excluding the output file in case it matches the pattern
+    outfilelist = [file for file in glob((ncdir+'/'+file_pattern)) if os.path.basename(file) != summa_runoff]
+    if len(outfilelist) == 0:
+        sys.exit('Error: no files found matching %s' % (ncdir+'/'+file_pattern))
+    outfilelist = sort_split_files(outfilelist)
+
+    # write output
+    concat_split_files(outfilelist, os.path.join(ncdir, summa_runoff))
+
+    print("wrote output: %s" % os.path.join(ncdir, summa_runoff))
+    print('Done')
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+'''Stand-in for the SUMMA executable, to test run scripts without compiling or running SUMMA.
+Accepts the same command line arguments as SUMMA (-m, -g, -r) and creates files with SUMMA's names:
+- Output:  [outputPath][outFilePrefix]_G[start]-[end]_day.nc, with variables time, hruId, gruId,
+           averageRoutedRunoff and scalarSWE;
+- Restart: [outputPath][outFilePrefix]_restart_[YYYYMMDDHH]_G[start]-[end].nc, a copy of the initial conditions
+           of the selected HRUs (only with -r e);
+- Log:     printed to screen in SUMMA's format, ending with SUMMA's success statement.
+
+Simulated runoff is a seasonal cycle that is scaled by the trial parameter values, so that different trial parameter
+files give different results. Environment variables can be used to mimic model behaviour:
+- FAKE_SUMMA_SECONDS: seconds to wait per simulated year (default: 0);
+- FAKE_SUMMA_FAIL_GRU: GRU index (1-based) that causes a SUMMA error if it is part of the run (default: none).
+Usage: python SUMMA_fake_executable.py -g [start GRU] [number of GRUs] -r [e] -m [path/to/fileManager.txt]'''
+
+# Modules
+import os
+import re
+import sys
+import time
+import numpy as np
+import pandas as pd
+import netCDF4 as nc4
+from datetime import datetime
+
+# --- Function definitions
+# Reads all settings from the file manager
+def read_file_manager(file):
+    settings = {}
+    with open(file) as contents:
+        for line in contents:
+            if "'" in line:
+                settings[line.split()[0]] = re.search(r"'(.*?)'", line).group(1)
+    return settings
+
+# Stops with SUMMA's error format
+def fatal_error(message):
+    print(' FATAL ERROR: ' + message)
+    sys.exit(1)
+
+
+# --- Main code
+if __name__ == '__main__':
+
+    # Command line arguments
+    args = sys.argv[1:]
+    if '-m' not in args:
+        fatal_error('summa_fake/file manager not specified (-m)')
+    file_manager = args[args.index('-m')+1]
+    restart = args[args.index('-r')+1] if '-r' in args else 'never'
+
+    # Settings
+    fm = read_file_manager(file_manager)
+    settings_path = fm['settingsPath']
+    output_path = fm['outputPath']
+    prefix = fm['outFilePrefix']
+    sim_start = datetime.strptime(fm['simStartTime'], '%Y-%m-%d %H:%M')
+    sim_end = datetime.strptime(fm['simEndTime'], '%Y-%m-%d %H:%M')
+    started = time.time()
+    print(' initial date/time = ' + datetime.now().strftime('%Y-%m-%d  %H:%M:%S.%f')[:-3], flush=True)
+
+    # GRUs and HRUs to simulate
+    with nc4.Dataset(settings_path + fm['attributeFile']) as att:
+        gru_ids = att['gruId'][:]
+        hru_ids = att['hruId'][:]
+        hru2gru = att['hru2gruId'][:]
+    if '-g' in args:
+        gru_start = int(args[args.index('-g')+1])
+        gru_count = int(args[args.index('-g')+2])
+        suffix = '_G{}-{}'.format(gru_start, gru_start+gru_count-1)
+    else:
+        gru_start, gru_count, suffix = 1, len(gru_ids), ''
+    if gru_start < 1 or gru_start+gru_count-1 > len(gru_ids):
+        fatal_error('summa_fake/startGRU and numGRU outside the range of GRUs in the attributes file')
+    run_gru = gru_ids[gru_start-1:gru_start-1+gru_count]
+    run_hru = np.flatnonzero(np.isin(hru2gru, run_gru))
+    print(' startGRU = {}; numGRU = {}; number of HRUs = {}'.format(gru_start, gru_count, len(run_hru)))
+
+    # Trial parameters scale the simulated runoff
+    scale = 1.0
+    with nc4.Dataset(settings_path + fm['trialParamFile']) as tp:
+        for name,var in tp.variables.items():
+            if name not in ('hruId','gruId'):
+                scale *= 1 + 0.1 * np.log10(abs(float(var[:].mean())) + 1)
+
+    # Simulate
+    days = pd.date_range(sim_start.date(), sim_end.date(), freq='D')
+    print(' Created output file: ' + output_path + prefix + suffix + '_day.nc')
+    fail_gru = int(os.environ.get('FAKE_SUMMA_FAIL_GRU', default=0))
+    seconds_per_day = float(os.environ.get('FAKE_SUMMA_SECONDS', default=0)) / 365
+    for ii,day in enumerate(days):
+        print('{:4d} {:2d} {:2d} {:2d} {:2d}'.format(day.year, day.month, day.day, 0, 0), flush=True)
+        if ii == len(days)//2 and gru_start <= fail_gru < gru_start+gru_count:
+            fatal_error('summa_fake/coupled_em/large water balance error for GRU {}'.format(fail_gru))
+        time.sleep(seconds_per_day)
+
+    # Write the output
+    doy = days.dayofyear.values[:,np.newaxis]
+    runoff = scale * 1e-8 * (1.5 + np.sin(2*np.pi*doy/365.25)) * (1 + 0.1*np.arange(len(run_gru)))[np.newaxis,:]
+    with nc4.Dataset(output_path + prefix + suffix + '_day.nc', 'w', format='NETCDF4') as out:
+        out.createDimension('time', None)
+        out.createDimension('hru', len(run_hru))
+        out.createDimension('gru', len(run_gru))
+        out.createVariable('time', 'f8', ('time',))
+        out['time'].setncatts({'units': 'seconds since 1990-1-1 0:0:0.0 -0:00', 'calendar': 'standard'})
+        out['time'][:] = nc4.date2num(days.to_pydatetime(), 'seconds since 1990-1-1 0:0:0.0 -0:00', 'standard')
+        out.createVariable('hruId', 'i8', ('hru',))
+        out['hruId'][:] = hru_ids[run_hru]
+        out.createVariable('gruId', 'i8', ('gru',))
+        out['gruId'][:] = run_gru
+        out.createVariable('averageRoutedRunoff', 'f8', ('time','gru'), fill_value=-9999.)
+        out['averageRoutedRunoff'].setncatts({'long_name': 'routed runoff in each GRU (instant)', 'units': 'm s-1'})
+        out['averageRoutedRunoff'][:] = runoff
+        out.createVariable('scalarSWE', 'f8', ('time','hru'), fill_value=-9999.)
+        out['scalarSWE'].setncatts({'long_name': 'snow water equivalent (instant)', 'units': 'kg m-2'})
+        out['scalarSWE'][:] = np.zeros((len(days),len(run_hru)))
+
+    # Write the restart file from the initial conditions of the simulated HRUs
+    if restart == 'e':
+        stamp = sim_end.strftime('%Y%m%d%H')
+        with nc4.Dataset(settings_path + fm['initConditionFile']) as src, \
+             nc4.Dataset(output_path + prefix + '_restart_' + stamp + suffix + '.nc', 'w', format='NETCDF4') as des:
+            for name,dim in src.dimensions.items():
+                if name not in ('hru','gru'):
+                    des.createDimension(name, len(dim))
+            des.createDimension('hru', len(run_hru))
+            des.createDimension('gru', len(run_gru))
+            for name,var in src.variables.items():
+                if name in ('hruId','gruId') or 'gru' in var.dimensions:
+                    continue
+                des.createVariable(name, var.datatype, var.dimensions)
+                des[name][:] = np.take(var[:], run_hru, axis=var.dimensions.index('hru')) if 'hru' in var.dimensions else var[:]
+
+    # Timing information and success statement, in SUMMA's format
+    elapsed = time.time() - started
+    print(' elapsed time = {:12.3f} s'.format(elapsed))
+    print('           or {:12.5f} m'.format(elapsed/60))
+    print('           or {:12.5f} h'.format(elapsed/3600))
+    print('           or {:12.5f} d'.format(elapsed/86400))
+    print('')
+    print(' number threads =  1')
+    print('')
+    print(' FORTRAN STOP: finished simulation successfully.')
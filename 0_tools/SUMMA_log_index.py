@@ -0,0 +1,110 @@
+# Index the SUMMA logs in a folder
+# Reads the end of each SUMMA log in a folder and stores the result of the run in a table in the same folder
+# ('_log_index.csv'), with one row per log:
+# - file, mtime, size: name, modification time [ns] and size [bytes] of the log when it was read;
+# - status: 'success' if the log ends with SUMMA's success statement, 'SUMMA error' if it contains 'FATAL ERROR', and
+#   'early termination' otherwise (e.g. the job ran out of time or memory, or the run has not finished yet);
+# - message: the line that shows the status;
+# - time_total, time_setup, time_init, time_restart, time_read, time_physics, time_write: elapsed times [s] that SUMMA
+#   prints at the end of a successful run (empty if not found).
+# When the index is updated, only logs that are new or have a different modification time or size than in the table are
+# read again, in parallel on the number of CPUs given by SLURM_CPUS_PER_TASK. Logs that no longer exist are removed from
+# the table. Updating the index of a folder with many logs is therefore fast once most runs have finished. Files with a
+# name that starts with '_', such as the summary of SUMMA_summarize_logs.py, are not treated as logs.
+#
+# The functions in this script are used by SUMMA_summarize_logs.py, SUMMA_plot_computational_times.py and the scripts
+# that run SUMMA. Running this script on its own updates the index and prints the number of logs with each status.
+#
+# Usage: python SUMMA_log_index.py [log_folder] [optional: extension of log files (default: .txt)]
+
+# Modules
+import os
+import re
+import sys
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+# Settings
+index_name = '_log_index.csv'
+timings = ['total','setup','init','restart','read','physics','write']
+
+
+# --- Function definitions
+# Returns the last part of a file as a list of non-empty lines
+def tail(file, _buffer=8192):
+    with open(file, 'rb') as f:
+        f.seek(max(0, os.fstat(f.fileno()).st_size - _buffer))
+        text = f.read().decode(errors='replace')
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+# Checks if a log file reports a successful simulation
+def is_successful(log_file):
+    if not Path(log_file).is_file():
+        return False
+    return any('successfully' in line for line in tail(log_file, 1024)[-2:])
+
+# Status, message and elapsed times of one SUMMA log
+def parse_log(log_file):
+    lines = tail(log_file)
+    result = {'status': 'early termination', 'message': lines[-1] if lines else 'empty log'}
+    result.update({'time_' + timing: np.nan for timing in timings})
+    if any('successfully' in line for line in lines[-2:]):
+        result.update({'status': 'success', 'message': lines[-1]})
+        for line in lines[-40:]:
+            elapsed = re.match(r'elapsed (\w+)\s*=\s*([\d\.Ee+-]+)', line) if line.startswith('elapsed') else None
+            if elapsed and 'time_' + elapsed.group(1).replace('time','total') in result:
+                result['time_' + elapsed.group(1).replace('time','total')] = float(elapsed.group(2))
+    else:
+        for line in reversed(lines):
+            if 'FATAL ERROR' in line:
+                result.update({'status': 'SUMMA error', 'message': line})
+                break
+    return result
+
+# Updates the index of the logs in a folder and returns it as a DataFrame, in order of file name
+def index_logs(folder, ext='.txt', num_processes=None, exclude=()):
+    folder = Path(folder)
+    index_file = folder / index_name
+    if num_processes is None:
+        num_processes = int(os.environ.get('SLURM_CPUS_PER_TASK',default=1))
+
+    # Logs in the folder, with their modification time and size
+    logs = pd.DataFrame([(entry.name, entry.stat().st_mtime_ns, entry.stat().st_size) for entry in os.scandir(folder)
+                         if entry.is_file() and entry.name.endswith(ext) and not entry.name.startswith('_') and entry.name not in exclude],
+                        columns=['file','mtime','size'])
+
+    # Logs that are in the index and have not changed since
+    if index_file.is_file():
+        index = pd.read_csv(index_file, keep_default_na=False, na_values=[''])
+        index = logs.merge(index, on=['file','mtime','size'], how='inner')
+    else:
+        index = logs.iloc[:0].copy()
+    new = logs[~logs['file'].isin(index['file'])]
+
+    # Read the new and changed logs
+    if len(new) > 0:
+        with ThreadPoolExecutor(max_workers=num_processes) as executor:
+            results = list(executor.map(parse_log, [folder/file for file in new['file']]))
+        new = pd.concat([new.reset_index(drop=True), pd.DataFrame(results)], axis=1)
+        index = new if len(index) == 0 else pd.concat([index, new], ignore_index=True)
+    columns = ['file','mtime','size','status','message'] + ['time_' + timing for timing in timings]
+    index = index.reindex(columns=columns).sort_values('file').reset_index(drop=True)
+    index.to_csv(index_file, index=False)
+    return index
+
+
+# --- Main code
+if __name__ == '__main__':
+
+    # Arguments
+    if len(sys.argv) < 2:
+        sys.exit('Error: no input folder specified')
+    folder = sys.argv[1]
+    ext = sys.argv[2] if len(sys.argv) > 2 else '.txt'
+
+    index = index_logs(folder, ext)
+    print('Indexed {} logs in {}'.format(len(index), folder))
+    for status,count in index['status'].value_counts().items():
+        print('{:<18} {}'.format(status, count))
@@ -0,0 +1,216 @@
+# Divide the GRUs into blocks of similar computational cost for SUMMA array runs
+# SUMMA's -g argument runs a block of consecutive GRUs. Blocks with the same number of GRUs can have very different
+# run times, because the cost per GRU depends on e.g. the number of HRUs, snow and terrain. This script estimates the
+# cost of each GRU and divides the GRUs into blocks of consecutive GRUs so that the largest block cost is as small as
+# possible. The cost of each GRU is estimated from one of the following sources:
+# - 'hru': the number of HRUs in each GRU (default);
+# - Output files of a previous run (.nc) that contain variable 'wallClockTime': the sum over time per GRU. HRU values
+#   are summed per GRU;
+# - A folder with SUMMA logs of a previous run with -g: the elapsed time of each successful run, divided over the GRUs
+#   of the run in proportion to their number of HRUs. The GRUs of each log are found from the log name (..._G[start]-
+#   [end]...), from the array ID in log names summa_log_[array_id].txt (as written by
+#   6_model_runs/1_run_summa_as_array.sh) and the existing 'gru_blocks.txt' that the previous run used, or from a
+#   line in the log that contains 'startGRU = [start]' and 'numGRU = [count]'.
+# GRUs without a cost in the output files or logs are given the median cost per HRU of the other GRUs times their
+# number of HRUs.
+#
+# The blocks are stored as a table in the SUMMA settings folder ('gru_blocks.txt'), with one row per array task:
+# array_id gru_start gru_count predicted_cost
+# Array IDs start at 1. An array job can find its block with e.g.:
+# read gru_start gru_count <<< $(awk -v id=$SLURM_ARRAY_TASK_ID '$1==id {print $2, $3}' gru_blocks.txt)
+#
+# Usage: python SUMMA_make_gru_blocks.py [number of blocks] [optional: 'hru', 'path/to/output_*.nc' or path/to/log/folder]
+
+# modules
+import re
+import sys
+import glob
+import numpy as np
+import pandas as pd
+import netCDF4 as nc4
+from pathlib import Path
+from SUMMA_log_index import index_logs
+
+# --- Control file handling
+# Easy access to control file folder
+controlFolder = Path('../0_control_files')
+
+# Store the name of the 'active' file in a variable
+controlFile = 'control_active.txt'
+
+# Function to extract a given setting from the control file
+def read_from_control( file, setting ):
+
+    # Open 'control_active.txt' and ...
+    with open(file) as contents:
+        for line in contents:
+
+            # ... find the line with the requested setting
+            if setting in line and not line.startswith('#'):
+                break
+
+    # Extract the setting's value
+    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
+    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
+    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
+
+    # Return this value
+    return substring
+
+# Function to specify a default path
+def make_default_path(suffix):
+
+    # Get the root path
+    rootPath = Path( read_from_control(controlFolder/controlFile,'root_path') )
+
+    # Get the domain folder
+    domainName = read_from_control(controlFolder/controlFile,'domain_name')
+    domainFolder = 'domain_' + domainName
+
+    # Specify the forcing path
+    defaultPath = rootPath / domainFolder / suffix
+
+    return defaultPath
+
+
+# --- Function definitions
+# Cost per GRU from 'wallClockTime' in output files; NaN for GRUs that are not in any file
+def gru_cost_from_outputs(files, gru_ids, hru_ids, hru2gru):
+    cost = np.full(len(gru_ids), np.nan)
+    gru_of_hru = dict(zip(hru_ids, hru2gru))
+    gru_index = {gru: ii for ii,gru in enumerate(gru_ids)}
+    for file in files:
+        with nc4.Dataset(file) as ds:
+            if 'wallClockTime' not in ds.variables:
+                continue
+            var = ds['wallClockTime']
+            space = 'gru' if 'gru' in var.dimensions else 'hru'
+            values = np.ma.filled(var[:].astype('float64'), 0.)
+            values = np.moveaxis(values, var.dimensions.index(space), 0).reshape(len(ds.dimensions[space]), -1).sum(axis=1)
+            if space == 'gru':
+                index = [gru_index[gru] for gru in ds['gruId'][:].astype(int)]
+            else:
+                index = [gru_index[gru_of_hru[hru]] for hru in ds['hruId'][:].astype(int)]
+            cost[index] = np.where(np.isnan(cost[index]), 0, cost[index])
+            np.add.at(cost, index, values)
+    return cost
+
+# Blocks of a previous array run as {array_id: (gru_start, gru_count)}; empty if there is no table
+def read_array_blocks(blocks_table):
+    if not Path(blocks_table).is_file():
+        return {}
+    table = pd.read_csv(blocks_table, sep=r'\s+')
+    return dict(zip(table['array_id'].astype(int), zip(table['gru_start'].astype(int), table['gru_count'].astype(int))))
+
+# GRU range of a SUMMA run with -g; None if the log does not show this
+def read_block_range(file, array_blocks=None):
+    name = re.search(r'_G(\d+)-(\d+)', Path(file).name)
+    if name:
+        return int(name.group(1)), int(name.group(2)) - int(name.group(1)) + 1
+    array_id = re.fullmatch(r'summa_log_(\d+)\.txt', Path(file).name)
+    if array_id and array_blocks and int(array_id.group(1)) in array_blocks:
+        return array_blocks[int(array_id.group(1))]
+    with open(file, errors='replace') as log:
+        line = re.search(r'startGRU\s*=\s*(\d+)\D+numGRU\s*=\s*(\d+)', log.read(65536))
+    if line is None:
+        return None
+    return int(line.group(1)), int(line.group(2))
+
+# Cost per GRU from the successful runs in a log folder; NaN for GRUs without a log
+def gru_cost_from_logs(folder, hru_count, array_blocks=None):
+    cost = np.full(len(hru_count), np.nan)
+    logs = index_logs(folder)
+    logs = logs[(logs['status'] == 'success') & logs['time_total'].notna()]
+    for file,elapsed in zip(logs['file'], logs['time_total']):
+        block = read_block_range(Path(folder)/file, array_blocks)
+        if block is None:
+            print('Skipping {}: GRUs of this log are unknown'.format(file))
+            continue
+        start, count = block
+        block_hrus = hru_count[start-1:start-1+count]
+        cost[start-1:start-1+count] = elapsed * block_hrus / block_hrus.sum()
+    return cost
+
+# Divides the GRUs into at most num_blocks blocks of consecutive GRUs with the smallest possible maximum block cost.
+# For a given maximum, blocks are filled greedily with a binary search in the cumulative cost; the smallest maximum
+# for which at most num_blocks blocks are needed is found by bisection.
+def make_blocks(cost, num_blocks):
+    cum_cost = np.concatenate([[0.], np.cumsum(cost)])
+
+    def fill_blocks(max_cost):
+        starts = [0]
+        while starts[-1] < len(cost):
+            end = np.searchsorted(cum_cost, cum_cost[starts[-1]] + max_cost, side='right') - 1
+            starts.append(max(end, starts[-1]+1))
+            if len(starts) > num_blocks+1:
+                return None
+        return starts
+
+    low, high = max(cost.max(), cum_cost[-1] / num_blocks), cum_cost[-1]
+    best = fill_blocks(high)
+    for _ in range(60):
+        middle = (low + high) / 2
+        starts = fill_blocks(middle)
+        if starts is None:
+            low = middle
+        else:
+            high, best = middle, starts
+        if high - low <= 1e-6 * cum_cost[-1]:
+            break
+    starts = np.array(best)
+    return starts[:-1] + 1, np.diff(starts), np.diff(cum_cost[starts])
+
+
+# --- Main code
+if __name__ == '__main__':
+
+    # Arguments
+    if len(sys.argv) < 2:
+        sys.exit('Usage: python SUMMA_make_gru_blocks.py [number of blocks] [optional: hru, path/to/output_*.nc or path/to/log/folder]')
+    num_blocks = int(sys.argv[1])
+    source = sys.argv[2] if len(sys.argv) > 2 else 'hru'
+
+    # --- Find the attributes file
+    settings_path = read_from_control(controlFolder/controlFile,'settings_summa_path')
+    if settings_path == 'default':
+        settings_path = make_default_path('settings/SUMMA') # outputs a Path()
+    else:
+        settings_path = Path(settings_path) # make sure a user-specified path is a Path()
+    attribute_name = read_from_control(controlFolder/controlFile,'settings_summa_attributes')
+
+    with nc4.Dataset(settings_path/attribute_name) as att:
+        gru_ids = att['gruId'][:].astype(int)
+        hru_ids = att['hruId'][:].astype(int)
+        hru2gru = att['hru2gruId'][:].astype(int)
+    hru_count = pd.Series(hru2gru).value_counts().reindex(gru_ids, fill_value=0).values
+
+    # --- Estimate the cost of each GRU
+    if source == 'hru':
+        cost = hru_count.astype('float64')
+    else:
+        if Path(source).is_dir():
+            cost = gru_cost_from_logs(source, hru_count, read_array_blocks(settings_path/'gru_blocks.txt'))
+        else:
+            files = sorted(glob.glob(source))
+            if len(files) == 0:
+                sys.exit('Error: no files found matching {}'.format(source))
+            cost = gru_cost_from_outputs(files, gru_ids, hru_ids, hru2gru)
+        known = ~np.isnan(cost)
+        if not known.any():
+            sys.exit('Error: no GRU costs found in {}'.format(source))
+        cost_per_hru = np.median(cost[known & (hru_count > 0)] / hru_count[known & (hru_count > 0)])
+        print('Found costs for {} out of {} GRUs; others are estimated from their number of HRUs'.format(known.sum(), len(cost)))
+        cost[~known] = cost_per_hru * hru_count[~known]
+
+    # --- Make and store the blocks
+    gru_start, gru_count, block_cost = make_blocks(cost, num_blocks)
+    table_file = settings_path / 'gru_blocks.txt'
+    with open(table_file, 'w') as table:
+        table.write('array_id gru_start gru_count predicted_cost\n')
+        for ii,(start,count,block) in enumerate(zip(gru_start, gru_count, block_cost)):
+            table.write('{} {} {} {:.6g}\n'.format(ii+1, start, count, block))
+
+    equal_blocks = np.add.reduceat(cost, np.arange(0, len(cost), int(np.ceil(len(cost)/num_blocks))))
+    print('Divided {} GRUs into {} blocks. Largest predicted block cost: {:.6g} (equal-sized blocks: {:.6g}); mean: {:.6g}'.format(
+          len(gru_ids), len(gru_start), block_cost.max(), equal_blocks.max(), cost.sum()/len(gru_start)))
+    print('Blocks stored in {}'.format(table_file))
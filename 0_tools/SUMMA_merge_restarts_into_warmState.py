@@ -1,47 +1,221 @@
-# Combine split domain state files (with 2 dimensions, hru and gru)
+# Merge split-domain SUMMA restart files into a single initial conditions (warm state) file
+# Restart files created by runs with the -g option only contain the GRUs (and their HRUs) of that run.
+# This script finds all restart files of the experiment in control_active.txt for a given time stamp,
+# sorts them by their GRU range and copies each file directly into its place in a pre-allocated output
+# file. Only one variable of one input file is held in memory at any time.
+#
+# Restart time stamp: taken from 'experiment_time_end' in the control file, unless specified as argument.
+# Output: 'warmState.nc' in the SUMMA settings folder, unless specified as argument.
+#
+# The GRUs in the restart files must cover the domain without gaps or overlaps. The HRU order of the merged
+# file is checked against the attributes file. If the restart files contain no 'hruId' variable, it is
+# taken from the attributes file.
+#
+# Usage: python SUMMA_merge_restarts_into_warmState.py [optional: restart time stamp YYYYMMDDHH] [optional: path/to/output_file.nc]
 # Modified by W. Knoben (2021) from A. Wood (2020)
-# -----------------------------------------------
-
-import sys, glob
-import pandas as pd
-import xarray as xr
-
-# --------- arguments -----------
-'''
-print("found %d args" % len(sys.argv))
-if len(sys.argv) == 5:
-    stateFileRoot = sys.argv[1]     # eg './hstate/wbout_restart_'
-    startDate     = sys.argv[2]     # eg '19910301'
-    endDate       = sys.argv[3]     # eg '19920301'
-    Freq          = sys.argv[4]     # D (daily) or MS (monthly)
-else:
-    print("USAGE: %s input_filepath/root startdate(YYYYMMDD) enddate frequency_of_states(D or MS)" % sys.argv[0])
-    sys.exit(0)
-'''
-srcPath = '/project/gwf/gwf_cmt/wknoben/summaWorkflow_data/domain_Nelson/simulations/run3_be4_make_ics/SUMMA'
-srcName = 'run3_be4_make_ics_restart_2017123123_*.nc'
-desPath = '/project/gwf/gwf_cmt/wknoben/summaWorkflow_data/domain_Nelson/settings/SUMMA/'
-desName = 'warmState.nc'
-
-# --------- code -----------
-# find the files
-output_file_list = glob.glob(srcPath + '/' + srcName)
-output_file_list.sort()
-
-out_ds   = [xr.open_dataset(f) for f in output_file_list]
-hru_vars = [] # variables that have hru dimension
-gru_vars = [] # variables that have gru dimension
-
-for name, var in out_ds[0].variables.items():
-    if 'hru' in var.dims:
-        hru_vars.append(name)
-    elif 'gru' in var.dims:
-        gru_vars.append(name)
-
-hru_ds = [ds[hru_vars] for ds in out_ds]
-gru_ds = [ds[gru_vars] for ds in out_ds]
-hru_merged = xr.concat(hru_ds, dim='hru')
-gru_merged = xr.concat(gru_ds, dim='gru')
-merged_ds  = xr.merge([hru_merged, gru_merged])
-    
-merged_ds.load().to_netcdf(desPath + '/' + desName)
\ No newline at end of file
+
+# Modules
+import re
+import sys
+import numpy as np
+import netCDF4 as nc4
+from pathlib import Path
+from datetime import datetime
+
+# --- Control file handling
+# Easy access to control file folder
+controlFolder = Path('../0_control_files')
+
+# Store the name of the 'active' file in a variable
+controlFile = 'control_active.txt'
+
+# Function to extract a given setting from the control file
+def read_from_control( file, setting ):
+
+    # Open 'control_active.txt' and ...
+    with open(file) as contents:
+        for line in contents:
+
+            # ... find the line with the requested setting
+            if setting in line and not line.startswith('#'):
+                break
+
+    # Extract the setting's value
+    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
+    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
+    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
+
+    # Return this value
+    return substring
+
+# Function to specify a default path
+def make_default_path(suffix):
+
+    # Get the root path
+    rootPath = Path( read_from_control(controlFolder/controlFile,'root_path') )
+
+    # Get the domain folder
+    domainName = read_from_control(controlFolder/controlFile,'domain_name')
+    domainFolder = 'domain_' + domainName
+
+    # Specify the forcing path
+    defaultPath = rootPath / domainFolder / suffix
+
+    return defaultPath
+
+
+# --- Function definitions
+# Finds the restart time stamp (YYYYMMDDHH) that corresponds to the end of the simulation in the control file
+def restart_time_from_control():
+    sim_end = read_from_control(controlFolder/controlFile,'experiment_time_end')
+    if sim_end == 'default':
+        raw_time = read_from_control(controlFolder/controlFile,'forcing_raw_time') # downloaded forcing (years)
+        _,year_end = raw_time.split(',') # split into separate variables
+        sim_end = year_end + '-12-31 23:00'
+    return datetime.strptime(sim_end, '%Y-%m-%d %H:%M').strftime('%Y%m%d%H')
+
+# Finds the restart files for a given time stamp and sorts them by the first GRU they contain.
+# SUMMA names these '[prefix]_restart_[YYYYMMDDHH]_G[start]-[end].nc' for split-domain runs.
+def find_restart_files(folder, prefix, restart_time):
+    files = list(Path(folder).glob('{}_restart_{}*.nc'.format(prefix, restart_time)))
+    gru_ranges = []
+    for file in files:
+        match = re.search(r'_G(\d+)-(\d+)', file.name)
+        gru_ranges.append((int(match.group(1)), int(match.group(2))) if match else (1, None))
+    order = sorted(range(len(files)), key=lambda i: gru_ranges[i][0])
+    return [files[i] for i in order], [gru_ranges[i] for i in order]
+
+# Reads the dimension sizes of each file and determines where each file goes in the output
+def plan_merge(files):
+
+    # Dimension sizes per file, read from the file headers only
+    sizes = []
+    for file in files:
+        with nc4.Dataset(file) as src:
+            sizes.append({name: len(dim) for name,dim in src.dimensions.items()})
+
+    # Offsets of each file along the hru and gru dimensions
+    hru_offsets = np.concatenate([[0], np.cumsum([size['hru'] for size in sizes])])
+    gru_offsets = np.concatenate([[0], np.cumsum([size['gru'] for size in sizes])])
+
+    # Output dimensions: hru and gru are summed, other dimensions (e.g. layers) use the largest size found
+    out_sizes = {name: max(size[name] for size in sizes) for name in sizes[0]}
+    out_sizes['hru'] = int(hru_offsets[-1])
+    out_sizes['gru'] = int(gru_offsets[-1])
+
+    return out_sizes, hru_offsets, gru_offsets
+
+# Checks that the GRU ranges in the file names cover the domain without gaps or overlaps
+def check_gru_ranges(gru_ranges, gru_offsets):
+    for i,(start,end) in enumerate(gru_ranges):
+        if start != gru_offsets[i] + 1:
+            sys.exit('Error: restart files do not cover the domain contiguously; expected a file starting at GRU {}, found {}'.format(gru_offsets[i]+1, start))
+        if end is not None and end != gru_offsets[i+1]:
+            sys.exit('Error: restart file for GRUs {}-{} contains {} GRUs'.format(start, end, gru_offsets[i+1]-gru_offsets[i]))
+
+# Merges the restart files into a single file by copying each file into its hyperslab of the output
+def merge_restarts(files, output_file, attribute_file=None):
+
+    # Find the output sizes and file offsets
+    out_sizes, hru_offsets, gru_offsets = plan_merge(files)
+
+    # Read the HRU and GRU IDs from the attributes, to check the merged file against
+    attribute_hru = attribute_gru = None
+    if attribute_file is not None:
+        with nc4.Dataset(attribute_file) as att:
+            attribute_hru = att['hruId'][:]
+            attribute_gru = att['gruId'][:]
+        if len(attribute_hru) != out_sizes['hru'] or len(attribute_gru) != out_sizes['gru']:
+            sys.exit('Error: restart files contain {} HRUs and {} GRUs, attributes contain {} HRUs and {} GRUs'.format(
+                     out_sizes['hru'], out_sizes['gru'], len(attribute_hru), len(attribute_gru)))
+
+    # Create the output file with the structure of the first input file
+    with nc4.Dataset(files[0]) as src, nc4.Dataset(output_file, 'w', format='NETCDF4') as des:
+
+        # Global attributes and dimensions
+        des.setncatts({name: src.getncattr(name) for name in src.ncattrs()})
+        des.setncattr('History', 'Merged from {} restart files on {}'.format(len(files), datetime.now().strftime('%Y/%m/%d %H:%M:%S')))
+        for name in src.dimensions:
+            des.createDimension(name, out_sizes[name])
+
+        # Variables, with the same data type and attributes as the input
+        for name,var in src.variables.items():
+            attrs = {att: var.getncattr(att) for att in var.ncattrs()}
+            fill_value = attrs.pop('_FillValue', None)
+            des.createVariable(name, var.datatype, var.dimensions, fill_value=fill_value)
+            des[name].setncatts(attrs)
+
+            # Variables without hru or gru dimension are the same in all files
+            if not ('hru' in var.dimensions or 'gru' in var.dimensions):
+                des[name][:] = var[:]
+
+        # Add hruId from the attributes file if needed
+        if attribute_hru is not None and 'hruId' not in des.variables:
+            des.createVariable('hruId', 'i8', ('hru',))
+            des['hruId'].setncattr('long_name', 'Index of hydrological response unit (HRU)')
+            des['hruId'][:] = attribute_hru
+
+    # Copy each input file into its place in the output
+    with nc4.Dataset(output_file, 'a') as des:
+        for i,file in enumerate(files):
+            with nc4.Dataset(file) as src:
+                for name,var in src.variables.items():
+                    if not ('hru' in var.dimensions or 'gru' in var.dimensions):
+                        continue
+
+                    # Hyperslab of this file in the output
+                    slab = []
+                    for dim in var.dimensions:
+                        if dim == 'hru':
+                            slab.append(slice(hru_offsets[i], hru_offsets[i+1]))
+                        elif dim == 'gru':
+                            slab.append(slice(gru_offsets[i], gru_offsets[i+1]))
+                        else:
+                            slab.append(slice(0, len(src.dimensions[dim])))
+                    des[name][tuple(slab)] = var[:]
+
+            # Show progress
+            print('Copied {} ({} out of {})'.format(Path(file).name, i+1, len(files)))
+
+        # Check the HRU order against the attributes
+        if attribute_hru is not None and not np.array_equal(des['hruId'][:], attribute_hru):
+            sys.exit('Error: hruId order in merged restart file does not match attributes; first difference at index {}'.format(
+                     np.flatnonzero(des['hruId'][:] != attribute_hru)[0]))
+
+    return out_sizes
+
+
+# --- Main code
+if __name__ == '__main__':
+
+    # Restart time stamp and output file from the command line, or defaults from the control file
+    restart_time = sys.argv[1] if len(sys.argv) > 1 else restart_time_from_control()
+
+    # Experiment output folder and file prefix
+    experiment_id = read_from_control(controlFolder/controlFile,'experiment_id')
+    restart_path = read_from_control(controlFolder/controlFile,'experiment_output_summa')
+    if restart_path == 'default':
+        restart_path = make_default_path('simulations/' + experiment_id + '/SUMMA') # outputs a Path()
+    else:
+        restart_path = Path(restart_path) # make sure a user-specified path is a Path()
+
+    # Settings folder with the attributes file; default location of the output
+    settings_path = read_from_control(controlFolder/controlFile,'settings_summa_path')
+    if settings_path == 'default':
+        settings_path = make_default_path('settings/SUMMA') # outputs a Path()
+    else:
+        settings_path = Path(settings_path) # make sure a user-specified path is a Path()
+    attribute_name = read_from_control(controlFolder/controlFile,'settings_summa_attributes')
+    output_file = Path(sys.argv[2]) if len(sys.argv) > 2 else settings_path / 'warmState.nc'
+
+    # Find the restart files
+    files, gru_ranges = find_restart_files(restart_path, experiment_id, restart_time)
+    if len(files) == 0:
+        sys.exit('Error: no restart files found for time stamp {} in {}'.format(restart_time, restart_path))
+    print('Merging {} restart files for time stamp {} into {}'.format(len(files), restart_time, output_file))
+
+    # Check that the files cover the domain, then merge
+    _, _, gru_offsets = plan_merge(files)
+    check_gru_ranges(gru_ranges, gru_offsets)
+    out_sizes = merge_restarts(files, output_file, settings_path / attribute_name)
+    print('Created {} with {} HRUs and {} GRUs'.format(output_file, out_sizes['hru'], out_sizes['gru']))
@@ -0,0 +1,207 @@
+# Monitor the progress of running SUMMA or mizuRoute simulations
+# Follows the logs in the SUMMA or mizuRoute log folder (settings 'experiment_log_summa' and 'experiment_log_mizuroute'
+# in control_active.txt) while the simulations run, e.g. as array job. Each log is one block of the run. For each block,
+# the last simulated date printed to the log is found and compared to the experiment period (settings
+# 'experiment_time_start' and 'experiment_time_end'), and the following is reported:
+# - status: running, stalled (the log has not been written to for the given number of minutes), finished or failed;
+# - simulated date and fraction of the experiment period that is done;
+# - speed in simulated years per hour of wall clock time;
+# - expected remaining wall clock time.
+# The speed of a block is based on the wall clock time since the start of the run (SUMMA's 'initial date/time' line)
+# if the log has this, and otherwise on the progress since the monitor first saw the log. The overall speed is the sum
+# over the running blocks and the overall completion time is that of the slowest running block. Blocks that have not
+# started yet are not known to the monitor and are therefore not included.
+#
+# Only the part of each log that was written since the previous update is read, so that updates remain fast for large
+# numbers of logs. Logs are found by their extension ('.txt' for SUMMA, '.txt' or '.log' for mizuRoute); files with a
+# name that starts with '_' are skipped. Stop the monitor with Ctrl+C.
+#
+# Usage: python SUMMA_monitor_run.py [optional: 'summa' (default) or 'mizuroute'] [optional: seconds between updates, 0 to report once (default: 60)] [optional: minutes without output before a block is stalled (default: 30)]
+
+# Modules
+import os
+import re
+import sys
+import time
+from pathlib import Path
+from datetime import datetime
+
+# --- Control file handling
+# Easy access to control file folder
+controlFolder = Path('../0_control_files')
+
+# Store the name of the 'active' file in a variable
+controlFile = 'control_active.txt'
+
+# Function to extract a given setting from the control file
+def read_from_control( file, setting ):
+
+    # Open 'control_active.txt' and ...
+    with open(file) as contents:
+        for line in contents:
+
+            # ... find the line with the requested setting
+            if setting in line and not line.startswith('#'):
+                break
+
+    # Extract the setting's value
+    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
+    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
+    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
+
+    # Return this value
+    return substring
+
+# Function to specify a default path
+def make_default_path(suffix):
+
+    # Get the root path
+    rootPath = Path( read_from_control(controlFolder/controlFile,'root_path') )
+
+    # Get the domain folder
+    domainName = read_from_control(controlFolder/controlFile,'domain_name')
+    domainFolder = 'domain_' + domainName
+
+    # Specify the forcing path
+    defaultPath = rootPath / domainFolder / suffix
+
+    return defaultPath
+
+
+# --- Function definitions
+# Simulated date in a log line: SUMMA's time step lines ('YYYY MM DD HH MM') or a date written as YYYY-MM-DD
+def simulated_date(line):
+    if 'date/time' in line:
+        return None
+    date = re.match(r'\s*(\d{4})\s+(\d{1,2})\s+(\d{1,2})\s+(\d{1,2})\s+(\d{1,2})\s*$', line) or \
+           re.search(r'(\d{4})-(\d{2})-(\d{2})[\sT]+(\d{1,2}):(\d{2})', line)
+    if date is None:
+        return None
+    try:
+        return datetime(*[int(value) for value in date.groups()])
+    except ValueError:
+        return None
+
+# Reads the part of a log that was written since the previous call and updates the log's state
+def update_log(log_file, state, _buffer=65536):
+    stat = log_file.stat()
+    if stat.st_size <= state.get('offset', 0):
+        return state
+    with open(log_file, 'rb') as log:
+        if 'offset' not in state:
+            head = log.read(_buffer).decode(errors='replace')
+            started = re.search(r'initial date/time\s*=\s*(\d{4}-\d{2}-\d{2})\s+(\d{1,2}:\d{2}:\d{2})', head)
+            if started:
+                state['started'] = datetime.strptime(started.group(1) + ' ' + started.group(2), '%Y-%m-%d %H:%M:%S').timestamp()
+        log.seek(max(state.get('offset', 0), stat.st_size - _buffer))
+        lines = log.read(stat.st_size - log.tell()).decode(errors='replace').splitlines()
+    state['offset'] = stat.st_size
+    state['written'] = stat.st_mtime
+    for line in reversed(lines):
+        date = simulated_date(line)
+        if date is not None:
+            state['date'] = date
+            break
+    if any('successfully' in line for line in lines[-3:]):
+        state['status'] = 'finished'
+    elif any('FATAL ERROR' in line for line in lines):
+        state['status'] = 'failed'
+    if 'first_seen' not in state and 'date' in state:
+        state['first_seen'] = (stat.st_mtime, state['date'])
+    return state
+
+# Progress of one block: status, fraction of the period done, simulated years per hour and remaining hours
+def block_progress(state, sim_start, sim_end, now, stall_minutes):
+    period = (sim_end - sim_start).total_seconds()
+    done = (state['date'] - sim_start).total_seconds() / period if 'date' in state else 0.
+    status = state.get('status', 'running')
+    if status == 'running' and now - state.get('written', now) > 60 * stall_minutes:
+        status = 'stalled'
+    if 'started' in state and 'date' in state:
+        wall, simulated = state['written'] - state['started'], (state['date'] - sim_start).total_seconds()
+    elif 'first_seen' in state:
+        wall, simulated = state['written'] - state['first_seen'][0], (state['date'] - state['first_seen'][1]).total_seconds()
+    else:
+        wall, simulated = 0., 0.
+    speed = simulated / (365.25 * 86400) / (wall / 3600) if wall > 0 else float('nan')
+    remaining = (1 - done) * period / (365.25 * 86400) / speed if speed > 0 else float('nan')
+    if status == 'finished':
+        done, remaining = 1., 0.
+    elif status == 'failed':
+        remaining = float('nan')
+    return status, done, speed, remaining
+
+# Prints the progress of all blocks, slowest running blocks first
+def report(states, sim_start, sim_end, stall_minutes):
+    now = time.time()
+    rows = [(name,) + block_progress(state, sim_start, sim_end, now, stall_minutes) for name,state in states.items()]
+    order = {'stalled': 0, 'failed': 1, 'running': 2, 'finished': 3}
+    rows.sort(key=lambda row: (order[row[1]], -row[4] if row[4] == row[4] else 0))
+    print('\n{} - {} blocks'.format(datetime.now().strftime('%Y-%m-%d %H:%M:%S'), len(rows)))
+    print('{:<40} {:<9} {:>16} {:>7} {:>10} {:>10}'.format('log', 'status', 'simulated date', 'done', 'years/h', 'hours left'))
+    for name,status,done,speed,remaining in rows:
+        if status == 'finished':
+            continue
+        date = states[name]['date'].strftime('%Y-%m-%d %H:%M') if 'date' in states[name] else '-'
+        print('{:<40} {:<9} {:>16} {:>6.1f}% {:>10.3g} {:>10.3g}'.format(name[:40], status, date, 100*done, speed, remaining))
+    running = [row for row in rows if row[1] in ['running','stalled']]
+    counts = {status: sum(row[1] == status for row in rows) for status in order}
+    overall_speed = sum(row[3] for row in running if row[3] == row[3])
+    finish = max([row[4] for row in running if row[4] == row[4]], default=float('nan'))
+    print('Running: {running}, stalled: {stalled}, failed: {failed}, finished: {finished}'.format(**counts))
+    print('Overall speed: {:.3g} simulated years per hour. Expected time until the running blocks finish: {:.3g} hours'.format(overall_speed, finish))
+
+
+# --- Main code
+if __name__ == '__main__':
+
+    # Arguments
+    model = sys.argv[1].lower() if len(sys.argv) > 1 else 'summa'
+    if model not in ['summa','mizuroute']:
+        sys.exit('Usage: python SUMMA_monitor_run.py [optional: summa or mizuroute] [optional: seconds between updates] [optional: minutes without output before a block is stalled]')
+    interval = float(sys.argv[2]) if len(sys.argv) > 2 else 60
+    stall_minutes = float(sys.argv[3]) if len(sys.argv) > 3 else 30
+
+    # --- Find the log folder and experiment period
+    experiment_id = read_from_control(controlFolder/controlFile,'experiment_id')
+    if model == 'summa':
+        log_path = read_from_control(controlFolder/controlFile,'experiment_log_summa')
+        default_log_path = 'simulations/' + experiment_id + '/SUMMA/SUMMA_logs'
+        extensions = ('.txt',)
+    else:
+        log_path = read_from_control(controlFolder/controlFile,'experiment_log_mizuroute')
+        default_log_path = 'simulations/' + experiment_id + '/mizuRoute/mizuRoute_logs'
+        extensions = ('.txt','.log')
+    if log_path == 'default':
+        log_path = make_default_path(default_log_path) # outputs a Path()
+    else:
+        log_path = Path(log_path) # make sure a user-specified path is a Path()
+
+    sim_start = read_from_control(controlFolder/controlFile,'experiment_time_start')
+    sim_end   = read_from_control(controlFolder/controlFile,'experiment_time_end')
+    if sim_start == 'default':
+        raw_time = read_from_control(controlFolder/controlFile,'forcing_raw_time') # downloaded forcing (years)
+        year_start,_ = raw_time.split(',') # split into separate variables
+        sim_start = year_start + '-01-01 00:00' # construct the filemanager field
+    if sim_end == 'default':
+        raw_time = read_from_control(controlFolder/controlFile,'forcing_raw_time') # downloaded forcing (years)
+        _,year_end = raw_time.split(',') # split into separate variables
+        sim_end = year_end + '-12-31 23:00' # construct the filemanager field
+    sim_start = datetime.strptime(sim_start, '%Y-%m-%d %H:%M')
+    sim_end = datetime.strptime(sim_end, '%Y-%m-%d %H:%M')
+
+    # --- Follow the logs
+    states = {}
+    try:
+        while True:
+            for entry in os.scandir(log_path):
+                if entry.is_file() and entry.name.endswith(extensions) and not entry.name.startswith('_'):
+                    state = states.setdefault(entry.name, {})
+                    if state.get('status') not in ['finished','failed']:
+                        update_log(Path(entry.path), state)
+            report(states, sim_start, sim_end, stall_minutes)
+            if interval <= 0:
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
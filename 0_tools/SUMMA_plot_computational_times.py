@@ -4,11 +4,9 @@ Usage: python SUMMA_plot_computational_times.py [log_folder] [name_of_summary_fi
 
 # Modules
 import os
-import re
 import sys
-import numpy as np
-import statistics as sts
 import matplotlib.pyplot as plt
+from SUMMA_log_index import index_logs
 
 # ----------------------
 # Set defaults
@@ -41,82 +39,6 @@ else: # at least 2 elements in sys.argv; len(sys.argv) cannot be zero or we woul
 # End of input arguments
 # ----------------------
 
-# -------------   
-# Sub functions
-
-# Define a function to grab the last line in a file
-# See: https://stackoverflow.com/questions/136168/get-last-n-lines-of-a-file-similar-to-tail
-def tail(folder, file, lines=1, _buffer=4098):
-        
-    """Tail a file and get X lines from the end"""
-    
-    # open the file
-    with open(folder + '/' + file,'r') as f: 
-    
-        # place holder for the lines found
-        lines_found = []
-
-        # block counter will be multiplied by buffer to get the block size from the end
-        block_counter = -1
-
-        # loop until we find X lines
-        while len(lines_found) < lines:
-            try:
-                f.seek(block_counter * _buffer, os.SEEK_END)
-            except IOError:  # either file is too small, or too many lines requested
-                f.seek(0)
-                lines_found = f.readlines()
-                break
-
-            lines_found = f.readlines()
-
-            # decrement the block counter to get the next X bytes
-            block_counter -= 1
-
-    return lines_found[-lines:]
-    
-# Function to grab the 7 different timing values from a SUMMA log file
-def get_computation_time(file,nLines=30):
-    
-    # get the file contents
-    log_txt = tail(folder,file,nLines)
-
-    # initialize the return values. Negative values allows for filtering outside this function if needed
-    total = physics = write = read = restart = setup = init = -1
-    
-    # only proceed if simulation was successful
-    success = False
-    nSkipped = 0
-    for line in log_txt:                
-        if 'successfully' in line:
-            success = True
-    if not success:
-        print(f'{file} does not appear to log a successful SUMMA run. Skipping.')
-        nSkipped += 1
-        return total,physics,write,read,restart,setup,init,nSkipped
-    
-    # loop over the lines and act according to what's found in the line
-    for line in log_txt:
-        if 'elapsed time' in line:
-            total = float(re.sub("[^\d\.]", "", line))
-        elif 'elapsed physics' in line:
-            physics = float(re.sub("[^\d\.]", "", line))
-        elif 'elapsed write' in line:
-            write = float(re.sub("[^\d\.]", "", line))
-        elif 'elapsed read' in line:
-            read = float(re.sub("[^\d\.]", "", line))
-        elif 'elapsed restart' in line:
-            restart = float(re.sub("[^\d\.]", "", line))
-        elif 'elapsed setup' in line:
-            setup = float(re.sub("[^\d\.]", "", line))
-        elif 'elapsed init' in line:
-            init = float(re.sub("[^\d\.]", "", line))
-        
-    return total,physics,write,read,restart,setup,init,nSkipped
-
-# End of sub functions
-# --------------------
-
 # -------------------
 # Start of processing
 
@@ -126,31 +48,25 @@ try:
 except OSError:
     pass
     
-# Find the .txt files in the folder
-files = []
-for file in os.listdir(folder):
-    if file.endswith(ext):
-        files.append(file)
-files.sort()
-
-# initialize the arrays
-time_init = np.zeros(len(files))
-time_setup = np.zeros(len(files))
-time_restart = np.zeros(len(files))
-time_read = np.zeros(len(files))
-time_write = np.zeros(len(files))
-time_physics = np.zeros(len(files))
-time_total = np.zeros(len(files))
-
-# loop over the files and extract the timing info into prepared arrays
-for ii,file in enumerate(files):
-    time_total[ii],time_physics[ii],time_write[ii],time_read[ii],\
-    time_restart[ii],time_setup[ii],time_init[ii],nSkipped = get_computation_time(file)
+# Find the timing info of each log file; only new or changed logs are read
+logs = index_logs(folder, ext)
+for file in logs.loc[logs['status'] != 'success', 'file']:
+    print(f'{file} does not appear to log a successful SUMMA run. Skipping.')
+logs = logs[logs['status'] == 'success'].fillna(-1) # negative values for timings that are missing from a log
+
+# extract the timing info into arrays
+time_init = logs['time_init'].values
+time_setup = logs['time_setup'].values
+time_restart = logs['time_restart'].values
+time_read = logs['time_read'].values
+time_write = logs['time_write'].values
+time_physics = logs['time_physics'].values
+time_total = logs['time_total'].values
     
 # Prepare for the figure
 plt.rcParams.update({'font.size': 16})
 ttl = 'SUMMA computational times ({n} logs{isLog})' # general title
-ttl_n = len(files)-nSkipped # number of log files included
+ttl_n = len(logs) # number of log files included
 
 # general plotting function
 def plot_times(ax, title, xlog=False):
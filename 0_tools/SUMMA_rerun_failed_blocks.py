@@ -0,0 +1,226 @@
+# Re-run failed blocks of GRUs in smaller blocks, to isolate GRUs that cause SUMMA to fail
+# A SUMMA run for a block of GRUs (using the -g argument) fails as a whole if a single GRU causes an error, or stops
+# without SUMMA's termination statement if the job runs out of time. This script checks all SUMMA logs in the folder
+# 'experiment_log_summa' and re-runs only the GRUs that have no successful run yet, in blocks that are smaller than the
+# blocks they failed in. Blocks that fail again are split again, down to single GRUs. GRUs that also fail when run on
+# their own are not run again; they are listed in 'summa_failed_grus.csv' in the log folder, with the error message
+# found in their log.
+#
+# The GRUs of each log are found from the log name. Logs written by SUMMA_run_blocks_local.py and by this script are
+# named summa_log_G[start]-[end].txt. Logs written by 6_model_runs/1_run_summa_as_array.sh are named
+# summa_log_[array_id].txt; their GRUs are found in the table made by SUMMA_make_gru_blocks.py ('gru_blocks.txt' in
+# the SUMMA settings folder), if it exists. Each failed block is split into 'split_factor' smaller blocks (see below).
+# A log counts as:
+# - successful: the log ends with SUMMA's success statement;
+# - SUMMA error: the log contains 'FATAL ERROR';
+# - early termination: neither, e.g. because the job was out of time or memory.
+#
+# By default, the smaller blocks are run on this machine with at most the given number of SUMMA processes at a time,
+# until all GRUs ran successfully or failed on their own. Alternatively, 'table' writes the next set of smaller blocks
+# to 'gru_blocks_rerun.txt' in the SUMMA settings folder, in the format of 'gru_blocks.txt', so that they can be run as
+# array job. Give 1_run_summa_as_array.sh 'G[start]-[end]' as array ID, so that the log names show the GRUs of each
+# block, and run this script again after the array job to find the blocks that failed again. Either way, the script can
+# be run again at any time; GRUs that ran successfully are never run again. Logs of runs that are still in progress
+# count as early termination, so only use this script once all runs have stopped.
+#
+# Usage: python SUMMA_rerun_failed_blocks.py [optional: 'run' (default) or 'table'] [optional: number of processes] [optional: path/to/summa.exe]
+
+# Modules
+import os
+import re
+import sys
+import numpy as np
+import pandas as pd
+import netCDF4 as nc4
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from SUMMA_run_blocks_local import find_executable, log_file_of, run_block
+from SUMMA_log_index import index_logs
+
+# --- Settings
+split_factor = 4 # number of smaller blocks that a failed block is split into
+
+# --- Control file handling
+# Easy access to control file folder
+controlFolder = Path('../0_control_files')
+
+# Store the name of the 'active' file in a variable
+controlFile = 'control_active.txt'
+
+# Function to extract a given setting from the control file
+def read_from_control( file, setting ):
+
+    # Open 'control_active.txt' and ...
+    with open(file) as contents:
+        for line in contents:
+
+            # ... find the line with the requested setting
+            if setting in line and not line.startswith('#'):
+                break
+
+    # Extract the setting's value
+    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
+    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
+    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
+
+    # Return this value
+    return substring
+
+# Function to specify a default path
+def make_default_path(suffix):
+
+    # Get the root path
+    rootPath = Path( read_from_control(controlFolder/controlFile,'root_path') )
+
+    # Get the domain folder
+    domainName = read_from_control(controlFolder/controlFile,'domain_name')
+    domainFolder = 'domain_' + domainName
+
+    # Specify the forcing path
+    defaultPath = rootPath / domainFolder / suffix
+
+    return defaultPath
+
+
+# --- Function definitions
+# GRU range of each log in the folder: from the log name, or from the array ID and the table of blocks
+def find_block_logs(log_path, blocks_table=None):
+    array_blocks = {}
+    if blocks_table is not None and blocks_table.is_file():
+        table = pd.read_csv(blocks_table, sep=r'\s+')
+        array_blocks = dict(zip(table['array_id'].astype(int), zip(table['gru_start'].astype(int), table['gru_count'].astype(int))))
+    logs = []
+    index = index_logs(log_path)
+    for file,mtime,status,message in zip(index['file'], index['mtime'], index['status'], index['message']):
+        name = re.fullmatch(r'summa_log_G(\d+)-(\d+)\.txt', file)
+        array_id = re.fullmatch(r'summa_log_(\d+)\.txt', file)
+        if name:
+            gru_start, gru_count = int(name.group(1)), int(name.group(2)) - int(name.group(1)) + 1
+        elif array_id and int(array_id.group(1)) in array_blocks:
+            gru_start, gru_count = array_blocks[int(array_id.group(1))]
+        else:
+            if file.startswith('summa_log_'):
+                print('Skipping {}: GRUs of this log are unknown'.format(file))
+            continue
+        logs.append({'gru_start': gru_start, 'gru_count': gru_count, 'status': status, 'message': message,
+                     'log_file': log_path/file, 'mtime': mtime})
+    return logs
+
+# Status of each GRU from all logs: whether it ran successfully, the size of the smallest block it failed in (0 if it
+# never failed), and the last failed log it is part of
+def gru_status(logs, num_gru):
+    success = np.zeros(num_gru, dtype=bool)
+    failed_size = np.zeros(num_gru, dtype='int64')
+    failed_log = np.full(num_gru, None, dtype=object)
+    for log in sorted(logs, key=lambda log: log['mtime']):
+        gru = slice(log['gru_start']-1, log['gru_start']-1+log['gru_count'])
+        if log['status'] == 'success':
+            success[gru] = True
+        else:
+            failed_size[gru] = np.where(failed_size[gru] > 0, np.minimum(failed_size[gru], log['gru_count']), log['gru_count'])
+            failed_log[gru] = [log] * log['gru_count']
+    return success, failed_size, failed_log
+
+# Smaller blocks for the GRUs that failed in blocks of more than one GRU. Consecutive GRUs that failed in blocks of the
+# same size are split into blocks of 1/split_factor of that size.
+def split_failed_blocks(success, failed_size, split_factor):
+    rerun = ~success & (failed_size > 1)
+    block_size = np.where(rerun, -(-failed_size // split_factor), 0)
+    blocks = []
+    ii = 0
+    while ii < len(block_size):
+        if block_size[ii] == 0:
+            ii += 1
+            continue
+        end = ii
+        while end < len(block_size) and block_size[end] == block_size[ii] and end - ii < block_size[ii]:
+            end += 1
+        blocks.append((ii+1, end-ii))
+        ii = end
+    return blocks
+
+# Stores the GRUs that failed on their own
+def write_failed_grus(file, success, failed_size, failed_log, gru_ids):
+    failed = np.flatnonzero(~success & (failed_size == 1))
+    pd.DataFrame({'gru_index': failed + 1,
+                  'gruId': gru_ids[failed],
+                  'status': [failed_log[ii]['status'] for ii in failed],
+                  'message': [failed_log[ii]['message'] for ii in failed],
+                  'log_file': [failed_log[ii]['log_file'].name for ii in failed]}).to_csv(file, index=False)
+    return len(failed)
+
+
+# --- Main code
+if __name__ == '__main__':
+
+    # Arguments
+    mode = sys.argv[1] if len(sys.argv) > 1 else 'run'
+    if mode not in ['run','table']:
+        sys.exit('Usage: python SUMMA_rerun_failed_blocks.py [optional: run or table] [optional: number of processes] [optional: path/to/summa.exe]')
+    num_processes = int(sys.argv[2]) if len(sys.argv) > 2 else int(os.environ.get('SLURM_CPUS_PER_TASK',default=os.cpu_count()))
+
+    # --- Find the executable, settings and log folder
+    if len(sys.argv) > 3:
+        summa_exe = Path(sys.argv[3])
+    else:
+        summa_path = read_from_control(controlFolder/controlFile,'install_path_summa')
+        if summa_path == 'default':
+            summa_path = Path( read_from_control(controlFolder/controlFile,'root_path') ) / 'installs/summa/bin'
+        else:
+            summa_path = Path(summa_path) # make sure a user-specified path is a Path()
+        summa_exe = summa_path / read_from_control(controlFolder/controlFile,'exe_name_summa')
+    if mode == 'run':
+        summa_exe = find_executable(summa_exe) # not needed to only make a table
+
+    settings_path = read_from_control(controlFolder/controlFile,'settings_summa_path')
+    if settings_path == 'default':
+        settings_path = make_default_path('settings/SUMMA') # outputs a Path()
+    else:
+        settings_path = Path(settings_path) # make sure a user-specified path is a Path()
+    fm_file = settings_path / read_from_control(controlFolder/controlFile,'settings_summa_filemanager')
+    attribute_name = read_from_control(controlFolder/controlFile,'settings_summa_attributes')
+
+    log_path = read_from_control(controlFolder/controlFile,'experiment_log_summa')
+    if log_path == 'default':
+        experiment_id = read_from_control(controlFolder/controlFile,'experiment_id')
+        log_path = make_default_path('simulations/' + experiment_id + '/SUMMA/SUMMA_logs') # outputs a Path()
+    else:
+        log_path = Path(log_path) # make sure a user-specified path is a Path()
+
+    with nc4.Dataset(settings_path/attribute_name) as att:
+        gru_ids = att['gruId'][:].astype(int)
+
+    # --- Re-run failed GRUs in smaller blocks until none are left
+    while True:
+        logs = find_block_logs(log_path, settings_path/'gru_blocks.txt')
+        if len(logs) == 0:
+            sys.exit('Error: no SUMMA logs found in {}'.format(log_path))
+        success, failed_size, failed_log = gru_status(logs, len(gru_ids))
+        blocks = split_failed_blocks(success, failed_size, split_factor)
+        num_missing = (~success & (failed_size == 0)).sum()
+        print('Found {} logs: {} GRUs ran successfully, {} GRUs need to be run again in {} blocks, {} GRUs failed on their own, {} GRUs have no log'.format(
+              len(logs), success.sum(), sum(count for _,count in blocks), len(blocks), (~success & (failed_size == 1)).sum(), num_missing))
+        if len(blocks) == 0 or mode == 'table':
+            break
+
+        def run(block):
+            gru_start, gru_count = block
+            return_code, seconds = run_block(summa_exe, fm_file, log_file_of(log_path, gru_start, gru_count), gru_start, gru_count)
+            print('GRUs {}-{} finished with return code {} after {:.1f} s'.format(gru_start, gru_start+gru_count-1, return_code, seconds), flush=True)
+
+        with ThreadPoolExecutor(max_workers=num_processes) as executor:
+            list(executor.map(run, blocks))
+
+    # --- Store the next blocks for an array job
+    if mode == 'table':
+        table_file = settings_path / 'gru_blocks_rerun.txt'
+        with open(table_file, 'w') as table:
+            table.write('array_id gru_start gru_count\n')
+            for ii,(start,count) in enumerate(blocks):
+                table.write('{} {} {}\n'.format(ii+1, start, count))
+        print('Blocks to run again stored in {}'.format(table_file))
+
+    # --- Store the GRUs that failed on their own
+    num_failed = write_failed_grus(log_path/'summa_failed_grus.csv', success, failed_size, failed_log, gru_ids)
+    if num_failed > 0:
+        print('{} GRU(s) failed when run on their own, see {}'.format(num_failed, log_path/'summa_failed_grus.csv'))
@@ -0,0 +1,171 @@
+# Run SUMMA for blocks of GRUs in parallel on a single machine
+# Runs SUMMA with the -g argument for all blocks of GRUs in the domain, without a job scheduler. Blocks are either of
+# equal size or taken from a table made by SUMMA_make_gru_blocks.py. At most the given number of SUMMA processes run at
+# the same time; a new block is started as soon as a running block finishes.
+#
+# The output of each block is written to a log file in the folder 'experiment_log_summa' while SUMMA runs, named
+# summa_log_G[start]-[end].txt. When all blocks are done, the return code, run time and status of each block are stored
+# in 'summa_block_status.csv' in the same folder. A block is successful if its log ends with SUMMA's success statement.
+# The script exits with a non-zero status if any block failed.
+#
+# The SUMMA executable, settings and log folder are taken from control_active.txt. Another executable can be given as
+# argument, e.g. 'SUMMA_fake_executable.py' in this folder to test the set up without running SUMMA.
+#
+# Usage: python SUMMA_run_blocks_local.py [GRUs per block, or path/to/gru_blocks.txt] [optional: number of processes] [optional: path/to/summa.exe]
+
+# Modules
+import os
+import sys
+import time
+import subprocess
+import numpy as np
+import pandas as pd
+import netCDF4 as nc4
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from SUMMA_log_index import is_successful
+
+# --- Control file handling
+# Easy access to control file folder
+controlFolder = Path('../0_control_files')
+
+# Store the name of the 'active' file in a variable
+controlFile = 'control_active.txt'
+
+# Function to extract a given setting from the control file
+def read_from_control( file, setting ):
+
+    # Open 'control_active.txt' and ...
+    with open(file) as contents:
+        for line in contents:
+
+            # ... find the line with the requested setting
+            if setting in line and not line.startswith('#'):
+                break
+
+    # Extract the setting's value
+    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
+    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
+    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
+
+    # Return this value
+    return substring
+
+# Function to specify a default path
+def make_default_path(suffix):
+
+    # Get the root path
+    rootPath = Path( read_from_control(controlFolder/controlFile,'root_path') )
+
+    # Get the domain folder
+    domainName = read_from_control(controlFolder/controlFile,'domain_name')
+    domainFolder = 'domain_' + domainName
+
+    # Specify the forcing path
+    defaultPath = rootPath / domainFolder / suffix
+
+    return defaultPath
+
+
+# --- Function definitions
+# Log file of one block
+def log_file_of(log_path, gru_start, gru_count):
+    return log_path / 'summa_log_G{}-{}.txt'.format(gru_start, gru_start+gru_count-1)
+
+# Absolute path to the executable; stops if it does not exist or cannot be executed. A relative path such as
+# './summa.exe' would otherwise be searched for on the PATH by subprocess
+def find_executable(summa_exe):
+    summa_exe = Path(summa_exe).resolve()
+    if not summa_exe.is_file() or not os.access(summa_exe, os.X_OK):
+        sys.exit('Error: {} does not exist or is not executable'.format(summa_exe))
+    return summa_exe
+
+# Runs SUMMA for one block, writing its output to the log file while it runs. Returns the return code and run time.
+# Other SUMMA options (e.g. ['-r','e']) can be given. If SUMMA cannot be started, the error is written to the log and
+# the block is failed with return code -1
+def run_block(summa_exe, fm_file, log_file, gru_start, gru_count, options=()):
+    started = time.time()
+    with open(log_file, 'w') as log:
+        try:
+            return_code = subprocess.run([str(summa_exe), '-g', str(gru_start), str(gru_count), *options, '-m', str(fm_file)],
+                                         stdout=log, stderr=subprocess.STDOUT).returncode
+        except OSError as error:
+            log.write('Error: could not start {}: {}\n'.format(summa_exe, error))
+            return_code = -1
+    return return_code, time.time() - started
+
+# Blocks of equal size, or from a table with columns gru_start and gru_count
+def read_blocks(blocks, num_gru):
+    if Path(blocks).is_file():
+        table = pd.read_csv(blocks, sep=r'\s+')
+        return list(zip(table['gru_start'].astype(int), table['gru_count'].astype(int)))
+    block_starts = np.arange(1, num_gru+1, int(blocks))
+    block_counts = np.minimum(int(blocks), num_gru - block_starts + 1)
+    return list(zip(block_starts, block_counts))
+
+
+# --- Main code
+if __name__ == '__main__':
+
+    # Arguments
+    if len(sys.argv) < 2:
+        sys.exit('Usage: python SUMMA_run_blocks_local.py [GRUs per block, or path/to/gru_blocks.txt] [optional: number of processes] [optional: path/to/summa.exe]')
+    blocks_arg = sys.argv[1]
+    num_processes = int(sys.argv[2]) if len(sys.argv) > 2 else int(os.environ.get('SLURM_CPUS_PER_TASK',default=os.cpu_count()))
+
+    # --- Find the executable, settings and log folder
+    if len(sys.argv) > 3:
+        summa_exe = Path(sys.argv[3])
+    else:
+        summa_path = read_from_control(controlFolder/controlFile,'install_path_summa')
+        if summa_path == 'default':
+            summa_path = Path( read_from_control(controlFolder/controlFile,'root_path') ) / 'installs/summa/bin'
+        else:
+            summa_path = Path(summa_path) # make sure a user-specified path is a Path()
+        summa_exe = summa_path / read_from_control(controlFolder/controlFile,'exe_name_summa')
+    summa_exe = find_executable(summa_exe)
+
+    settings_path = read_from_control(controlFolder/controlFile,'settings_summa_path')
+    if settings_path == 'default':
+        settings_path = make_default_path('settings/SUMMA') # outputs a Path()
+    else:
+        settings_path = Path(settings_path) # make sure a user-specified path is a Path()
+    fm_file = settings_path / read_from_control(controlFolder/controlFile,'settings_summa_filemanager')
+    attribute_name = read_from_control(controlFolder/controlFile,'settings_summa_attributes')
+
+    log_path = read_from_control(controlFolder/controlFile,'experiment_log_summa')
+    if log_path == 'default':
+        experiment_id = read_from_control(controlFolder/controlFile,'experiment_id')
+        log_path = make_default_path('simulations/' + experiment_id + '/SUMMA/SUMMA_logs') # outputs a Path()
+    else:
+        log_path = Path(log_path) # make sure a user-specified path is a Path()
+    log_path.mkdir(parents=True, exist_ok=True)
+
+    # --- Define the blocks
+    with nc4.Dataset(settings_path/attribute_name) as att:
+        num_gru = len(att.dimensions['gru'])
+    blocks = read_blocks(blocks_arg, num_gru)
+    print('Running {} blocks of GRUs with at most {} processes at a time'.format(len(blocks), num_processes))
+
+    # --- Run
+    def run(block):
+        gru_start, gru_count = block
+        return_code, seconds = run_block(summa_exe, fm_file, log_file_of(log_path, gru_start, gru_count), gru_start, gru_count)
+        print('GRUs {}-{} finished with return code {} after {:.1f} s'.format(gru_start, gru_start+gru_count-1, return_code, seconds), flush=True)
+        return return_code, seconds
+
+    with ThreadPoolExecutor(max_workers=num_processes) as executor:
+        results = list(executor.map(run, blocks))
+
+    # --- Store the status of each block
+    status = pd.DataFrame(blocks, columns=['gru_start','gru_count'])
+    status['return_code'] = [return_code for return_code,_ in results]
+    status['seconds'] = [seconds for _,seconds in results]
+    status['successful'] = [is_successful(log_file_of(log_path, start, count)) for start,count in blocks]
+    status['log_file'] = [log_file_of(log_path, start, count).name for start,count in blocks]
+    status.to_csv(log_path/'summa_block_status.csv', index=False)
+
+    num_failed = (~status['successful']).sum()
+    print('{} out of {} blocks completed successfully. Status of each block stored in {}'.format(len(blocks)-num_failed, len(blocks), log_path/'summa_block_status.csv'))
+    if num_failed > 0:
+        sys.exit(1)
@@ -0,0 +1,206 @@
+# Run an ensemble of SUMMA configurations and score the results
+# Runs SUMMA for a set of file managers (e.g. those created by 5_model_input/SUMMA/1e_trial_parameters/2_create_trialParams_ensemble.py).
+# All members must use the same forcing and attributes; they differ in e.g. trial parameters and output prefix. Each
+# member is split into blocks of GRUs (using the -g option), and all member x block combinations are run as separate tasks:
+# - Locally, tasks are run in parallel on the number of CPUs in environment variable SLURM_CPUS_PER_TASK (default: 1);
+# - In a SLURM array job, each array task runs every n-th task, where n is the number of array tasks.
+#
+# Each task writes its log to folder 'SUMMA_logs' in the member's output path. Tasks with a log that reports a successful
+# simulation are skipped, so that the script can be run again to retry failed tasks or to score an array job once all
+# its tasks have finished.
+#
+# When all tasks are done, a table with the result of each member is stored next to the file managers. If an observation
+# file is given, this includes the Kling-Gupta and Nash-Sutcliffe efficiencies of simulated daily flow. Simulated flow is
+# the sum of SUMMA variable 'averageRoutedRunoff' [m s-1] multiplied by GRU area [m2] over all GRUs in the domain, i.e.
+# flow at the outlet of the domain without delays in the river network. The observation file is a .csv file with
+# dates or times in the first column and observed flow [m3 s-1] in the second column.
+#
+# The SUMMA executable is taken from control_active.txt, unless specified as argument. Use 'SUMMA_fake_executable.py'
+# in this folder to test the ensemble set up without running SUMMA.
+#
+# Usage: python SUMMA_run_ensemble.py [file manager pattern, e.g. '/path/to/fileManager_*.txt'] [GRUs per block] [optional: observations.csv, or 'none'] [optional: path/to/summa.exe]
+
+# Modules
+import os
+import re
+import sys
+import glob
+import numpy as np
+import pandas as pd
+import netCDF4 as nc4
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from SUMMA_log_index import is_successful
+from SUMMA_run_blocks_local import find_executable, run_block
+
+# --- Control file handling
+# Easy access to control file folder
+controlFolder = Path('../0_control_files')
+
+# Store the name of the 'active' file in a variable
+controlFile = 'control_active.txt'
+
+# Function to extract a given setting from the control file
+def read_from_control( file, setting ):
+
+    # Open 'control_active.txt' and ...
+    with open(file) as contents:
+        for line in contents:
+
+            # ... find the line with the requested setting
+            if setting in line and not line.startswith('#'):
+                break
+
+    # Extract the setting's value
+    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
+    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
+    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
+
+    # Return this value
+    return substring
+
+
+# --- Function definitions
+# Reads all settings from a file manager
+def read_file_manager(file):
+    settings = {}
+    with open(file) as contents:
+        for line in contents:
+            if "'" in line:
+                settings[line.split()[0]] = re.search(r"'(.*?)'", line).group(1)
+    return settings
+
+# Log file of one task
+def log_file_of(fm, gru_start, gru_count):
+    return Path(fm['outputPath']) / 'SUMMA_logs' / '{}_G{}-{}.txt'.format(fm['outFilePrefix'], gru_start, gru_start+gru_count-1)
+
+# Runs SUMMA for one task and returns the return code (-1 if SUMMA could not be started; see SUMMA_run_blocks_local.py)
+def run_task(summa_exe, fm_file, log_file, gru_start, gru_count):
+    log_file.parent.mkdir(parents=True, exist_ok=True)
+    return_code, _ = run_block(summa_exe, fm_file, log_file, gru_start, gru_count)
+    return return_code
+
+# Finds the daily flow at the domain outlet from the output files of one member
+def simulated_flow(fm, gru_area):
+
+    # Find the output files of each block; use daily files if SUMMA wrote outputs at several frequencies
+    files = glob.glob(fm['outputPath'] + fm['outFilePrefix'] + '_G*.nc')
+    frequencies = sorted(set(re.search(r'_G\d+-\d+_(\w+)\.nc$', file).group(1) for file in files))
+    frequency = 'day' if 'day' in frequencies else frequencies[0]
+    files = [file for file in files if file.endswith('_' + frequency + '.nc')]
+
+    # Sum runoff x area over all GRUs in all files
+    flow = None
+    for file in files:
+        with nc4.Dataset(file) as ds:
+            runoff = ds['averageRoutedRunoff']
+            values = np.moveaxis(np.ma.filled(runoff[:].astype('float64'), np.nan), runoff.dimensions.index('gru'), -1)
+            block_flow = values @ gru_area.reindex(ds['gruId'][:].astype(int)).values
+            times = nc4.num2date(ds['time'][:], ds['time'].units, getattr(ds['time'], 'calendar', 'standard'),
+                                 only_use_cftime_datetimes=False, only_use_python_datetimes=True)
+        block_flow = pd.Series(block_flow, index=pd.DatetimeIndex(times))
+        flow = block_flow if flow is None else flow.add(block_flow, fill_value=0)
+
+    return flow.resample('D').mean()
+
+# Kling-Gupta and Nash-Sutcliffe efficiencies
+def kge(sim, obs):
+    r = np.corrcoef(sim, obs)[0,1]
+    alpha = np.std(sim) / np.std(obs)
+    beta = np.mean(sim) / np.mean(obs)
+    return 1 - np.sqrt((r-1)**2 + (alpha-1)**2 + (beta-1)**2)
+
+def nse(sim, obs):
+    return 1 - np.sum((sim-obs)**2) / np.sum((obs-np.mean(obs))**2)
+
+
+# --- Main code
+if __name__ == '__main__':
+
+    # Arguments
+    if len(sys.argv) < 3:
+        sys.exit('Usage: python SUMMA_run_ensemble.py [file manager pattern] [GRUs per block] [optional: observations.csv] [optional: path/to/summa.exe]')
+    fm_files = sorted(glob.glob(sys.argv[1]))
+    block_size = int(sys.argv[2])
+    obs_file = sys.argv[3] if len(sys.argv) > 3 and sys.argv[3].lower() != 'none' else None
+    if len(sys.argv) > 4:
+        summa_exe = Path(sys.argv[4])
+    else:
+        summa_path = read_from_control(controlFolder/controlFile,'install_path_summa')
+        if summa_path == 'default':
+            summa_path = Path( read_from_control(controlFolder/controlFile,'root_path') ) / 'installs/summa/bin'
+        else:
+            summa_path = Path(summa_path) # make sure a user-specified path is a Path()
+        summa_exe = summa_path / read_from_control(controlFolder/controlFile,'exe_name_summa')
+    summa_exe = find_executable(summa_exe)
+    if len(fm_files) == 0:
+        sys.exit('Error: no file managers found matching {}'.format(sys.argv[1]))
+
+    # Read the file managers and check that all members share the same inputs and have unique outputs
+    fms = [read_file_manager(file) for file in fm_files]
+    for setting in ['settingsPath','attributeFile','forcingPath','forcingListFile','simStartTime','simEndTime']:
+        if len(set(fm[setting] for fm in fms)) > 1:
+            sys.exit('Error: ensemble members use different values of {}'.format(setting))
+    outputs = [fm['outputPath'] + fm['outFilePrefix'] for fm in fms]
+    if len(set(outputs)) < len(outputs):
+        sys.exit('Error: ensemble members must have a unique outputPath and outFilePrefix combination')
+    for fm in fms:
+        Path(fm['outputPath']).mkdir(parents=True, exist_ok=True)
+
+    # Find the GRUs and their area from the shared attributes file
+    with nc4.Dataset(fms[0]['settingsPath'] + fms[0]['attributeFile']) as att:
+        gru_ids = att['gruId'][:].astype(int)
+        hru_area = pd.Series(att['HRUarea'][:]).groupby(att['hru2gruId'][:].astype(int)).sum()
+    gru_area = hru_area.reindex(gru_ids)
+
+    # Define all tasks: members x GRU blocks
+    block_starts = np.arange(1, len(gru_ids)+1, block_size)
+    block_counts = np.minimum(block_size, len(gru_ids) - block_starts + 1)
+    tasks = [(ii, start, count) for ii in range(len(fms)) for start,count in zip(block_starts,block_counts)]
+
+    # Select the tasks of this array task, if this is an array job
+    array_id = os.environ.get('SLURM_ARRAY_TASK_ID')
+    if array_id is not None:
+        array_index = int(array_id) - int(os.environ.get('SLURM_ARRAY_TASK_MIN', default=0))
+        array_count = int(os.environ.get('SLURM_ARRAY_TASK_COUNT', default=1))
+        my_tasks = tasks[array_index::array_count]
+    else:
+        my_tasks = tasks
+
+    # Skip the tasks that were completed earlier
+    to_run = [(ii, start, count) for ii,start,count in my_tasks if not is_successful(log_file_of(fms[ii], start, count))]
+    print('Running {} out of {} tasks ({} members, {} GRU blocks each)'.format(len(to_run), len(my_tasks), len(fms), len(block_starts)))
+
+    # Run the tasks
+    ncpus = int(os.environ.get('SLURM_CPUS_PER_TASK',default=1))
+    with ThreadPoolExecutor(max_workers=ncpus) as executor:
+        list(executor.map(lambda task: run_task(summa_exe, fm_files[task[0]], log_file_of(fms[task[0]], task[1], task[2]), task[1], task[2]), to_run))
+
+    # Scores are only found once all tasks of all array tasks are done
+    if array_id is not None:
+        print('Array task done. Run this script again without an array job to find the scores.')
+        sys.exit(0)
+
+    # Find the status of each member
+    results = pd.DataFrame({'file_manager': [Path(file).name for file in fm_files],
+                            'member': [fm['outFilePrefix'] for fm in fms]})
+    is_done = np.array([is_successful(log_file_of(fms[ii], start, count)) for ii,start,count in tasks]).reshape(len(fms), len(block_starts))
+    results['blocks_successful'] = is_done.sum(axis=1)
+    results['blocks_failed'] = (~is_done).sum(axis=1)
+
+    # Find the scores of the members without failed blocks
+    if obs_file is not None:
+        obs = pd.read_csv(obs_file, index_col=0, parse_dates=True).iloc[:,0].resample('D').mean()
+        results['kge'] = np.nan
+        results['nse'] = np.nan
+        for ii,fm in enumerate(fms):
+            if is_done[ii].all():
+                sim = simulated_flow(fm, gru_area)
+                both = pd.concat([sim,obs], axis=1, join='inner').dropna()
+                results.loc[ii,'kge'] = kge(both.iloc[:,0].values, both.iloc[:,1].values)
+                results.loc[ii,'nse'] = nse(both.iloc[:,0].values, both.iloc[:,1].values)
+
+    # Save
+    results_file = Path(fm_files[0]).parent / 'ensemble_scores.csv'
+    results.to_csv(results_file, index=False)
+    print('{} out of {} members completed successfully. Results stored in {}'.format((results['blocks_failed'] == 0).sum(), len(fms), results_file))
@@ -0,0 +1,272 @@
+# Spin up SUMMA states by repeatedly simulating the same period
+# Runs SUMMA for blocks of GRUs (using the -g option) over a spin-up period and saves the states at the end of
+# the period (using the -r e option). The restart files of all blocks are merged into a single state file,
+# which is the initial conditions file of the next cycle. After each cycle, the storages in each HRU are
+# compared to those at the start of the cycle:
+# - Snow water equivalent (scalarSWE);
+# - Total water in the soil column (mLayerVolFracLiq and mLayerVolFracIce in the soil layers);
+# - Aquifer storage (scalarAquiferStorage).
+#
+# A block has converged if all storages in all its HRUs changed less than the tolerances below. Converged blocks
+# are not simulated again; their latest restart file is used in the merged state file. Cycles continue until all
+# blocks have converged or the maximum number of cycles is reached.
+#
+# Inputs, outputs and the spin-up period are taken from control_active.txt:
+# - The file manager is copied to 'fileManager_spinup.txt' with the spin-up period and folders;
+# - The first cycle starts from the initial conditions file in the file manager;
+# - SUMMA outputs and logs go into a 'spinup' folder inside the experiment output and log folders;
+# - The final states are stored as 'warmState.nc' in the SUMMA settings folder.
+#
+# Blocks are run in parallel on the number of CPUs in environment variable SLURM_CPUS_PER_TASK (default: 1).
+#
+# Usage: python SUMMA_spinup.py [GRUs per block] [maximum number of cycles] [optional: spin-up start 'YYYY-MM-DD HH:MM'] [optional: spin-up end 'YYYY-MM-DD HH:MM']
+
+# Modules
+import os
+import re
+import sys
+import numpy as np
+import netCDF4 as nc4
+from pathlib import Path
+from shutil import copyfile
+from concurrent.futures import ThreadPoolExecutor
+from SUMMA_run_blocks_local import find_executable, run_block as run_summa
+from SUMMA_merge_restarts_into_warmState import find_restart_files, plan_merge, check_gru_ranges, merge_restarts
+
+# --- User settings
+# Convergence tolerances per HRU: a storage has converged if |new - old| <= absolute + relative * |new|
+tolerances = {
+    'swe':     [1.0,   0.01], # [kg m-2, -]
+    'soil':    [1.0,   0.01], # [kg m-2, -]
+    'aquifer': [0.001, 0.01], # [m, -]
+}
+
+# Density of liquid water and ice, used to find total soil water [kg m-3]
+iden_water = 1000.
+iden_ice   = 917.
+
+
+# --- Control file handling
+# Easy access to control file folder
+controlFolder = Path('../0_control_files')
+
+# Store the name of the 'active' file in a variable
+controlFile = 'control_active.txt'
+
+# Function to extract a given setting from the control file
+def read_from_control( file, setting ):
+
+    # Open 'control_active.txt' and ...
+    with open(file) as contents:
+        for line in contents:
+
+            # ... find the line with the requested setting
+            if setting in line and not line.startswith('#'):
+                break
+
+    # Extract the setting's value
+    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
+    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
+    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
+
+    # Return this value
+    return substring
+
+# Function to specify a default path
+def make_default_path(suffix):
+
+    # Get the root path
+    rootPath = Path( read_from_control(controlFolder/controlFile,'root_path') )
+
+    # Get the domain folder
+    domainName = read_from_control(controlFolder/controlFile,'domain_name')
+    domainFolder = 'domain_' + domainName
+
+    # Specify the forcing path
+    defaultPath = rootPath / domainFolder / suffix
+
+    return defaultPath
+
+
+# --- Function definitions
+# Reads a variable with 'hru' as the last dimension
+def read_hru_last(ds, name):
+    var = ds[name]
+    return np.moveaxis(np.ma.filled(var[:].astype('float64'), np.nan), var.dimensions.index('hru'), -1)
+
+# Finds the storages that are checked for convergence, for all HRUs in a state file at once
+def read_storages(file):
+    with nc4.Dataset(file) as ds:
+        nSnow = read_hru_last(ds, 'nSnow')[0]
+        nSoil = read_hru_last(ds, 'nSoil')[0]
+        liq   = read_hru_last(ds, 'mLayerVolFracLiq')
+        ice   = read_hru_last(ds, 'mLayerVolFracIce')
+        depth = read_hru_last(ds, 'mLayerDepth')
+
+        # Soil layers are below the snow layers in each HRU
+        layer = np.arange(liq.shape[0])[:,np.newaxis]
+        is_soil = (layer >= nSnow) & (layer < nSnow + nSoil)
+        soil = np.where(is_soil, (liq*iden_water + ice*iden_ice) * depth, 0).sum(axis=0)
+
+        return {'swe':     read_hru_last(ds, 'scalarSWE')[0],
+                'soil':    soil,
+                'aquifer': read_hru_last(ds, 'scalarAquiferStorage')[0]}
+
+# Finds for each HRU if all its storages have converged
+def has_converged(old, new):
+    converged = np.ones(len(new['swe']), dtype=bool)
+    for name,(absolute,relative) in tolerances.items():
+        converged &= np.abs(new[name] - old[name]) <= absolute + relative * np.abs(new[name])
+    return converged
+
+# Writes a copy of the file manager with different settings
+def write_file_manager(template, file, settings):
+    with open(template) as src, open(file, 'w') as des:
+        for line in src:
+            name = line.split()[0] if line.strip() else ''
+            if name in settings:
+                line = re.sub(r"'.*?'", "'{}'".format(settings[name]), line, count=1)
+            des.write(line)
+
+# Reads a setting from the file manager
+def read_from_file_manager(file, setting):
+    with open(file) as src:
+        for line in src:
+            if line.split() and line.split()[0] == setting:
+                return re.search(r"'(.*)'", line).group(1)
+
+# Runs SUMMA for one block, saving the states at the end of the run, and returns the return code (-1 if SUMMA could
+# not be started; see SUMMA_run_blocks_local.py)
+def run_block(summa_exe, file_manager, log_path, gru_start, gru_count):
+    log_file = log_path / 'summa_log_G{}-{}.txt'.format(gru_start, gru_start+gru_count-1)
+    return_code, _ = run_summa(summa_exe, file_manager, log_file, gru_start, gru_count, ['-r','e'])
+    return return_code
+
+
+# --- Main code
+if __name__ == '__main__':
+
+    # Arguments
+    if len(sys.argv) < 3:
+        sys.exit('Usage: python SUMMA_spinup.py [GRUs per block] [maximum number of cycles] [optional: start] [optional: end]')
+    block_size = int(sys.argv[1])
+    max_cycles = int(sys.argv[2])
+
+    # Spin-up period; the experiment period by default
+    sim_start = sys.argv[3] if len(sys.argv) > 3 else read_from_control(controlFolder/controlFile,'experiment_time_start')
+    sim_end   = sys.argv[4] if len(sys.argv) > 4 else read_from_control(controlFolder/controlFile,'experiment_time_end')
+    if sim_start == 'default':
+        raw_time = read_from_control(controlFolder/controlFile,'forcing_raw_time') # downloaded forcing (years)
+        year_start,_ = raw_time.split(',') # split into separate variables
+        sim_start = year_start + '-01-01 00:00' # construct the filemanager field
+    if sim_end == 'default':
+        raw_time = read_from_control(controlFolder/controlFile,'forcing_raw_time') # downloaded forcing (years)
+        _,year_end = raw_time.split(',') # split into separate variables
+        sim_end   = year_end   + '-12-31 23:00' # construct the filemanager field
+
+    # SUMMA executable
+    summa_path = read_from_control(controlFolder/controlFile,'install_path_summa')
+    if summa_path == 'default':
+        summa_path = Path( read_from_control(controlFolder/controlFile,'root_path') ) / 'installs/summa/bin'
+    else:
+        summa_path = Path(summa_path) # make sure a user-specified path is a Path()
+    summa_exe = find_executable(summa_path / read_from_control(controlFolder/controlFile,'exe_name_summa'))
+
+    # Settings folder, file manager and attributes
+    settings_path = read_from_control(controlFolder/controlFile,'settings_summa_path')
+    if settings_path == 'default':
+        settings_path = make_default_path('settings/SUMMA') # outputs a Path()
+    else:
+        settings_path = Path(settings_path) # make sure a user-specified path is a Path()
+    filemanager_name = read_from_control(controlFolder/controlFile,'settings_summa_filemanager')
+    attribute_name = read_from_control(controlFolder/controlFile,'settings_summa_attributes')
+
+    # Spin-up output and log folders
+    experiment_id = read_from_control(controlFolder/controlFile,'experiment_id')
+    output_path = read_from_control(controlFolder/controlFile,'experiment_output_summa')
+    if output_path == 'default':
+        output_path = make_default_path('simulations/' + experiment_id + '/SUMMA') # outputs a Path()
+    else:
+        output_path = Path(output_path) # make sure a user-specified path is a Path()
+    log_path = read_from_control(controlFolder/controlFile,'experiment_log_summa')
+    if log_path == 'default':
+        log_path = make_default_path('simulations/' + experiment_id + '/SUMMA/SUMMA_logs') # outputs a Path()
+    else:
+        log_path = Path(log_path) # make sure a user-specified path is a Path()
+    spinup_path = output_path / 'spinup'
+    spinup_log_path = log_path / 'spinup'
+    spinup_path.mkdir(parents=True, exist_ok=True)
+    spinup_log_path.mkdir(parents=True, exist_ok=True)
+
+    # Spin-up file names
+    spinup_prefix = experiment_id + '_spinup'
+    spinup_state = 'warmState_spinup.nc'
+    spinup_filemanager = settings_path / 'fileManager_spinup.txt'
+    output_file = settings_path / 'warmState.nc'
+
+    # Define the GRU blocks and the HRUs in each block
+    with nc4.Dataset(settings_path/attribute_name) as att:
+        gru_ids = att['gruId'][:]
+        hru2gru = att['hru2gruId'][:]
+    sorter = np.argsort(gru_ids)
+    hru_per_gru = np.bincount(sorter[np.searchsorted(gru_ids, hru2gru, sorter=sorter)], minlength=len(gru_ids))
+    block_starts = np.arange(1, len(gru_ids)+1, block_size)
+    block_counts = np.minimum(block_size, len(gru_ids) - block_starts + 1)
+    hru_offsets = np.concatenate([[0], np.cumsum(hru_per_gru)])
+    block_hrus = [slice(hru_offsets[start-1], hru_offsets[start-1+count]) for start,count in zip(block_starts,block_counts)]
+    print('Spinning up {} GRUs in {} blocks for period {} to {}'.format(len(gru_ids), len(block_starts), sim_start, sim_end))
+
+    # Number of parallel runs
+    ncpus = int(os.environ.get('SLURM_CPUS_PER_TASK',default=1))
+
+    # Run the cycles
+    init_file = read_from_file_manager(settings_path/filemanager_name, 'initConditionFile')
+    is_converged = np.zeros(len(block_starts), dtype=bool)
+    for cycle in range(1, max_cycles+1):
+
+        # Make the file manager for this cycle
+        write_file_manager(settings_path/filemanager_name, spinup_filemanager,
+                           {'simStartTime': sim_start, 'simEndTime': sim_end, 'outFilePrefix': spinup_prefix,
+                            'outputPath': str(spinup_path) + '/', 'initConditionFile': init_file})
+
+        # Remove the previous restart files of the blocks that are run again, so that only the newest remain
+        to_run = np.flatnonzero(~is_converged)
+        files,gru_ranges = find_restart_files(spinup_path, spinup_prefix, '')
+        for file,(start,_) in zip(files,gru_ranges):
+            if start in block_starts[to_run]:
+                file.unlink()
+
+        # Run the blocks that have not converged yet
+        with ThreadPoolExecutor(max_workers=ncpus) as executor:
+            return_codes = list(executor.map(lambda i: run_block(summa_exe, spinup_filemanager, spinup_log_path,
+                                                                 block_starts[i], block_counts[i]), to_run))
+        is_failed = np.array(return_codes) != 0
+        if is_failed.any():
+            sys.exit('Error: SUMMA failed for blocks starting at GRU {}; see logs in {}'.format(block_starts[to_run[is_failed]], spinup_log_path))
+
+        # Compare the storages at the end of this cycle to those at the start
+        old = read_storages(settings_path/init_file)
+        files,gru_ranges = find_restart_files(spinup_path, spinup_prefix, '')
+        for file,(start,_) in zip(files,gru_ranges):
+            i = np.flatnonzero(block_starts == start)[0]
+            if not is_converged[i]:
+                new = read_storages(file)
+                is_converged[i] = has_converged({name: value[block_hrus[i]] for name,value in old.items()}, new).all()
+
+        # Merge the newest restart files of all blocks into the initial conditions of the next cycle
+        _, _, gru_offsets = plan_merge(files)
+        check_gru_ranges(gru_ranges, gru_offsets)
+        merge_restarts(files, settings_path/(spinup_state + '.tmp'), settings_path/attribute_name)
+        os.replace(settings_path/(spinup_state + '.tmp'), settings_path/spinup_state)
+        init_file = spinup_state
+
+        # Show progress
+        print('Cycle {}: {} out of {} blocks converged'.format(cycle, is_converged.sum(), len(is_converged)))
+        if is_converged.all():
+            break
+
+    # Store the final states
+    copyfile(settings_path/spinup_state, output_file)
+    if not is_converged.all():
+        print('Blocks starting at GRU {} did not converge in {} cycles'.format(block_starts[~is_converged], max_cycles))
+    print('Stored spin-up states in {}'.format(output_file))
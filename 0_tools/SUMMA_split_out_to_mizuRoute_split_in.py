@@ -1,11 +1,19 @@
 # concatenate SUMMA domain-split outputs into time-split files
 # Splits on calendar years by default, months optional
+#
+# Each SUMMA output file is opened once per group of output files (see max_open below) and only the variable of
+# interest is read, one period at a time. Each period is written straight into its place in a preallocated output file
+# for that period, at the position of the file's GRUs. The output files contain the variable of interest, time and the
+# GRU (or HRU) IDs. Output files are written under a temporary name and renamed once complete, so that existing
+# output files can safely be skipped when the script is run again.
 
 import os
 import sys
 import glob
-import xarray as xr
+import numpy as np
+import netCDF4 as nc4
 from pathlib import Path
+from SUMMA_concat_split_summa import sort_split_files
 
 
 # --- check args
@@ -20,7 +28,7 @@ if len(sys.argv) != 9:
                arg7: final data year,              e.g. 2019
                arg8: flag to split by months,           True/False""" % sys.argv[0])
     sys.exit(0)
-    
+
 # otherwise continue
 src_dir = sys.argv[1] # e.g. '/path/to/summa/out/'
 src_pat = sys.argv[2] # e.g. 'run1_G*_timestep.nc'
@@ -45,67 +53,107 @@ split_m = sys.argv[8] # Split by months too: True/False
 # Print flag
 progres = False
 
-# Make sure we're dealing with the right kind of inputs 
-src_dir = Path(src_dir) 
+# Maximum number of output files that are written at the same time
+max_open = 100
+
+# Make sure we're dealing with the right kind of inputs
+src_dir = Path(src_dir)
 des_dir = Path(des_dir)
-split_s = int(split_s) 
+split_s = int(split_s)
 split_e = int(split_e)
+split_m = split_m.lower() == 'true'
 
 # Ensure the output path exists
-des_dir.mkdir(parents=True, exist_ok=True) 
+des_dir.mkdir(parents=True, exist_ok=True)
 
-# Get the names of all inputs
+# Get the names of all inputs, ordered by their first GRU
 src_files = glob.glob(str( src_dir / src_pat ))
-src_files.sort()
-
-# define the extraction function
-def make_new_file(time):
-    
-    # Check if the file already exists and skip if sort
-    if os.path.isfile(des_dir / des_fil.format(time)):
-        print('file for {} already exists. Skipping.'.format(time))
-        return
-    else:
-        print('Starting on file for {}.'.format(time))
-    
-    # Initialize a variable
-    new = None
-    
-    # Loop over all identified files
-    for src_file in src_files:
-        
-        # Progress print
-        if progres:
-            print('    ' + src_file)
-        
-        # Open the subset we need
-        ds = xr.open_dataset(src_file).sel(time=time)
-        
-        # Keep only the variable of interest
-        for var,da in ds.data_vars.items():
-            if not var == src_var:
-                ds = ds.drop(var)
-        
-        # Store/append
-        if new is None:
-            new = ds
-        else:
-            new = xr.merge([new,ds])
-            
-        ds.close()
-            
-    # Done looping, save to file
-    new.to_netcdf(des_dir / des_fil.format(time))
-    
-    return # nothing, already saved
-
-
-# run the loop
-for year in range(split_s,split_e+1):
-    if split_m:
-        for month in range(1,13):
-            this_time = str(year)+'-'+str(month).zfill(2)
-            make_new_file(this_time)
+if len(src_files) == 0:
+    sys.exit('Error: no files found matching {}'.format(src_dir / src_pat))
+src_files = sort_split_files(src_files)
+
+# --- Find the time steps of each period and the position of each file's GRUs
+with nc4.Dataset(src_files[0]) as ds:
+    var = ds[src_var]
+    space = 'gru' if 'gru' in var.dimensions else 'hru'
+    id_var = space + 'Id'
+    times = ds['time'][:]
+    time_atts = {att: ds['time'].getncattr(att) for att in ds['time'].ncattrs()}
+    dates = nc4.num2date(times, ds['time'].units, getattr(ds['time'], 'calendar', 'standard'))
+
+space_count = []
+for src_file in src_files:
+    with nc4.Dataset(src_file) as ds:
+        if len(ds.dimensions['time']) != len(times):
+            sys.exit('Error: {} has {} time steps instead of {}'.format(src_file, len(ds.dimensions['time']), len(times)))
+        space_count.append(len(ds.dimensions[space]))
+offsets = np.concatenate([[0], np.cumsum(space_count)])
+
+# Time steps of each period; periods are contiguous because time is sorted
+if split_m:
+    keys = np.array(['{}-{:02d}'.format(date.year, date.month) for date in dates])
+    wanted = ['{}-{:02d}'.format(year, month) for year in range(split_s,split_e+1) for month in range(1,13)]
+else:
+    keys = np.array([str(date.year) for date in dates])
+    wanted = [str(year) for year in range(split_s,split_e+1)]
+periods = {}
+for key in wanted:
+    steps = np.flatnonzero(keys == key)
+    if os.path.isfile(des_dir / des_fil.format(key)):
+        print('file for {} already exists. Skipping.'.format(key))
+    elif len(steps) == 0:
+        print('no data for {}. Skipping.'.format(key))
     else:
-        this_time = str(year)
-        make_new_file(this_time)
\ No newline at end of file
+        periods[key] = slice(steps[0], steps[-1]+1)
+
+# define the function that creates an empty output file for one period
+def make_new_file(ds, file, steps):
+    var = ds[src_var]
+    new = nc4.Dataset(file, 'w', format='NETCDF4')
+    for dim in var.dimensions:
+        new.createDimension(dim, steps.stop - steps.start if dim == 'time' else offsets[-1] if dim == space else len(ds.dimensions[dim]))
+    new.createVariable('time', ds['time'].datatype, ('time',))
+    new['time'].setncatts(time_atts)
+    new['time'][:] = times[steps]
+    new.createVariable(id_var, ds[id_var].datatype, (space,))
+    new[id_var].setncatts({att: ds[id_var].getncattr(att) for att in ds[id_var].ncattrs()})
+    fill_value = var.getncattr('_FillValue') if '_FillValue' in var.ncattrs() else None
+    new.createVariable(src_var, var.datatype, var.dimensions, fill_value=fill_value)
+    new[src_var].setncatts({att: var.getncattr(att) for att in var.ncattrs() if att != '_FillValue'})
+    return new
+
+# --- Copy the data of each file into all output files, for groups of at most max_open output files
+keys = list(periods)
+for group in range(0, len(keys), max_open):
+    group_keys = keys[group:group+max_open]
+    print('Starting on files for {} to {}.'.format(group_keys[0], group_keys[-1]))
+    temp_files = {key: des_dir / (des_fil.format(key) + '.part') for key in group_keys}
+    with nc4.Dataset(src_files[0]) as ds:
+        outputs = {key: make_new_file(ds, temp_files[key], periods[key]) for key in group_keys}
+    try:
+        for ii,src_file in enumerate(src_files):
+
+            # Progress print
+            if progres:
+                print('    ' + src_file)
+
+            with nc4.Dataset(src_file) as ds:
+                var = ds[src_var]
+                axis = var.dimensions.index(space)
+                target = slice(offsets[ii], offsets[ii+1])
+                ids = ds[id_var][:]
+                for key in group_keys:
+                    outputs[key][id_var][target] = ids
+                    index = [slice(None)] * len(var.dimensions)
+                    index[var.dimensions.index('time')] = periods[key]
+                    values = var[tuple(index)]
+                    index = [slice(None)] * len(var.dimensions)
+                    index[axis] = target
+                    outputs[key][src_var][tuple(index)] = values
+    finally:
+        for new in outputs.values():
+            new.close()
+
+    # Done with this group, move the files to their final names
+    for key in group_keys:
+        os.replace(temp_files[key], des_dir / des_fil.format(key))
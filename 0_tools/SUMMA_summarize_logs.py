@@ -4,9 +4,9 @@ Usage: python summarize_logs.py [log_folder] [name_of_summary_file.txt] [log fil
     
 # Modules
 import os
-import re
 import sys
 import statistics as sts
+from SUMMA_log_index import index_logs
 
 # ----------------------
 # Set defaults
@@ -38,82 +38,6 @@ else: # at least 2 elements in sys.argv; len(sys.argv) cannot be zero or we woul
 # End of input arguments
 # ----------------------
         
-# -------------   
-# Sub functions
-
-# Define a function to grab the last line in a file
-# See: https://stackoverflow.com/questions/136168/get-last-n-lines-of-a-file-similar-to-tail
-def tail(folder, file, lines=1, _buffer=4098):
-        
-    """Tail a file and get X lines from the end"""
-    
-    # open the file
-    with open(folder + '/' + file,'r') as f: 
-    
-        # place holder for the lines found
-        lines_found = []
-
-        # block counter will be multiplied by buffer to get the block size from the end
-        block_counter = -1
-
-        # loop until we find X lines
-        while len(lines_found) < lines:
-            try:
-                f.seek(block_counter * _buffer, os.SEEK_END)
-            except IOError:  # either file is too small, or too many lines requested
-                f.seek(0)
-                lines_found = f.readlines()
-                break
-
-            lines_found = f.readlines()
-
-            # decrement the block counter to get the next X bytes
-            block_counter -= 1
-
-    return lines_found[-lines:]
-    
-# Define a function to handle the three types of log results: success, SUMMA error, non-SUMMA error
-def determine_output(folder,file,nLines=2):
-    
-    # initialize outputs
-    success, summa, other = [0,0,0] # error flags
-    time = -1 # times are only extracted for successful simulations - a default negative time allows filtering outside this function
-    
-    # get the file contents
-    log_txt = tail(folder,file,nLines)
-    
-    # loop over the lines in the log text to find what happened
-    msg = 'no line read' # initialize output
-    line = None
-    for line in log_txt:
-                
-        # determine if the log contains a SUMMA statement
-        if 'successfully' in line:
-                       
-            # determine time taken
-            more_lines = tail(folder,file,6) # extracting bottom 6 lines includes time in [h]
-            time = float(re.sub("[^\d\.]", "", more_lines[0])) # hours should be in top entry; store as float                        
-            
-            # process output flags
-            success = 1
-            msg = 'success after ' + '{:.2f}'.format(time) + ' h \n' # message string
-            return success, summa, other, msg, time # we know what happened, stop function call
-            
-        elif 'FATAL ERROR' in line:
-            summa = 1
-            msg = line
-            return success, summa, other, msg, time # we know what happened, stop function call
-        
-    # if we reach this, no SUMMA termination statement was found
-    other = 1
-    if line is not None:
-        msg = 'check SLURM logs - simulation terminated early at: ' + line
-    
-    return success, summa, other, msg, time
-    
-# End of sub functions
-# --------------------
-
 # -------------------
 # Start of processing
 
@@ -123,21 +47,16 @@ try:
 except OSError:
     pass
 
-# Find the .txt files in the folder
-files = []
-for file in os.listdir(folder):
-    #if file.endswith(".txt"):
-    if file.endswith(ext):
-        files.append(file)
-            
-# Sort the list
-files.sort()            
-            
-# Initialize case counters
-total_success, total_summa, total_other = [0,0,0]
+# Find the result contained in each log file; only new or changed logs are read
+logs = index_logs(folder, ext, exclude=[summaryFile])
+
+# Count the cases
+total_success = (logs['status'] == 'success').sum()
+total_summa   = (logs['status'] == 'SUMMA error').sum()
+total_other   = (logs['status'] == 'early termination').sum()
 
-# Initialize time list
-computation_time = []
+# Save the computation time of successful simulations, in hours
+computation_time = list(logs.loc[logs['status'] == 'success', 'time_total'].dropna() / 3600)
 
 # Open the summary file
 with open(folder + '/' + summaryFile, 'w') as sf:
@@ -146,21 +65,14 @@ with open(folder + '/' + summaryFile, 'w') as sf:
     sf.write('Summarizing log files in ' + folder + '\n \n')
     sf.write('Log files' + '\n')
     
-    # Loop over the log files
-    for file in files:
-    
-        # Find the result contained in each log file 
-        success, summa, other, msg, time = determine_output(folder,file)  # default of using last 2 lines should suffice to catch all success/error cases
-  
-        # Increment the counters
-        total_success += success
-        total_summa   += summa
-        total_other   += other
-
-        # Save the computation time (time == -1 if error encountered)
-        computation_time.append(time)
-
-        # Add the file name and error message to the summary file
+    # Add the file name and error message of each log to the summary file
+    for file,status,message,time in zip(logs['file'], logs['status'], logs['message'], logs['time_total']/3600):
+        if status == 'success':
+            msg = 'success after ' + '{:.2f}'.format(time) + ' h \n'
+        elif status == 'SUMMA error':
+            msg = message + '\n'
+        else:
+            msg = 'check SLURM logs - simulation terminated early at: ' + message + '\n'
         sf.write(file + '\t' + msg) 
 
     # Calculate percentages
@@ -170,7 +82,8 @@ with open(folder + '/' + summaryFile, 'w') as sf:
     pct_other   = total_other / total * 100
     
     # Calculate computation time stats
-    computation_time = [time for time in computation_time if time >= 0] # remove negative times that are associated with simulations that return an error
+    if len(computation_time) == 0:
+        computation_time = [float('nan')] # no successful simulations
     st_min    = min(computation_time)
     st_max    = max(computation_time)
     st_mean   = sts.mean(computation_time)
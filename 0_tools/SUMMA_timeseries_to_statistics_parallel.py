@@ -1,83 +1,220 @@
-'''Loads timeseries of simulated variables and computes a variety of statistics.'''
+'''Loads timeseries of simulated variables and computes a variety of statistics.
+Works on SUMMA and mizuRoute outputs that are split in space (e.g. SUMMA runs with -g; all files have the same time
+steps) or in time (e.g. mizuRoute's yearly files; all files have the same GRUs or segments). All statistics of all
+variables are computed from a single read of each file, in blocks of GRUs/HRUs/segments that contain the full time
+series, so that memory use is limited and quantiles are exact. Blocks are processed in parallel on the number of CPUs
+given by SLURM_CPUS_PER_TASK. Results are placed in a single output file at the position of each block: spatial
+blocks in order of their first GRU (from the _G[start]-[end] part of SUMMA's file names), with the GRU, HRU or segment
+IDs (gruId, hruId, reachID, basinID) of all blocks.
+
+Statistics:
+- mean, min, max, std, sum: over the full time series, stored with a time dimension of length 1 and time bounds
+  (time_bnds) of the first and last time step, as CDO's timmean, timmin etc. would;
+- p[percentile], e.g. p5, p50 or p95: percentiles over the full time series, stored in the same way;
+- monthly_[mean/min/max/std/sum] and seasonal_[mean/min/max/std/sum]: climatologies with a month (1-12) or season
+  (DJF, MAM, JJA, SON) dimension.
+Output variables are named [variable]_[statistic], except if only one statistic over the full time series is asked
+for: the output variables then have the same name as the input variables, so that the output can replace that of CDO.
+
+Usage: python SUMMA_timeseries_to_statistics_parallel.py ['path/to/files_*.nc'] [path/to/output.nc] [variable(s), e.g. scalarTotalET,scalarTotalRunoff] [statistic(s), e.g. mean,p95,monthly_mean]'''
 
 import os
+import re
+import sys
 import glob
-import xarray as xr
-from pathlib import Path
+import warnings
+import numpy as np
+import netCDF4 as nc4
 import multiprocessing as mp
+from datetime import datetime
+from SUMMA_concat_split_summa import sort_split_files
 
 # Settings
-src_dir = '/scratch/wknoben/summaWorkflow_data/domain_NorthAmerica/simulations/run1/SUMMA'
-src_pat = 'run1_G*_timestep.nc'
-des_dir = '/scratch/wknoben/summaWorkflow_data/domain_NorthAmerica/simulations/run1/statistics'
-des_fil = 'run1_summa_day_stats_{}_{}_{}.nc'
-settings= {'wallClockTime': 'mean'}
-viz_fil = 'run1_summa_day_stats_{}_{}.nc'
-viz_fil = viz_fil.format(','.join(settings.keys()),','.join(settings.values()))
+max_values = 2.5e7 # maximum number of values read at once per variable
+id_names = ['gruId','hruId','reachID','basinID'] # ID variables that are copied to the output file
+reductions = {'mean': np.nanmean, 'min': np.nanmin, 'max': np.nanmax, 'std': np.nanstd, 'sum': np.nansum}
+seasons = {'DJF': [12,1,2], 'MAM': [3,4,5], 'JJA': [6,7,8], 'SON': [9,10,11]}
 
-# Make sure we're dealing with the right kind of inputs 
-src_dir = Path(src_dir) 
-des_dir = Path(des_dir)
+# -- functions
+def check_statistic(stat):
+    '''Returns True if a statistic name is known'''
+    name = stat.split('_',1)[1] if stat.startswith(('monthly_','seasonal_')) else stat
+    return name in reductions or (re.fullmatch(r'p\d+(\.\d+)?', name) is not None and float(name[1:]) <= 100)
 
-# Ensure the output path exists
-des_dir.mkdir(parents=True, exist_ok=True) 
+def reduce(data, stat):
+    '''Computes one statistic over the first axis of data'''
+    if stat in reductions:
+        return reductions[stat](data, axis=0)
+    return np.nanpercentile(data, float(stat[1:]), axis=0)
 
-# Get the names of all inputs
-src_files = glob.glob(str( src_dir / src_pat ))
-src_files.sort()
+def compute_statistics(task):
+    '''Reads the time series of one block from one or more files and computes all statistics of all variables'''
+    parts, variables, statistics = task
 
-# -- functions
-def run_loop(file):
-    
-    # extract the subset IDs
-    subset = file.split('/')[-1].split('_')[1]
-    
-    # pass if file exists already
-    if os.path.isfile(des_dir / 'run1_summa_day_stats_mean_wallClockTime_{}'.format(subset)):
-        return
-    
-    # open file
-    dat = xr.open_dataset(file)
-    
-    # compute the requested statistics
-    for var,stat in settings.items():
-        
-        # Select the case
-        if stat == 'mean':
-            new = dat[var].mean(dim='time')
-        elif stat == 'max':
-            new = dat[var].max(dim='time')
-        
-        new.to_netcdf(des_dir / des_fil.format(stat,var,subset))
-    return
-    
-def merge_subsets_into_one(src,pattern,des,name):
-    
-    '''Merges all files in {src} that match {pattern} into one file stored in /{des}/{name.nc}'''
-    
-    # Find all files
-    src_files = glob.glob(str( src / pattern ))
-    
-    # Merge into one
-    out = xr.merge([xr.open_dataset(file) for file in src_files])
-    
-    # save to file
-    out.to_netcdf(des / name)
-    
-    return #nothing
+    # Read the time series of the block; parts of time-split files are appended in time
+    months = []
+    data = {var: [] for var in variables}
+    for file,space,space_slice in parts:
+        with nc4.Dataset(file) as ds:
+            dates = nc4.num2date(ds['time'][:], ds['time'].units, getattr(ds['time'], 'calendar', 'standard'))
+            months.append(np.array([date.month for date in dates]))
+            for var in variables:
+                index = [slice(None)] * len(ds[var].dimensions)
+                index[ds[var].dimensions.index(space)] = space_slice
+                values = np.ma.filled(ds[var][tuple(index)].astype('float64'), np.nan)
+                data[var].append(np.moveaxis(values, ds[var].dimensions.index('time'), 0))
+    months = np.concatenate(months)
+
+    # Compute the statistics
+    results = {}
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning) # all-NaN time series give NaN
+        for var in variables:
+            values = np.concatenate(data[var], axis=0)
+            for stat in statistics:
+                if stat.startswith('monthly_'):
+                    groups = [[month] for month in range(1,13)]
+                elif stat.startswith('seasonal_'):
+                    groups = list(seasons.values())
+                else:
+                    results[(var,stat)] = reduce(values, stat)[np.newaxis]
+                    continue
+                result = np.full((len(groups),) + values.shape[1:], np.nan)
+                for ii,group in enumerate(groups):
+                    select = np.isin(months, group)
+                    if select.any():
+                        result[ii] = reduce(values[select], stat.split('_',1)[1])
+                results[(var,stat)] = result
+    return results
 # -- end functions
 
-# -- start parallel processing
-ncpus = int(os.environ.get('SLURM_CPUS_PER_TASK',default=1))
+# -- start processing
 if __name__ == "__main__":
-    pool = mp.Pool(processes=ncpus)
-    pool.map(run_loop,src_files)
-    pool.close()
-# -- end parallel processing
 
-# merge the individual files into one for further vizualization
-merge_subsets_into_one(des_dir,des_fil.replace('{}','*'),des_dir,viz_fil)
+    # Arguments
+    if len(sys.argv) != 5:
+        sys.exit("Usage: python SUMMA_timeseries_to_statistics_parallel.py ['path/to/files_*.nc'] [path/to/output.nc] [variable(s)] [statistic(s)]")
+    src_files = glob.glob(sys.argv[1])
+    des_file = sys.argv[2]
+    variables = sys.argv[3].split(',')
+    statistics = sys.argv[4].split(',')
+    if len(src_files) == 0:
+        sys.exit('Error: no files found matching {}'.format(sys.argv[1]))
+    for stat in statistics:
+        if not check_statistic(stat):
+            sys.exit('Error: unknown statistic {}'.format(stat))
+
+    # Headers: spatial dimension of each variable, time range and spatial size of each file
+    with nc4.Dataset(src_files[0]) as ds:
+        time_units = ds['time'].units
+        calendar = getattr(ds['time'], 'calendar', 'standard')
+        time_atts = {att: ds['time'].getncattr(att) for att in ds['time'].ncattrs() if att != '_FillValue'}
+        space_of = {}
+        for var in variables:
+            if var not in ds.variables:
+                sys.exit('Error: variable {} not found in {}'.format(var, src_files[0]))
+            space = [dim for dim in ds[var].dimensions if dim != 'time']
+            if 'time' not in ds[var].dimensions or len(space) != 1:
+                sys.exit('Error: variable {} must have dimensions time and one spatial dimension'.format(var))
+            space_of[var] = space[0]
+        var_atts = {var: {att: ds[var].getncattr(att) for att in ds[var].ncattrs() if att != '_FillValue'} for var in variables}
+        id_vars = {name: ds[name].dimensions[0] for name in id_names if name in ds.variables and len(ds[name].dimensions) == 1}
+    spaces = sorted(set(space_of.values()))
+    all_spaces = sorted(set(spaces) | set(id_vars.values()))
+
+    first_time, last_time, steps, sizes = [], [], [], []
+    for file in src_files:
+        with nc4.Dataset(file) as ds:
+            times = nc4.date2num(nc4.num2date(ds['time'][[0,-1]], ds['time'].units, calendar), time_units, calendar)
+            first_time.append(times[0])
+            last_time.append(times[1])
+            steps.append(len(ds.dimensions['time']))
+            sizes.append({space: len(ds.dimensions[space]) for space in all_spaces})
+
+    # Split in space if all files start at the same time, in time otherwise
+    split_in_space = len(set(first_time)) == 1
+    if split_in_space:
+        order = sort_split_files(src_files)
+    else:
+        order = [file for _,file in sorted(zip(first_time, src_files))]
+    sizes = [sizes[src_files.index(file)] for file in order]
+    src_files = order
+    total_steps = steps[0] if split_in_space else sum(steps)
+
+    # Blocks of space that are read at once, and their position in the output
+    tasks, targets = [], []
+    for space in spaces:
+        space_vars = [var for var in variables if space_of[var] == space]
+        step = max(1, int(max_values // total_steps))
+        if split_in_space:
+            offset = 0
+            for file,size in zip(src_files, sizes):
+                for start in range(0, size[space], step):
+                    block = slice(start, min(start+step, size[space]))
+                    tasks.append(([(file, space, block)], space_vars, statistics))
+                    targets.append((space, slice(offset+block.start, offset+block.stop)))
+                offset += size[space]
+        else:
+            for start in range(0, sizes[0][space], step):
+                block = slice(start, min(start+step, sizes[0][space]))
+                tasks.append(([(file, space, block) for file in src_files], space_vars, statistics))
+                targets.append((space, block))
+
+    # Create the output file
+    plain = [stat for stat in statistics if not stat.startswith(('monthly_','seasonal_'))]
+    keep_names = len(statistics) == 1 and len(plain) == 1
+    with nc4.Dataset(des_file, 'w', format='NETCDF4') as des:
+        des.setncattr('History', 'Created ' + datetime.now().strftime('%Y/%m/%d %H:%M:%S') + ' by SUMMA_timeseries_to_statistics_parallel.py from {} files'.format(len(src_files)))
+        for space in all_spaces:
+            des.createDimension(space, sum(size[space] for size in sizes) if split_in_space else sizes[0][space])
+
+        # Time and its bounds
+        des.createDimension('time', 1)
+        des.createDimension('bnds', 2)
+        des.createVariable('time', 'f8', ('time',))
+        des['time'].setncatts(time_atts)
+        des['time'].setncattr('bounds', 'time_bnds')
+        des['time'][:] = (min(first_time) + max(last_time)) / 2
+        des.createVariable('time_bnds', 'f8', ('time','bnds'))
+        des['time_bnds'][:] = [[min(first_time), max(last_time)]]
+        if any(stat.startswith('monthly_') for stat in statistics):
+            des.createDimension('month', 12)
+            des.createVariable('month', 'i4', ('month',))
+            des['month'][:] = np.arange(1,13)
+        if any(stat.startswith('seasonal_') for stat in statistics):
+            des.createDimension('season', len(seasons))
+            des.createVariable('season', str, ('season',))
+            des['season'][:] = np.array(list(seasons), dtype=object)
+
+        # IDs of all elements
+        for name,space in id_vars.items():
+            ids = []
+            for file in (src_files if split_in_space else src_files[:1]):
+                with nc4.Dataset(file) as ds:
+                    ids.append(ds[name][:])
+                    datatype = ds[name].datatype
+                    atts = {att: ds[name].getncattr(att) for att in ds[name].ncattrs() if att != '_FillValue'}
+            des.createVariable(name, datatype, (space,))
+            des[name].setncatts(atts)
+            des[name][:] = np.concatenate(ids)
+
+        # Statistics
+        for var in variables:
+            for stat in statistics:
+                name = var if keep_names else '{}_{}'.format(var, stat)
+                first_dim = 'month' if stat.startswith('monthly_') else 'season' if stat.startswith('seasonal_') else 'time'
+                des.createVariable(name, 'f8', (first_dim, space_of[var]), fill_value=-9999.)
+                des[name].setncatts(var_atts[var])
+                des[name].setncattr('statistic', stat)
+
+        # Compute the statistics of each block in parallel and store these in place
+        ncpus = int(os.environ.get('SLURM_CPUS_PER_TASK',default=1))
+        with mp.Pool(processes=ncpus) as pool:
+            for (space,target),results in zip(targets, pool.imap(compute_statistics, tasks)):
+                for (var,stat),values in results.items():
+                    name = var if keep_names else '{}_{}'.format(var, stat)
+                    des[name][:,target] = np.ma.masked_invalid(values)
+                print('Done: {} {}-{}'.format(space, target.start+1, target.stop), flush=True)
 
-# remove the individual files for cleanliness
-for file in glob.glob(des_fil.replace('{}','*')):
-    os.remove(file)
\ No newline at end of file
+    print('Statistics stored in {}'.format(des_file))
+# -- end processing
@@ -105,7 +105,7 @@ fi
 #---------------------------------
 # Create .tif file
 #---------------------------------
-gdal_translate -co COMPRESS="DEFLATE" -co BIGTIFF=$bigtiff_flag $vrt_file $tif_file
+gdal_translate -co COMPRESS="DEFLATE" -co TILED=YES -co BIGTIFF=$bigtiff_flag $vrt_file $tif_file
 
 
 #---------------------------------
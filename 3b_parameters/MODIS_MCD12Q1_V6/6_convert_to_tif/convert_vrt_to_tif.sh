@@ -62,7 +62,7 @@ tif_file="${dest_path}/$(basename "$vrt_file" .vrt).tif"
 #---------------------------------
 # Create .tif file
 #---------------------------------
-gdal_translate -co "COMPRESS=DEFLATE" $vrt_file $tif_file
+gdal_translate -co "COMPRESS=DEFLATE" -co "TILED=YES" $vrt_file $tif_file
 
 
 #---------------------------------
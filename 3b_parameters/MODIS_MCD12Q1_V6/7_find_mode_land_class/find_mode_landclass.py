@@ -2,12 +2,12 @@
 
 # Modules
 import os
+import sys
 import numpy as np
 from pathlib import Path
-import scipy.stats as sc
 from shutil import copyfile
 from datetime import datetime
-from osgeo import gdal, ogr, osr
+from osgeo import gdal
 
 # --- Control file handling
 # Easy access to control file folder
@@ -51,6 +51,17 @@ def make_default_path(suffix):
     return defaultPath
     
 
+# --- Block-wise raster helpers
+# The windowing and threading code is shared with the intersection scripts in 4b_remapping/1_topo. Like the control
+# file, this folder is found relative to the folder of this script, so the script must be run from its own folder
+# (see README.md)
+helperFolder = Path('../../../4b_remapping/1_topo')
+if not (helperFolder / 'raster_windows.py').is_file():
+    sys.exit('Error: {} not found. Run this script from its own folder in the workflow repository.'.format(helperFolder / 'raster_windows.py'))
+sys.path.append(str(helperFolder))
+from raster_windows import make_windows, get_dataset, close_datasets, map_windows
+
+
 # --- Find source and destination locations
 # Find where the soil classes are
 landClassPath = read_from_control(controlFolder/controlFile,'parameter_land_tif_path')
@@ -84,88 +95,69 @@ dest_file = read_from_control(controlFolder/controlFile,'parameter_land_tif_name
 
 
 # --- Function definition
-# Opens geotif file, extracts data from a single band and computes corner & center coordinates in lat/lon
-def open_geotif(file,band):
-    
-    # Do the things
-    ds = gdal.Open(file) # open the file
-    band = ds.GetRasterBand(band) # get the data band; there should be 18 for each of the 18 years
-    data = band.ReadAsArray() # convert to numpy array for further manipulation
-    width = ds.RasterXSize # pixel width
-    height = ds.RasterYSize # pixel height
-    rasterSize = [width,height]
-    geoTransform = ds.GetGeoTransform() # geolocation
-    boundingBox = np.zeros((5,2)) # coordinates of bounding box
-    boundingBox[0,0] = boundingBox[1,0] = geoTransform[0]
-    boundingBox[0,1] = boundingBox[2,1] = geoTransform[3]
-    boundingBox[2,0] = boundingBox[3,0] = geoTransform[0] + width*geoTransform[1]
-    boundingBox[1,1] = boundingBox[3,1] = geoTransform[3] + height*geoTransform[5]
-    boundingBox[4,0] = geoTransform[0] + (width/2)*geoTransform[1]
-    boundingBox[4,1] = geoTransform[3] + (height/2)*geoTransform[5]
+# Finds the most common value along the first axis of an integer array (ties go to the lowest value)
+def mode_of_classes(data):
     
-    return data, geoTransform, rasterSize, boundingBox
+    # Map the class values onto a compact range 0,1,..,n-1 with a lookup table
+    offset = data.min()
+    values = (data - offset).astype(np.intp)
+    present = np.flatnonzero(np.bincount(values.ravel()))
+    lookup = np.zeros(present[-1]+1, dtype=np.intp)
+    lookup[present] = np.arange(len(present))
+    codes = lookup[values].reshape(data.shape[0],-1)
     
-# Writes data into a new geotif file
-# Source: https://gis.stackexchange.com/questions/199477/gdal-python-cut-geotiff-image/199565
-def write_geotif_sameDomain(src_file,des_file,des_data):
+    # Count the occurrence of each class per pixel, one band at a time
+    pixels = np.arange(codes.shape[1])
+    counts = np.zeros((len(present),codes.shape[1]), dtype=np.min_scalar_type(data.shape[0]))
+    for band in codes:
+        counts[band,pixels] += 1
     
-    # load the source file to get the appropriate attributes
-    src_ds = gdal.Open(src_file)
+    # Most common class per pixel, converted back to the original class values
+    mode = present[counts.argmax(axis=0)] + offset
     
-    # get the geotransform
-    des_transform = src_ds.GetGeoTransform()
+    return mode.reshape(data.shape[1:]).astype(data.dtype)
     
-    # get the data dimensions
-    ncols = des_data.shape[1]
-    nrows = des_data.shape[0]
-    
-    # make the file
-    driver = gdal.GetDriverByName("GTiff")
-    dst_ds = driver.Create(des_file,ncols,nrows,1,gdal.GDT_Float32, options = [ 'COMPRESS=DEFLATE' ])
-    dst_ds.GetRasterBand(1).WriteArray( des_data ) 
-    dst_ds.SetGeoTransform(des_transform)
-    wkt = src_ds.GetProjection()
-    srs = osr.SpatialReference()
-    srs.ImportFromWkt(wkt)
-    dst_ds.SetProjection( srs.ExportToWkt() )
-    
-    # close files
-    src_ds = None
-    des_ds = None
+# Reads a window from all bands (years) at once and finds the mode land class in it
+def mode_in_window(window, file):
+    ds = get_dataset(file, gdal.Open)
+    xoff, yoff, xsize, ysize = window
+    data = ds.ReadAsArray(xoff, yoff, xsize, ysize).reshape(ds.RasterCount, ysize, xsize)
+    return window, mode_of_classes(data)
 
-    return
-    
 
 # -------------------------------------------------------------
 
 # ---  Find mode land class 
-# Get land use classes for each year
-land_use_classes = np.dstack((open_geotif( str(landClassPath/source_file) ,1)[0], \
-                              open_geotif( str(landClassPath/source_file) ,2)[0], \
-                              open_geotif( str(landClassPath/source_file) ,3)[0], \
-                              open_geotif( str(landClassPath/source_file) ,4)[0], \
-                              open_geotif( str(landClassPath/source_file) ,5)[0], \
-                              open_geotif( str(landClassPath/source_file) ,6)[0], \
-                              open_geotif( str(landClassPath/source_file) ,7)[0], \
-                              open_geotif( str(landClassPath/source_file) ,8)[0], \
-                              open_geotif( str(landClassPath/source_file) ,9)[0], \
-                              open_geotif( str(landClassPath/source_file) ,10)[0], \
-                              open_geotif( str(landClassPath/source_file) ,11)[0], \
-                              open_geotif( str(landClassPath/source_file) ,12)[0], \
-                              open_geotif( str(landClassPath/source_file) ,13)[0], \
-                              open_geotif( str(landClassPath/source_file) ,14)[0], \
-                              open_geotif( str(landClassPath/source_file) ,15)[0], \
-                              open_geotif( str(landClassPath/source_file) ,16)[0], \
-                              open_geotif( str(landClassPath/source_file) ,17)[0], \
-                              open_geotif( str(landClassPath/source_file) ,18)[0]))
-
-# Extract mode
-mode = sc.mode(land_use_classes,axis=2)[0].squeeze()
-
-# Store this in a new geotif file
+# The multiband file is processed in windows, so that only a few blocks of all the years are kept in memory
 src_file = str(landClassPath/source_file)
 des_file = str(modeLandClassPath/dest_file)
-write_geotif_sameDomain(src_file,des_file,mode)
+
+# Number of threads used to process windows in parallel
+ncpus = int(os.environ.get('SLURM_CPUS_PER_TASK',default=1))
+
+# Open the source file and find the processing windows
+src_ds = gdal.Open(src_file)
+all_windows = make_windows(src_ds.RasterXSize, src_ds.RasterYSize, *src_ds.GetRasterBand(1).GetBlockSize())
+print('Processing {} windows of {} bands with {} thread(s).'.format(len(all_windows), src_ds.RasterCount, ncpus))
+
+# Make the destination file with the same (integer) data type and georeferencing as the source
+driver = gdal.GetDriverByName("GTiff")
+dst_ds = driver.Create(des_file, src_ds.RasterXSize, src_ds.RasterYSize, 1, src_ds.GetRasterBand(1).DataType, 
+                       options = [ 'COMPRESS=DEFLATE', 'TILED=YES' ])
+dst_ds.SetGeoTransform(src_ds.GetGeoTransform())
+dst_ds.SetProjection(src_ds.GetProjection())
+dst_band = dst_ds.GetRasterBand(1)
+
+# Find the mode in each window and write the result as soon as it is available. Only a few windows per thread are
+# submitted at a time, so that finished windows do not pile up while the writer waits for an earlier window.
+for (xoff, yoff, xsize, ysize), mode in map_windows(lambda window: mode_in_window(window, src_file), all_windows, ncpus):
+    dst_band.WriteArray(mode, xoff, yoff)
+
+# Close the files
+close_datasets()
+dst_band = None
+dst_ds = None
+src_ds = None
 
 
 # --- Code provenance
@@ -179,9 +171,10 @@ log_suffix = '_mode_over_years_log.txt'
 logFolder = '_workflow_log'
 Path( logPath / logFolder ).mkdir(parents=True, exist_ok=True)
 
-# Copy this script
+# Copy this script and the block-wise raster helpers it uses
 thisFile = 'find_mode_landclass.py'
 copyfile(thisFile, logPath / logFolder / thisFile);
+copyfile(helperFolder / 'raster_windows.py', logPath / logFolder / 'raster_windows.py');
 
 # Get current date and time
 now = datetime.now()
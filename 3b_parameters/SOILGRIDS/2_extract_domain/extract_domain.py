@@ -101,7 +101,7 @@ new_tif = str(soil_domain_path/soil_domain_name)
 
 # Crop to domain
 #ds = gdal.Translate(new_tif, old_tif, projWin=bbox)
-translate_options = gdal.TranslateOptions(format = 'GTiff', projWin = bbox, creationOptions = ['COMPRESS=DEFLATE'])
+translate_options = gdal.TranslateOptions(format = 'GTiff', projWin = bbox, creationOptions = ['COMPRESS=DEFLATE','TILED=YES'])
 ds = gdal.Translate(new_tif, old_tif, options=translate_options)
 
 # Close the data set
@@ -1,5 +1,7 @@
 # Intersect catchment with MERIT DEM
-# Finds the mean elevation of each HRU in the model setup with rasterstats.
+# Finds the mean elevation of each HRU in the model setup, reading the DEM block by block. The same pass 
+# over the DEM also finds the elevation range, mean tangent slope, mean aspect and an estimate of the 
+# contour length of each HRU.
 #
 # Note:
 # 1. Find the source catchment shapefile;
@@ -8,11 +10,16 @@
 
 # modules
 import os
+import warnings
+import numpy as np
 import geopandas as gpd
-from rasterstats import zonal_stats
+import rasterio
+from rasterio import windows
+from rasterio.errors import NotGeoreferencedWarning
 from pathlib import Path
 from shutil import copyfile
 from datetime import datetime
+from raster_windows import make_rasterio_windows, geometry_mask_in_window, get_dataset, close_datasets, map_windows
 
 
 # --- Control file handling
@@ -61,6 +68,7 @@ def make_default_path(suffix):
 # Catchment shapefile path & name
 catchment_path = read_from_control(controlFolder/controlFile,'catchment_shp_path')
 catchment_name = read_from_control(controlFolder/controlFile,'catchment_shp_name')
+catchment_area = read_from_control(controlFolder/controlFile,'catchment_shp_area')
 
 # Specify default path if needed
 if catchment_path == 'default':
@@ -111,18 +119,135 @@ for file in os.listdir(catchment_path):
         copyfile(catchment_path/file, intersect_path/newfile);
         
         
-# --- Rasterstats analysis
-# Load the shapefile
+# --- Block-wise zonal statistics
+# The DEM is read in windows that follow the file's internal tiling so that only a few blocks are 
+# in memory at any time. Each window is read with a 1-pixel halo so that the slope can be computed
+# at the window edges. Per HRU, the sum and count of elevation, tangent slope and aspect components 
+# and the elevation range are accumulated over all windows that overlap the HRU. The statistics are 
+# computed from these at the end.
+#
+# Stored fields:
+# | Field     | Description |
+# |:----------|:------------|
+# | elev_mean | Mean elevation [m] |
+# | elev_min  | Minimum elevation [m] |
+# | elev_max  | Maximum elevation [m] |
+# | tan_slope | Mean tangent of the slope [m m-1] |
+# | asp_mean  | Circular mean of the aspect of sloping pixels [degrees clockwise from north] |
+# | cont_len  | Contour length [m], estimated as HRU area / flow length, where flow length = (elev_max - elev_min) / tan_slope |
+
+# Number of threads used to process windows in parallel
+ncpus = int(os.environ.get('SLURM_CPUS_PER_TASK',default=1))
+
+# Rasterizing in multiple threads can trigger spurious warnings about the temporary in-memory rasters
+warnings.simplefilter('ignore', category=NotGeoreferencedWarning)
+
+# Function to find the pixel sizes in meters for each row of a window
+def pixel_size_in_meters(src, win_transform, height):
+    
+    # Pixel size in the units of the coordinate system
+    dx = abs(win_transform.a)
+    dy = abs(win_transform.e)
+    
+    # Convert degrees to meters if needed, using the latitude of the center of each row
+    if src.crs is not None and src.crs.is_geographic:
+        lat = win_transform.f + (np.arange(height) + 0.5) * win_transform.e
+        dx = dx * 111320 * np.cos(np.deg2rad(lat))
+        dy = dy * 110574
+    
+    return np.broadcast_to(dx, (height,)), dy
+
+# Function to accumulate the elevation, slope and aspect statistics per HRU inside a single window
+# Returns per HRU: [elevation sum, elevation count, elevation min, elevation max, 
+#                   tan(slope) sum, tan(slope) count, sin(aspect) sum, cos(aspect) sum, aspect count]
+def topo_stats_in_window(window, file, gdf, all_touched=True):
+    
+    # Find the HRUs that overlap this window
+    src = get_dataset(file)
+    win_transform = src.window_transform(window)
+    hru_idx = list(gdf.sindex.intersection(windows.bounds(window, src.transform)))
+    if len(hru_idx) == 0:
+        return {}
+    
+    # Read the data in this window plus a 1-pixel halo where available, and set invalid pixels to NaN
+    row_off, col_off = int(window.row_off), int(window.col_off)
+    halo = windows.Window(col_off - 1, row_off - 1, int(window.width) + 2, int(window.height) + 2)
+    halo = halo.intersection(windows.Window(0, 0, src.width, src.height))
+    data = src.read(1, window=halo, out_dtype='float64')
+    if src.nodata is not None:
+        data[data == src.nodata] = np.nan
+    
+    # Slope and aspect from central differences (one-sided at the edges of the raster)
+    dx, dy = pixel_size_in_meters(src, src.window_transform(halo), data.shape[0])
+    grad_row, grad_col = np.gradient(data)
+    dz_east  = grad_col / dx[:,None]
+    dz_north = grad_row / (dy * np.sign(win_transform.e))
+    tan_slope = np.hypot(dz_east, dz_north)
+    aspect = np.arctan2(-dz_east, -dz_north) # direction the slope faces, clockwise from north
+    
+    # Remove the halo
+    rows = slice(row_off - int(halo.row_off), row_off - int(halo.row_off) + int(window.height))
+    cols = slice(col_off - int(halo.col_off), col_off - int(halo.col_off) + int(window.width))
+    data, tan_slope, aspect = data[rows,cols], tan_slope[rows,cols], aspect[rows,cols]
+    valid = ~np.isnan(data)
+    valid_slope = ~np.isnan(tan_slope)
+    
+    # Find the statistics inside each HRU
+    stats = {}
+    for idx in hru_idx:
+        
+        # Rasterize the HRU on only the part of the window it covers
+        hru_mask = geometry_mask_in_window(gdf.geometry.iloc[idx], win_transform, data.shape[0], data.shape[1], all_touched)
+        if hru_mask is None:
+            continue
+        mask, sub = hru_mask
+        mask_elev  = mask & valid[sub]
+        mask_slope = mask & valid_slope[sub]
+        if not mask_elev.any():
+            continue
+        
+        # Elevation, slope and aspect values in this HRU; flat pixels have no aspect
+        elev  = data[sub][mask_elev]
+        slope = tan_slope[sub][mask_slope]
+        asp   = aspect[sub][mask_slope][slope > 0]
+        stats[idx] = np.array([elev.sum(), elev.size, elev.min(), elev.max(),
+                               slope.sum(), slope.size, np.sin(asp).sum(), np.cos(asp).sum(), asp.size])
+    
+    return stats
+    
+# Load the shapefile and build the spatial index before any threads are started
 gdf = gpd.read_file(str(intersect_path/intersect_name))
+gdf.sindex
 
-# Calculate zonal statistics
-stats = zonal_stats(gdf, 
-                    str(dem_path/dem_name), 
-                    stats=['mean'], 
-                    all_touched=True)
+# Find the processing windows
+with rasterio.open(dem_path/dem_name) as src:
+    all_windows = make_rasterio_windows(src)
+print('Processing {} windows with {} thread(s).'.format(len(all_windows), ncpus))
 
-# Add the mean elevation to the GeoDataFrame
-gdf['elev_mean'] = [stat['mean'] for stat in stats]
+# Accumulate the statistics per HRU over all windows
+acc = np.zeros((len(gdf),9))
+acc[:,2] = np.inf
+acc[:,3] = -np.inf
+for stats in map_windows(lambda window: topo_stats_in_window(window, dem_path/dem_name, gdf), all_windows, ncpus):
+    for idx,hru_stats in stats.items():
+        acc[idx,[0,1,4,5,6,7,8]] += hru_stats[[0,1,4,5,6,7,8]]
+        acc[idx,2] = min(acc[idx,2], hru_stats[2])
+        acc[idx,3] = max(acc[idx,3], hru_stats[3])
+close_datasets()
+
+# Compute the statistics; HRUs without valid DEM pixels get no value
+with np.errstate(invalid='ignore', divide='ignore'):
+    gdf['elev_mean'] = np.where(acc[:,1] > 0, acc[:,0] / acc[:,1], np.nan)
+    gdf['elev_min']  = np.where(acc[:,1] > 0, acc[:,2], np.nan)
+    gdf['elev_max']  = np.where(acc[:,1] > 0, acc[:,3], np.nan)
+    gdf['tan_slope'] = np.where(acc[:,5] > 0, acc[:,4] / acc[:,5], np.nan)
+    gdf['asp_mean']  = np.where(acc[:,8] > 0, np.rad2deg(np.arctan2(acc[:,6], acc[:,7])) % 360, np.nan)
+    
+    # Contour length as the HRU area divided by the length of the flow path through the HRU. 
+    # Flat HRUs (no relief or slope) are treated as squares.
+    flow_length = (gdf['elev_max'] - gdf['elev_min']) / gdf['tan_slope']
+    flow_length = flow_length.where(flow_length > 0, np.sqrt(gdf[catchment_area]))
+    gdf['cont_len'] = gdf[catchment_area] / flow_length
 
 # Save the updated GeoDataFrame
 gdf.to_file(str(intersect_path/intersect_name))
@@ -140,9 +265,10 @@ log_suffix = '_catchment_dem_intersect_log.txt'
 logFolder = '_workflow_log'
 Path( logPath / logFolder ).mkdir(parents=True, exist_ok=True)
 
-# Copy this script
+# Copy this script and the block-wise raster helpers it uses
 thisFile = '1_find_HRU_elevation.py'
 copyfile(thisFile, logPath / logFolder / thisFile);
+copyfile('raster_windows.py', logPath / logFolder / 'raster_windows.py');
 
 # Get current date and time
 now = datetime.now()
@@ -151,6 +277,6 @@ logFile = now.strftime('%Y%m%d') + log_suffix
 with open( logPath / logFolder / logFile, 'w') as file:
     
     lines = ['Log generated by ' + thisFile + ' on ' + now.strftime('%Y/%m/%d %H:%M:%S') + '\n',
-             'Found mean HRU elevation from MERIT Hydro adjusted elevation DEM.']
+             'Found mean HRU elevation, slope, aspect and contour length from MERIT Hydro adjusted elevation DEM.']
     for txt in lines:
         file.write(txt)  
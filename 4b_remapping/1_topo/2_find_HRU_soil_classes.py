@@ -1,16 +1,17 @@
 # Intersect catchment with SOILGRIDS soil classes
-# Counts the occurence of each soil class in each HRU in the model setup with rasterstats.
+# Counts the occurence of each soil class in each HRU in the model setup, reading the raster block by block.
 
 # modules
 import os
+import warnings
 from pathlib import Path
 from shutil import copyfile
 from datetime import datetime
 import geopandas as gpd
-import rasterio
-from rasterstats import zonal_stats
+from rasterio.errors import NotGeoreferencedWarning
 import pandas as pd
 import numpy as np
+from raster_windows import count_classes
 
 
 # --- Control file handling
@@ -92,29 +93,23 @@ else:
 intersect_path.mkdir(parents=True, exist_ok=True)
 
 
-# --- Rasterstats analysis
-# Load the shapefile
-gdf = gpd.read_file(catchment_path / catchment_name)
+# --- Block-wise zonal histogram
+# The raster is read in windows that follow the file's internal tiling so that only a few blocks are 
+# in memory at any time. Class counts per HRU are accumulated over all windows that overlap the HRU.
 
-# Open the raster file
-with rasterio.open(soil_path / soil_name) as src:
-    affine = src.transform
-    array = src.read(1)  # Read the first band
+# Number of threads used to process windows in parallel
+ncpus = int(os.environ.get('SLURM_CPUS_PER_TASK',default=1))
 
-# Get unique values in the raster
-unique_values = np.unique(array).astype(int)
-unique_values = unique_values[unique_values != src.nodata]  # Remove nodata value if present
+# Rasterizing in multiple threads can trigger spurious warnings about the temporary in-memory rasters
+warnings.simplefilter('ignore', category=NotGeoreferencedWarning)
 
-# Perform zonal statistics for each unique value
-results = []
-for value in unique_values:
-    category_stats = zonal_stats(gdf, array, affine=affine, stats=['count'], categorical=True, 
-                                 category_map={value: 1})
-    counts = [stat.get(1, 0) for stat in category_stats]  # Get count for category 1, default to 0 if not present
-    results.append(pd.DataFrame(counts, columns=[f'USGS_{value}']))
+# Load the shapefile and count the classes per HRU over all windows (see raster_windows.py)
+gdf = gpd.read_file(catchment_path / catchment_name)
+hist = count_classes(soil_path / soil_name, gdf, ncpus)
 
-# Combine all results
-hist_df = pd.concat(results, axis=1).fillna(0).astype(int)
+# Keep only the classes that occur in the domain
+unique_values = np.flatnonzero(hist.sum(axis=0))
+hist_df = pd.DataFrame(hist[:,unique_values], columns=[f'USGS_{value}' for value in unique_values], index=gdf.index)
 
 # Combine the original GeoDataFrame with the histogram results
 result = gdf.join(hist_df)
@@ -134,9 +129,10 @@ log_suffix = '_catchment_soilgrids_intersect_log.txt'
 logFolder = '_workflow_log'
 Path( logPath / logFolder ).mkdir(parents=True, exist_ok=True)
 
-# Copy this script
+# Copy this script and the block-wise raster helpers it uses
 thisFile = '2_find_HRU_soil_classes.py'
 copyfile(thisFile, logPath / logFolder / thisFile);
+copyfile('raster_windows.py', logPath / logFolder / 'raster_windows.py');
 
 # Get current date and time
 now = datetime.now()
@@ -1,15 +1,17 @@
 # Intersect catchment with MODIS-derived IGBP land classes
-# Counts the occurence of each land class in each HRU in the model setup with rasterstats.
+# Counts the occurence of each land class in each HRU in the model setup, reading the raster block by block.
 
 # Modules
 import os
+import warnings
 from pathlib import Path
 from shutil import copyfile
 from datetime import datetime
 import geopandas as gpd
-import rasterio
-from rasterstats import zonal_stats
+from rasterio.errors import NotGeoreferencedWarning
 import pandas as pd
+import numpy as np
+from raster_windows import count_classes
 
 
 # --- Control file handling
@@ -91,33 +93,23 @@ else:
 intersect_path.mkdir(parents=True, exist_ok=True)
 
 
-# --- Rasterstats analysis
-# Load the shapefile
-gdf = gpd.read_file(catchment_path / catchment_name)
-
-# Open the raster file
-with rasterio.open(land_path / land_name) as src:
-    affine = src.transform
-    array = src.read(1)
-    nodata = src.nodata
-
-# Perform zonal statistics
-stats = zonal_stats(gdf, array, affine=affine, nodata=nodata, categorical=True)
+# --- Block-wise zonal histogram
+# The raster is read in windows that follow the file's internal tiling so that only a few blocks are 
+# in memory at any time. Class counts per HRU are accumulated over all windows that overlap the HRU.
 
-# Convert stats to DataFrame
-df_stats = pd.DataFrame(stats)
+# Number of threads used to process windows in parallel
+ncpus = int(os.environ.get('SLURM_CPUS_PER_TASK',default=1))
 
-# Convert column names to integers and sort them
-sorted_columns = sorted(df_stats.columns, key=lambda x: int(x))
+# Rasterizing in multiple threads can trigger spurious warnings about the temporary in-memory rasters
+warnings.simplefilter('ignore', category=NotGeoreferencedWarning)
 
-# Reorder DataFrame based on sorted column names
-df_stats = df_stats[sorted_columns]
-
-# Replace NaN with 0 and convert to integers
-df_stats = df_stats.fillna(0).astype(int)
+# Load the shapefile and count the classes per HRU over all windows (see raster_windows.py)
+gdf = gpd.read_file(catchment_path / catchment_name)
+hist = count_classes(land_path / land_name, gdf, ncpus)
 
-# Rename columns
-df_stats.columns = [f'IGBP_{int(col)}' for col in df_stats.columns]
+# Keep only the classes that occur in the domain
+unique_values = np.flatnonzero(hist.sum(axis=0))
+df_stats = pd.DataFrame(hist[:,unique_values], columns=[f'IGBP_{value}' for value in unique_values], index=gdf.index)
 
 # Merge stats with original GeoDataFrame
 gdf_result = gdf.join(df_stats)
@@ -137,9 +129,10 @@ log_suffix = '_catchment_modis_intersect_log.txt'
 logFolder = '_workflow_log'
 Path( logPath / logFolder ).mkdir(parents=True, exist_ok=True)
 
-# Copy this script
+# Copy this script and the block-wise raster helpers it uses
 thisFile = '3_find_HRU_land_classes.py'
 copyfile(thisFile, logPath / logFolder / thisFile);
+copyfile('raster_windows.py', logPath / logFolder / 'raster_windows.py');
 
 # Get current date and time
 now = datetime.now()
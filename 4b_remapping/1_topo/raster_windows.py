@@ -0,0 +1,156 @@
+# Helpers to process rasters block by block
+# Used by the intersection scripts in this folder and by 3b_parameters/MODIS_MCD12Q1_V6/7_find_mode_land_class.
+# Windows follow the internal blocks (tiles or strips) of the raster, so that only a few blocks are in memory at any
+# time. Windows are processed in threads, each with its own file handle, with a limited number of windows in flight.
+
+# Modules
+import threading
+import numpy as np
+import rasterio
+from rasterio import features, windows
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+# --- Windows
+# Function to define processing windows that are aligned with the internal blocks of a raster
+# Returns the windows as (column offset, row offset, width, height), the order used by both rasterio and GDAL
+def make_windows(width, height, block_width, block_height, target_pixels=2**20):
+
+    # Combine blocks into windows of roughly 'target_pixels' pixels
+    win_width  = min(width,  block_width  * max(1, int(np.sqrt(target_pixels)) // block_width))
+    win_height = min(height, block_height * max(1, target_pixels // (win_width * block_height)))
+
+    # Return the windows
+    return [(col_off, row_off, min(win_width, width - col_off), min(win_height, height - row_off))
+            for row_off in range(0, height, win_height)
+            for col_off in range(0, width, win_width)]
+
+# Function to define processing windows for a file opened with rasterio
+def make_rasterio_windows(src, target_pixels=2**20):
+    block_height, block_width = src.block_shapes[0]
+    return [windows.Window(*window) for window in make_windows(src.width, src.height, block_width, block_height, target_pixels)]
+
+# Function to find the part of a window that contains a given geometry (with a 1-pixel buffer)
+def geometry_subwindow(geom, win_transform, win_height, win_width):
+
+    # Convert the bounding box of the geometry into pixel coordinates inside the window
+    minx, miny, maxx, maxy = geom.bounds
+    col_1, row_1 = ~win_transform * (minx, maxy)
+    col_2, row_2 = ~win_transform * (maxx, miny)
+    rows, cols = [row_1, row_2], [col_1, col_2]
+
+    # Round outwards and clip to the window
+    row_min = max(int(np.floor(min(rows))) - 1, 0)
+    row_max = min(int(np.ceil(max(rows))) + 1, win_height)
+    col_min = max(int(np.floor(min(cols))) - 1, 0)
+    col_max = min(int(np.ceil(max(cols))) + 1, win_width)
+
+    return row_min, row_max, col_min, col_max
+
+# Function to rasterize a geometry on only the part of a window it covers
+# Returns the mask and the rows and columns of the window it applies to, or None if the geometry is outside the window
+def geometry_mask_in_window(geom, win_transform, win_height, win_width, all_touched=False):
+    row_min, row_max, col_min, col_max = geometry_subwindow(geom, win_transform, win_height, win_width)
+    if row_min >= row_max or col_min >= col_max:
+        return None
+    sub_window = windows.Window(col_min, row_min, col_max - col_min, row_max - row_min)
+    mask = features.geometry_mask([geom], out_shape=(row_max - row_min, col_max - col_min),
+                                  transform=windows.transform(sub_window, win_transform),
+                                  invert=True, all_touched=all_touched)
+    return mask, (slice(row_min,row_max), slice(col_min,col_max))
+
+
+# --- File handles and threads
+# Every thread opens its own file handle, because rasterio and GDAL datasets cannot be shared between threads
+thread_data = threading.local()
+open_datasets = []
+def get_dataset(file, open_function=rasterio.open):
+    if not hasattr(thread_data, 'datasets'):
+        thread_data.datasets = {}
+    if file not in thread_data.datasets:
+        thread_data.datasets[file] = open_function(file)
+        open_datasets.append(thread_data.datasets[file])
+    return thread_data.datasets[file]
+
+# Function to close the file handles of all threads
+def close_datasets():
+    for ds in open_datasets:
+        if hasattr(ds, 'close'):
+            ds.close()
+    open_datasets.clear()
+
+# Function to apply a function to all windows in threads, yielding the results in the order of the windows
+# At most 'max_pending' windows (default: 2 per thread) are submitted or finished but not yet returned, so that
+# memory use does not depend on the number of windows
+def map_windows(function, all_windows, ncpus, max_pending=None):
+    max_pending = max_pending or 2 * ncpus
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=ncpus) as pool:
+        for window in all_windows:
+            pending.append(pool.submit(function, window))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# --- Zonal histograms
+# Function to count the occurrence of each class per HRU inside a single window
+# Pixels with the nodata value, NaN or a negative class value are not counted
+def count_classes_in_window(window, file, gdf, all_touched=False):
+
+    # Find the HRUs that overlap this window
+    src = get_dataset(file)
+    win_transform = src.window_transform(window)
+    hru_idx = list(gdf.sindex.intersection(windows.bounds(window, src.transform)))
+    if len(hru_idx) == 0:
+        return {}
+
+    # Read the data in this window and find the valid pixels
+    data = src.read(1, window=window)
+    valid = np.ones(data.shape, dtype=bool)
+    if src.nodata is not None:
+        valid &= (data != src.nodata)
+    if np.issubdtype(data.dtype, np.floating):
+        valid &= ~np.isnan(data)
+    valid &= ~(data < 0)
+
+    # Count the classes inside each HRU
+    counts = {}
+    for idx in hru_idx:
+
+        # Rasterize the HRU on only the part of the window it covers
+        hru_mask = geometry_mask_in_window(gdf.geometry.iloc[idx], win_transform, data.shape[0], data.shape[1], all_touched)
+        if hru_mask is None:
+            continue
+        mask, sub = hru_mask
+        mask &= valid[sub]
+
+        # Histogram of the classes in this HRU
+        if mask.any():
+            counts[idx] = np.bincount(data[sub][mask].astype(int))
+
+    return counts
+
+# Function to count the occurrence of each class per HRU in a raster, as an array of HRUs by class values
+def count_classes(file, gdf, ncpus, all_touched=False):
+
+    # Build the spatial index before any threads are started
+    gdf.sindex
+
+    # Find the processing windows
+    with rasterio.open(file) as src:
+        all_windows = make_rasterio_windows(src)
+    print('Processing {} windows with {} thread(s).'.format(len(all_windows), ncpus))
+
+    # Accumulate the class counts per HRU over all windows
+    hist = np.zeros((len(gdf),1), dtype=np.int64)
+    for counts in map_windows(lambda window: count_classes_in_window(window, file, gdf, all_touched), all_windows, ncpus):
+        for idx,hru_hist in counts.items():
+            if len(hru_hist) > hist.shape[1]:
+                hist = np.pad(hist, ((0,0),(0,len(hru_hist) - hist.shape[1])))
+            hist[idx,:len(hru_hist)] += hru_hist
+    close_datasets()
+
+    return hist
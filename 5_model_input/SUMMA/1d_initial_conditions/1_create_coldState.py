@@ -1,12 +1,14 @@
 # Create coldstate.nc
-# Creates empty `coldstate.nc` file for initial SUMMA runs. This can be replaced by a more elegant initial conditions file, such as generated by SUMMA's `-r y` (create a restart file, yearly intervals) command line option. 
+# Creates empty `coldstate.nc` file for initial SUMMA runs. States are the same for all HRUs, unless per-HRU values are provided through setting `settings_summa_init_values` in the control file. This can be replaced by a more elegant initial conditions file, such as generated by SUMMA's `-r y` (create a restart file, yearly intervals) command line option. 
 #
 # Note on HRU order
 # HRU order must be the same in forcing, attributes, initial conditions and trial parameter files. Order will be taken from forcing files to ensure consistency.
 
 # modules
 import os
+import sys
 import numpy as np
+import pandas as pd
 import xarray as xr
 import netCDF4 as nc4
 from pathlib import Path
@@ -115,20 +117,70 @@ dt_init = read_from_control(controlFolder/controlFile,'forcing_time_step_size')
 mLayerDepth  = np.asarray([0.025, 0.075, 0.15, 0.25, 0.5, 0.5, 1, 1.5])
 iLayerHeight = np.asarray([0, 0.025, 0.1, 0.25, 0.5, 1, 1.5, 2.5, 4])
 
-# States
-scalarCanopyIce      = 0      # Current ice storage in the canopy
-scalarCanopyLiq      = 0      # Current liquid water storage in the canopy
-scalarSnowDepth      = 0      # Current snow depth
-scalarSWE            = 0      # Current snow water equivalent
-scalarSfcMeltPond    = 0      # Current ponded melt water
-scalarAquiferStorage = 1.0    # Current aquifer storage
-scalarSnowAlbedo     = 0      # Snow albedo
-scalarCanairTemp     = 283.16 # Current temperature in the canopy airspace
-scalarCanopyTemp     = 283.16 # Current temperature of the canopy 
-mLayerTemp           = 283.16 # Current temperature of each layer; assumed that all layers are identical
-mLayerVolFracIce     = 0      # Current ice storage in each layer; assumed that all layers are identical
-mLayerVolFracLiq     = 0.2    # Current liquid water storage in each layer; assumed that all layers are identical
-mLayerMatricHead     = -1.0   # Current matric head in each layer; assumed that all layers are identical
+# States; these are the same for all HRUs unless per-HRU values are provided (see below)
+states = {
+    'scalarCanopyIce'      : 0,      # Current ice storage in the canopy
+    'scalarCanopyLiq'      : 0,      # Current liquid water storage in the canopy
+    'scalarSnowDepth'      : 0,      # Current snow depth
+    'scalarSWE'            : 0,      # Current snow water equivalent
+    'scalarSfcMeltPond'    : 0,      # Current ponded melt water
+    'scalarAquiferStorage' : 1.0,    # Current aquifer storage
+    'scalarSnowAlbedo'     : 0,      # Snow albedo
+    'scalarCanairTemp'     : 283.16, # Current temperature in the canopy airspace
+    'scalarCanopyTemp'     : 283.16, # Current temperature of the canopy 
+    'mLayerTemp'           : 283.16, # Current temperature of each layer; assumed that all layers are identical
+    'mLayerVolFracIce'     : 0,      # Current ice storage in each layer; assumed that all layers are identical
+    'mLayerVolFracLiq'     : 0.2,    # Current liquid water storage in each layer; assumed that all layers are identical
+    'mLayerMatricHead'     : -1.0,   # Current matric head in each layer; assumed that all layers are identical
+}
+
+
+# --- Replace the default states with per-HRU values, if provided
+# Each .csv file has a key in its first column and state values in the other columns. The key is either 'hruId',
+# or the name of an HRU variable in the attributes file. Integer variables (e.g. soilTypeIndex) must match exactly;
+# for real variables (e.g. elevation) the states are linearly interpolated between the rows of the table. HRUs that
+# have no value keep the default. Files are applied in the order they are listed in the control file.
+init_values = read_from_control(controlFolder/controlFile,'settings_summa_init_values')
+
+# Apply the values in each file
+if init_values.lower() != 'none':
+    for table_file in init_values.split(','):
+        
+        # Open the table
+        table_file = table_file.strip()
+        table = pd.read_csv(table_file)
+        key = table.columns[0]
+        if table[key].duplicated().any():
+            sys.exit('Error: duplicate values of {} in {}'.format(key, table_file))
+        
+        # Find the key of each HRU, in the HRU order of the forcing file
+        if key == 'hruId':
+            hru_keys = forcing_hruIds
+            is_integer_key = True
+        else:
+            attribute_name = read_from_control(controlFolder/controlFile,'settings_summa_attributes')
+            with nc4.Dataset(coldstate_path/attribute_name) as att:
+                if key not in att.variables:
+                    sys.exit('Error: {} in {} is not a variable in {}'.format(key, table_file, attribute_name))
+                hru_keys = pd.Series(att[key][:], index=att['hruId'][:].astype(int)).reindex(forcing_hruIds).values
+                is_integer_key = att[key].dtype.kind in 'iu'
+        
+        # Find the value of each state for all HRUs at once
+        for var in table.columns[1:]:
+            if var not in states:
+                sys.exit('Error: {} in {} is not one of the states {}'.format(var, table_file, list(states.keys())))
+            
+            # Look up integer keys, interpolate real keys
+            if is_integer_key:
+                values = pd.Series(table[var].values, index=table[key].values).reindex(hru_keys).values
+            else:
+                rows = table[[key,var]].dropna().sort_values(key)
+                values = np.interp(hru_keys, rows[key].values, rows[var].values)
+            
+            # Replace the states where values were found
+            has_value = np.isfinite(values)
+            states[var] = np.where(has_value, values, states[var])
+            print('Setting {} at {} out of {} HRUs from {}'.format(var, has_value.sum(), num_hru, table_file))
 
 
 # --- Make the initial conditions files
@@ -180,19 +232,13 @@ with nc4.Dataset(coldstate_path/coldstate_name, "w", format="NETCDF4") as cs:
     create_and_fill_nc_var(cs, 'nSnow', nSnow, 1, num_hru, 'scalarv', 'i4', False)
     
     # States
-    create_and_fill_nc_var(cs, 'scalarCanopyIce',      scalarCanopyIce,      1,       num_hru, 'scalarv', 'f8', False)
-    create_and_fill_nc_var(cs, 'scalarCanopyLiq',      scalarCanopyLiq,      1,       num_hru, 'scalarv', 'f8', False)
-    create_and_fill_nc_var(cs, 'scalarSnowDepth',      scalarSnowDepth,      1,       num_hru, 'scalarv', 'f8', False)
-    create_and_fill_nc_var(cs, 'scalarSWE',            scalarSWE,            1,       num_hru, 'scalarv', 'f8', False)
-    create_and_fill_nc_var(cs, 'scalarSfcMeltPond',    scalarSfcMeltPond,    1,       num_hru, 'scalarv', 'f8', False)
-    create_and_fill_nc_var(cs, 'scalarAquiferStorage', scalarAquiferStorage, 1,       num_hru, 'scalarv', 'f8', False)
-    create_and_fill_nc_var(cs, 'scalarSnowAlbedo',     scalarSnowAlbedo,     1,       num_hru, 'scalarv', 'f8', False)
-    create_and_fill_nc_var(cs, 'scalarCanairTemp',     scalarCanairTemp,     1,       num_hru, 'scalarv', 'f8', False)
-    create_and_fill_nc_var(cs, 'scalarCanopyTemp',     scalarCanopyTemp,     1,       num_hru, 'scalarv', 'f8', False)
-    create_and_fill_nc_var(cs, 'mLayerTemp',           mLayerTemp,           midToto, num_hru, 'midToto', 'f8', False)
-    create_and_fill_nc_var(cs, 'mLayerVolFracIce',     mLayerVolFracIce,     midToto, num_hru, 'midToto', 'f8', False)
-    create_and_fill_nc_var(cs, 'mLayerVolFracLiq',     mLayerVolFracLiq,     midToto, num_hru, 'midToto', 'f8', False)
-    create_and_fill_nc_var(cs, 'mLayerMatricHead',     mLayerMatricHead,     midSoil, num_hru, 'midSoil', 'f8', False)
+    for var,value in states.items():
+        if var.startswith('scalar'):
+            create_and_fill_nc_var(cs, var, value, 1,       num_hru, 'scalarv', 'f8', False)
+        elif var == 'mLayerMatricHead':
+            create_and_fill_nc_var(cs, var, value, midSoil, num_hru, 'midSoil', 'f8', False)
+        else:
+            create_and_fill_nc_var(cs, var, value, midToto, num_hru, 'midToto', 'f8', False)
     
     # layer dimensions
     create_and_fill_nc_var(cs, 'iLayerHeight', iLayerHeight, num_hru, ifcToto, 'ifcToto', 'f8', False)
@@ -0,0 +1,327 @@
+# Create an ensemble of trialParams.nc files
+# Creates `settings_summa_ens_size` trial parameter files, each with a different set of values for the parameters in `settings_summa_ens_params`. Parameter values are sampled from their ranges with a Latin hypercube or Sobol design (`settings_summa_ens_design`). Ranges are taken from `localParamInfo.txt` and `basinParamInfo.txt`, unless specified in the control file. Any trial parameters specified through `settings_summa_trialParam_n` are included in every file.
+#
+# For each ensemble member, this script also creates a file manager that uses the trial parameter file of that member and gives the outputs a unique prefix. Trial parameter files and file managers are stored in folder `ensemble` inside the SUMMA settings folder, together with a `.csv` table of the sampled values.
+#
+# Note on HRU order
+# HRU order must be the same in forcing, attributes, initial conditions and trial parameter files. Order will be taken from forcing files to ensure consistency.
+
+# modules
+import os
+import re
+import sys
+import numpy as np
+import pandas as pd
+import xarray as xr
+import netCDF4 as nc4
+from pathlib import Path
+from shutil import copyfile
+from datetime import datetime
+
+
+# --- Control file handling
+# Easy access to control file folder
+controlFolder = Path('../../../0_control_files')
+
+# Store the name of the 'active' file in a variable
+controlFile = 'control_active.txt'
+
+# Function to extract a given setting from the control file
+def read_from_control( file, setting ):
+
+    # Open 'control_active.txt' and ...
+    with open(file) as contents:
+        for line in contents:
+
+            # ... find the line with the requested setting
+            if setting in line and not line.startswith('#'):
+                break
+
+    # Extract the setting's value
+    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
+    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
+    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
+
+    # Return this value
+    return substring
+
+# Function to specify a default path
+def make_default_path(suffix):
+
+    # Get the root path
+    rootPath = Path( read_from_control(controlFolder/controlFile,'root_path') )
+
+    # Get the domain folder
+    domainName = read_from_control(controlFolder/controlFile,'domain_name')
+    domainFolder = 'domain_' + domainName
+
+    # Specify the forcing path
+    defaultPath = rootPath / domainFolder / suffix
+
+    return defaultPath
+
+# Function to read a setting from the file manager
+def read_from_file_manager(file, setting):
+    with open(file) as contents:
+        for line in contents:
+            if line.split() and line.split()[0] == setting:
+                return re.search(r"'(.*)'", line).group(1)
+
+# Function to read the default value and range of each parameter in localParamInfo.txt or basinParamInfo.txt
+def read_parameter_info(file):
+    info = {}
+    with open(file) as contents:
+        for line in contents:
+
+            # Parameter lines have the format 'name | default | lower | upper'
+            if line.startswith('!') or line.count('|') != 3:
+                continue
+            name,default,lower,upper = [part.strip() for part in line.split('!')[0].split('|')]
+            info[name] = [float(value.replace('d','e')) for value in (default,lower,upper)] # Fortran exponents, e.g. 1.d-07
+
+    return info
+
+
+# --- Find forcing location and an example file
+# Forcing path
+forcing_path = read_from_control(controlFolder/controlFile,'forcing_summa_path')
+
+# Specify default path if needed
+if forcing_path == 'default':
+    forcing_path = make_default_path('forcing/4_SUMMA_input') # outputs a Path()
+else:
+    forcing_path = Path(forcing_path) # make sure a user-specified path is a Path()
+
+# Find a list of forcing files
+_,_,forcing_files = next(os.walk(forcing_path))
+
+# Select a random file as a template for hruId order
+forcing_name = forcing_files[0]
+
+
+# --- Find where the ensemble needs to go
+# Settings path, file manager and attributes
+settings_path    = read_from_control(controlFolder/controlFile,'settings_summa_path')
+filemanager_name = read_from_control(controlFolder/controlFile,'settings_summa_filemanager')
+attribute_name   = read_from_control(controlFolder/controlFile,'settings_summa_attributes')
+
+# Specify default path if needed
+if settings_path == 'default':
+    settings_path = make_default_path('settings/SUMMA') # outputs a Path()
+else:
+    settings_path = Path(settings_path) # make sure a user-specified path is a Path()
+
+# Ensemble folder, relative to the settings path so that file managers can refer to it
+ensemble_folder = 'ensemble'
+ensemble_path = settings_path / ensemble_folder
+ensemble_path.mkdir(parents=True, exist_ok=True)
+
+# SUMMA output path of the ensemble
+experiment_id = read_from_control(controlFolder/controlFile,'experiment_id')
+output_path = read_from_control(controlFolder/controlFile,'experiment_output_summa')
+
+# Specify default path if needed
+if output_path == 'default':
+    output_path = make_default_path('simulations/' + experiment_id + '/SUMMA') # outputs a Path()
+else:
+    output_path = Path(output_path) # make sure a user-specified path is a Path()
+output_path = output_path / ensemble_folder
+output_path.mkdir(parents=True, exist_ok=True)
+
+
+# --- Find order and number of HRUs in forcing file
+# Open the forcing file
+forc = xr.open_dataset(forcing_path/forcing_name)
+
+# Get the sorting order from the forcing file
+forcing_hruIds = forc['hruId'].values.astype(int) # 'hruId' is prescribed by SUMMA so this variable must exist
+
+# Number of HRUs
+num_hru = len(forcing_hruIds)
+
+
+# --- Read any other trial parameters that need to be specified
+num_tp = int( read_from_control(controlFolder/controlFile,'settings_summa_trialParam_n') )
+
+# read the names and values of trial parameters to specify
+all_tp = {}
+for ii in range(0,num_tp):
+
+    # Get the values
+    par_and_val = read_from_control(controlFolder/controlFile,f'settings_summa_trialParam_{ii+1}')
+
+    # Split into parameter and value
+    arr = par_and_val.split(',')
+
+    # Convert value(s) into float
+    if len(arr) > 2:
+        # Store all values as an array of floats
+        val = np.array(arr[1:], dtype=np.float32)
+    else:
+        # Convert the single value to a float
+        val = float( arr[1] )
+
+    # Store in dictionary
+    all_tp[arr[0]] = val
+
+
+# --- Read the ensemble settings
+# Ensemble size and sampling design
+num_ens = int( read_from_control(controlFolder/controlFile,'settings_summa_ens_size') )
+design  = read_from_control(controlFolder/controlFile,'settings_summa_ens_design').lower()
+if num_ens < 1:
+    sys.exit('Error: settings_summa_ens_size is {}; no ensemble to create'.format(num_ens))
+
+# Default ranges of the local (HRU) and basin (GRU) parameters
+local_info = read_parameter_info(settings_path / read_from_file_manager(settings_path/filemanager_name,'globalHruParamFile'))
+basin_info = read_parameter_info(settings_path / read_from_file_manager(settings_path/filemanager_name,'globalGruParamFile'))
+
+# Parameters to sample and their ranges
+ens_names, ens_lower, ens_upper, ens_is_basin = [],[],[],[]
+for spec in read_from_control(controlFolder/controlFile,'settings_summa_ens_params').split(','):
+
+    # Split into name and, optionally, the range
+    parts = spec.strip().split(':')
+    name = parts[0]
+    if name in local_info:
+        lower,upper = local_info[name][1:]
+    elif name in basin_info:
+        lower,upper = basin_info[name][1:]
+    else:
+        sys.exit('Error: parameter {} not found in localParamInfo or basinParamInfo'.format(name))
+    if len(parts) == 3:
+        lower,upper = float(parts[1]), float(parts[2])
+
+    # Store
+    ens_names.append(name)
+    ens_lower.append(lower)
+    ens_upper.append(upper)
+    ens_is_basin.append(name in basin_info and name not in local_info)
+
+ens_lower = np.array(ens_lower)
+ens_upper = np.array(ens_upper)
+num_par = len(ens_names)
+
+
+# --- Sample the parameter values
+# Fixed seed, so that the same control file creates the same ensemble
+rng = np.random.default_rng(seed=1)
+
+# Sample the unit hypercube for all members and parameters at once
+if design == 'lhs':
+    # Latin hypercube: each parameter has exactly one sample in each of the num_ens equal-probability intervals
+    strata = rng.permuted(np.tile(np.arange(num_ens), (num_par,1)), axis=1).T
+    unit_samples = (strata + rng.random((num_ens,num_par))) / num_ens
+elif design == 'sobol':
+    # Sobol sequence; scipy is only needed for this design
+    try:
+        from scipy.stats import qmc
+    except ImportError:
+        sys.exit('Error: settings_summa_ens_design "sobol" requires scipy')
+    unit_samples = qmc.Sobol(d=num_par, scramble=True, seed=rng).random(num_ens)
+else:
+    sys.exit('Error: unknown settings_summa_ens_design {}; use "lhs" or "sobol"'.format(design))
+
+# Scale to the parameter ranges
+samples = ens_lower + unit_samples * (ens_upper - ens_lower)
+
+# Store the sampled values with the name of each member's files
+ens_table = pd.DataFrame(samples, columns=ens_names)
+ens_table.insert(0, 'member', ['{}_{:04d}'.format(experiment_id, ii+1) for ii in range(num_ens)])
+ens_table.to_csv(ensemble_path / 'ensemble_parameters.csv', index=False)
+
+
+# --- Make the trial parameter files
+# Find the GRUs, needed for basin parameters only
+if any(ens_is_basin):
+    with nc4.Dataset(settings_path/attribute_name) as att:
+        attribute_gruIds = att['gruId'][:].astype(int)
+    num_gru = len(attribute_gruIds)
+
+# Create the files
+for ii,member in enumerate(ens_table['member']):
+    with nc4.Dataset(ensemble_path/('trialParams_' + member + '.nc'), "w", format="NETCDF4") as tp:
+
+        # === Some general attributes
+        now = datetime.now()
+        tp.setncattr('Author', "Created by SUMMA workflow scripts")
+        tp.setncattr('History','Created ' + now.strftime('%Y/%m/%d %H:%M:%S'))
+        tp.setncattr('Purpose','Create a trial parameter .nc file for ensemble member ' + member)
+
+        # === Define the dimensions
+        tp.createDimension('hru',num_hru)
+        if any(ens_is_basin):
+            tp.createDimension('gru',num_gru)
+
+        # === Variables ===
+        var = 'hruId'
+        tp.createVariable(var, 'i4', 'hru', fill_value = False)
+        tp[var].setncattr('units', '-')
+        tp[var].setncattr('long_name', 'Index of hydrological response unit (HRU)')
+        tp[var][:] = forcing_hruIds
+
+        if any(ens_is_basin):
+            var = 'gruId'
+            tp.createVariable(var, 'i4', 'gru', fill_value = False)
+            tp[var].setncattr('units', '-')
+            tp[var].setncattr('long_name', 'Index of grouped response unit (GRU)')
+            tp[var][:] = attribute_gruIds
+
+        # Trial parameters that are the same for all members
+        for var,val in all_tp.items():
+            if var not in ens_names:
+                tp.createVariable(var, 'f8', 'hru', fill_value = False)
+                tp[var][:] = val
+
+        # Sampled parameters
+        for var,val,is_basin in zip(ens_names, samples[ii], ens_is_basin):
+            tp.createVariable(var, 'f8', 'gru' if is_basin else 'hru', fill_value = False)
+            tp[var][:] = val
+
+
+# --- Make the file managers
+# Read the file manager once
+with open(settings_path/filemanager_name) as src:
+    filemanager_lines = src.readlines()
+
+# Settings that differ between members
+for member in ens_table['member']:
+    member_settings = {'outFilePrefix':  member,
+                       'outputPath':     str(output_path) + '/',
+                       'trialParamFile': ensemble_folder + '/trialParams_' + member + '.nc'}
+    with open(ensemble_path/('fileManager_' + member + '.txt'), 'w') as fm:
+        for line in filemanager_lines:
+            name = line.split()[0] if line.strip() else ''
+            if name in member_settings:
+                line = re.sub(r"'.*?'", "'{}'".format(member_settings[name]), line, count=1)
+            fm.write(line)
+
+print('Created {} trial parameter files and file managers in {}'.format(num_ens, ensemble_path))
+
+
+# --- Code provenance
+# Generates a basic log file in the domain folder and copies the control file and itself there.
+
+# Set the log path and file name
+logPath = settings_path
+log_suffix = '_make_trial_parameter_ensemble.txt'
+
+# Create a log folder
+logFolder = '_workflow_log'
+Path( logPath / logFolder ).mkdir(parents=True, exist_ok=True)
+
+# Copy this script
+thisFile = '2_create_trialParams_ensemble.py'
+copyfile(thisFile, logPath / logFolder / thisFile);
+
+# Get current date and time
+now = datetime.now()
+
+# Create a log file
+logFile = now.strftime('%Y%m%d') + log_suffix
+with open( logPath / logFolder / logFile, 'w') as file:
+
+    lines = ['Log generated by ' + thisFile + ' on ' + now.strftime('%Y/%m/%d %H:%M:%S') + '\n',
+             'Generated {} trial parameter .nc files with {} sampling of {}.'.format(num_ens, design, ', '.join(ens_names))]
+    for txt in lines:
+        file.write(txt)
@@ -15,8 +15,8 @@
 # | latitude       | taken from the shapefile geometry |
 # | elevation      | placeholder value -999, fill from the MERIT Hydro DEM |
 # | HRUarea        | taken from the shapefile attributes |
-# | tan_slope      | unused in current set up, fixed at 0.1 [-] |
-# | contourLength  | unused in current set up, fixed at 30 [m] |
+# | tan_slope      | placeholder value 0.1 [-], fill from the MERIT Hydro DEM |
+# | contourLength  | placeholder value 30 [m], fill from the MERIT Hydro DEM |
 # | slopeTypeIndex | unused in current set up, fixed at 1 [-] |
 # | soilTypeIndex  | placeholder value -999, fill from SOILGRIDS |
 # | vegTypeIndex   | placeholder value -999, fill from MODIS veg |
@@ -27,19 +27,20 @@
 # - tan_slope
 # - contourLength
 # - slopeTypeIndex 
-# are not set to correct values. `slopeTypeIndex` is a legacy variable that is no longer used. `tan_slope` and `contourLength` are needed for the `qbaseTopmodel` modeling option. These require significant preprocessing of geospatial data and are not yet implemented as part of this workflow.
+# are initialized with default values. `slopeTypeIndex` is a legacy variable that is no longer used. `tan_slope` and `contourLength` are needed for the `qbaseTopmodel` modeling option. These are derived from the MERIT Hydro DEM during the elevation intersection and replace the defaults when elevation is added to the attributes `.nc` file.
 #
 # `downHRUindex` is set to 0, indicating that each HRU will be modeled as an independent column. This can optionally be changed by setting the flag `settings_summa_connect_HRUs` to `yes` in the control file. The notebook that populates the attributes `.nc` file with elevation will in that case also use the relative elevations of HRUs in each GRU to define downslope HRU IDs.
 
 # modules
 import os
+import numpy as np
 import pandas as pd
 import xarray as xr
-import netCDF4 as nc4
 import geopandas as gpd
 from pathlib import Path
 from shutil import copyfile
 from datetime import datetime
+from attributes_nc import create_attributes_file
 
 
 # --- Control file handling
@@ -171,123 +172,31 @@ num_gru = len(gru_ids)
 
 
 # --- Create the new attributes file
-# Create the new .nc file
-with nc4.Dataset(attribute_path/attribute_name, "w", format="NETCDF4") as att:
-
-    # General attributes
-    now = datetime.now()
-    att.setncattr('Author', "Created by SUMMA workflow scripts")
-    att.setncattr('History','Created ' + now.strftime('%Y/%m/%d %H:%M:%S'))
-
-    # Define the dimensions 
-    att.createDimension('hru',num_hru)
-    att.createDimension('gru',num_gru)
-    
-    # Define the variables
-    var = 'hruId'
-    att.createVariable(var, 'i4', 'hru', fill_value = False)
-    att[var].setncattr('units', '-')
-    att[var].setncattr('long_name', 'Index of hydrological response unit (HRU)')
-    
-    var = 'gruId'
-    att.createVariable(var, 'i4', 'gru', fill_value = False)
-    att[var].setncattr('units', '-')
-    att[var].setncattr('long_name', 'Index of grouped response unit (GRU)')
-    
-    var = 'hru2gruId'
-    att.createVariable(var, 'i4', 'hru', fill_value = False)
-    att[var].setncattr('units', '-')
-    att[var].setncattr('long_name', 'Index of GRU to which the HRU belongs')
-    
-    var = 'downHRUindex'
-    att.createVariable(var, 'i4', 'hru', fill_value = False)
-    att[var].setncattr('units', '-')
-    att[var].setncattr('long_name', 'Index of downslope HRU (0 = basin outlet)')
-    
-    var = 'longitude'
-    att.createVariable(var, 'f8', 'hru', fill_value = False)
-    att[var].setncattr('units', 'Decimal degree east')
-    att[var].setncattr('long_name', 'Longitude of HRU''s centroid')
-    
-    var = 'latitude'
-    att.createVariable(var, 'f8', 'hru', fill_value = False)
-    att[var].setncattr('units', 'Decimal degree north')
-    att[var].setncattr('long_name', 'Latitude of HRU''s centroid')
-    
-    var = 'elevation'
-    att.createVariable(var, 'f8', 'hru', fill_value = False)
-    att[var].setncattr('units', 'm')
-    att[var].setncattr('long_name', 'Mean HRU elevation')
-    
-    var = 'HRUarea'
-    att.createVariable(var, 'f8', 'hru', fill_value = False)
-    att[var].setncattr('units', 'm^2')
-    att[var].setncattr('long_name', 'Area of HRU')
-    
-    var = 'tan_slope'
-    att.createVariable(var, 'f8', 'hru', fill_value = False)
-    att[var].setncattr('units', 'm m-1')
-    att[var].setncattr('long_name', 'Average tangent slope of HRU')
-    
-    var = 'contourLength'
-    att.createVariable(var, 'f8', 'hru', fill_value = False)
-    att[var].setncattr('units', 'm')
-    att[var].setncattr('long_name', 'Contour length of HRU')
-    
-    var = 'slopeTypeIndex'
-    att.createVariable(var, 'i4', 'hru', fill_value = False)
-    att[var].setncattr('units', '-')
-    att[var].setncattr('long_name', 'Index defining slope')
-    
-    var = 'soilTypeIndex'
-    att.createVariable(var, 'i4', 'hru', fill_value = False)
-    att[var].setncattr('units', '-')
-    att[var].setncattr('long_name', 'Index defining soil type')
-    
-    var = 'vegTypeIndex'
-    att.createVariable(var, 'i4', 'hru', fill_value = False)
-    att[var].setncattr('units', '-')
-    att[var].setncattr('long_name', 'Index defining vegetation type')
-    
-    var = 'mHeight'
-    att.createVariable(var, 'f8', 'hru', fill_value = False)
-    att[var].setncattr('units', 'm')
-    att[var].setncattr('long_name', 'Measurement height above bare ground')
-    
-    # Progress
-    progress = 0
-    
-    # GRU variable
-    for idx in range(0,num_gru):
-        att['gruId'][idx] = gru_ids[idx]
-    
-    # HRU variables; due to pre-sorting, these are already in the same order as the forcing files
-    for idx in range(0,num_hru):
-        
-        # Fill values from shapefile
-        att['hruId'][idx]     = shp.iloc[idx][catchment_hruId_var]
-        att['HRUarea'][idx]   = shp.iloc[idx][catchment_area_var]
-        att['latitude'][idx]  = shp.iloc[idx][catchment_lat_var]
-        att['longitude'][idx] = shp.iloc[idx][catchment_lon_var]
-        att['hru2gruId'][idx] = shp.iloc[idx][catchment_gruId_var]
-        
-        # Constants
-        att['tan_slope'][idx]      = 0.1                         # Only used in qbaseTopmodel modelling decision
-        att['contourLength'][idx]  = 30                          # Only used in qbaseTopmodel modelling decision
-        att['slopeTypeIndex'][idx] = 1                           # Needs to be set but not used
-        att['mHeight'][idx]        = forcing_measurement_height  # Forcing data height; used in some scaling equations       
-        att['downHRUindex'][idx]   = 0   # All HRUs modeled as independent columns; optionally changed when elevation is added to attributes.nc
-        
-        # Placeholders to be filled later
-        att['elevation'][idx]     = -999
-        att['soilTypeIndex'][idx] = -999
-        att['vegTypeIndex'][idx]  = -999
-        
-       # Show a progress report
-        print(str(progress+1) + ' out of ' + str(num_hru) + ' HRUs completed.')
-        
-        # Increment the counter
-        progress += 1
+# HRU variables; due to pre-sorting, these are already in the same order as the forcing files.
+# Each variable is assembled as a single array and written to the file in one go.
+hru_values = {
+    
+    # Fill values from shapefile
+    'hruId':          shp[catchment_hruId_var].values,
+    'HRUarea':        shp[catchment_area_var].values,
+    'latitude':       shp[catchment_lat_var].values,
+    'longitude':      shp[catchment_lon_var].values,
+    'hru2gruId':      shp[catchment_gruId_var].values,
+    
+    # Constants
+    'tan_slope':      np.full(num_hru, 0.1),                        # Only used in qbaseTopmodel modelling decision; replaced when elevation is added to attributes.nc
+    'contourLength':  np.full(num_hru, 30.0),                       # Only used in qbaseTopmodel modelling decision; replaced when elevation is added to attributes.nc
+    'slopeTypeIndex': np.full(num_hru, 1),                          # Needs to be set but not used
+    'mHeight':        np.full(num_hru, forcing_measurement_height), # Forcing data height; used in some scaling equations
+    'downHRUindex':   np.full(num_hru, 0), # All HRUs modeled as independent columns; optionally changed when elevation is added to attributes.nc
+    
+    # Placeholders to be filled later
+    'elevation':      np.full(num_hru, -999.0),
+    'soilTypeIndex':  np.full(num_hru, -999),
+    'vegTypeIndex':   np.full(num_hru, -999)}
+
+# Create the new .nc file and write all variables (see attributes_nc.py)
+create_attributes_file(attribute_path/attribute_name, gru_ids, hru_values)
         
         
 # --- Code provenance
@@ -301,9 +210,10 @@ log_suffix = '_initialize_attributes.txt'
 logFolder = '_workflow_log'
 Path( logPath / logFolder ).mkdir(parents=True, exist_ok=True)
 
-# Copy this script
+# Copy this script and the shared attributes code it uses
 thisFile = '1_initialize_attributes_nc.py'
 copyfile(thisFile, logPath / logFolder / thisFile);
+copyfile('attributes_nc.py', logPath / logFolder / 'attributes_nc.py');
 
 # Get current date and time
 now = datetime.now()
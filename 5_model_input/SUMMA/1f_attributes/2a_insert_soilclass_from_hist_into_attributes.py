@@ -9,6 +9,7 @@ import geopandas as gpd
 from pathlib import Path
 from shutil import copyfile
 from datetime import datetime
+from attributes_nc import mode_soil_class
 
 
 # --- Control file handling
@@ -83,45 +84,28 @@ else:
 # Open files
 shp = gpd.read_file(intersect_path/intersect_name)
 
+# Make the HRU ID the index, so that HRUs can be found without searching the whole table
+shp = shp.set_index(shp[intersect_hruId_var].astype(int))
+
 # Open the netcdf file for reading+writing
 with nc4.Dataset(attribute_path/attribute_name, "r+") as att:
     
-    # Loop over the HRUs in the attributes
-    for idx in range(0,len(att['hruId'])):
-        
-        # Find the HRU ID (attributes file) at this index
-        attribute_hru = att['hruId'][idx]
+    # Put the shapefile rows in the same order as the HRUs in the attributes
+    attribute_hrus = att['hruId'][:].astype(int)
+    shp = shp.reindex(attribute_hrus)
     
-        # Find the row in the shapefile that contains info for this HRU
-        shp_mask = (shp[intersect_hruId_var].astype(int) == attribute_hru)
-        
-        # Extract the histogram values
-        tmp_hist = []
-        for j in range (0,13):
-            if 'USGS_' + str(j) in shp.columns:
-                tmp_hist.append(shp['USGS_' + str(j)][shp_mask].values[0])
-            else:
-                tmp_hist.append(0)
-                
-        # Set the '0' class to having -1 occurences -> that must make some other class the most occuring one. 
-        # Using -1 also accounts for cases where SOILGRIDS has no sand/silt/clay data (oceans, glaciers, open water)
-        # and returns soil class =0. In such cases we default to the soilclass with the second most occurences. If 
-        # tied, we use the first in the list. We should never return soilclass = 0 in this way.
-        tmp_hist[0] = -1
-        
-        # Find the index with the most occurences
-        # Note: this assumes that we have USGS_0 to USGS_12 and thus that index == soilclass. 
-        tmp_sc = np.argmax(np.asarray(tmp_hist))
-        
-        # Check the assumption that index == soilclass
-        if shp['USGS_' + str(tmp_sc)][shp_mask].values != tmp_hist[tmp_sc]:
-            print('Index and mode soil class do not match at hru_id ' + \
-                  str(shp[intersect_hruId_var][shp_mask].values[0]))
-            tmp_sc = -999
-            
-        # Replace the value
-        print('Replacing soil class {} with {} at HRU {}'.format(att['soilTypeIndex'][idx],tmp_sc,attribute_hru))
-        att['soilTypeIndex'][idx] = tmp_sc
+    # Find HRUs that are missing in the shapefile; these keep their placeholder value
+    is_missing = shp[intersect_hruId_var].isna().values
+    for attribute_hru in attribute_hrus[is_missing]:
+        print('No soil class histogram found for HRU {}'.format(attribute_hru))
+    
+    # Find the mode soil class of each HRU (see attributes_nc.py)
+    tmp_sc = mode_soil_class(shp, attribute_hrus, is_missing)
+    
+    # Replace the values
+    tmp_sc = np.where(is_missing, att['soilTypeIndex'][:], tmp_sc)
+    print('Replacing soil classes at {} HRUs'.format((~is_missing).sum()))
+    att['soilTypeIndex'][:] = tmp_sc
         
         
 # --- Code provenance
@@ -135,9 +119,10 @@ log_suffix = '_add_soil_to_attributes.txt'
 logFolder = '_workflow_log'
 Path( logPath / logFolder ).mkdir(parents=True, exist_ok=True)
 
-# Copy this script
+# Copy this script and the shared attributes code it uses
 thisFile = '2a_insert_soilclass_from_hist_into_attributes.py'
 copyfile(thisFile, logPath / logFolder / thisFile);
+copyfile('attributes_nc.py', logPath / logFolder / 'attributes_nc.py');
 
 # Get current date and time
 now = datetime.now()
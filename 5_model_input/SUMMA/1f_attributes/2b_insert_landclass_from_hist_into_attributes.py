@@ -9,6 +9,7 @@ import geopandas as gpd
 from pathlib import Path
 from shutil import copyfile
 from datetime import datetime
+from attributes_nc import mode_land_class
 
 
 # --- Control file handling
@@ -84,53 +85,31 @@ else:
 # Open files
 shp = gpd.read_file(intersect_path/intersect_name)
 
+# Make the HRU ID the index, so that HRUs can be found without searching the whole table
+shp = shp.set_index(shp[intersect_hruId_var].astype(int))
+
 # Open the netcdf file for reading+writing
 with nc4.Dataset(attribute_path/attribute_name, "r+") as att:
     
-    # Keep track of number of water (class 17) occurrences
-    is_water = 0
+    # Put the shapefile rows in the same order as the HRUs in the attributes
+    attribute_hrus = att['hruId'][:].astype(int)
+    shp = shp.reindex(attribute_hrus)
     
-    # Loop over the HRUs in the attributes
-    for idx in range(0,len(att['hruId'])):
-        
-        # Find the HRU ID (attributes file) at this index
-        attribute_hru = att['hruId'][idx]
+    # Find HRUs that are missing in the shapefile; these keep their placeholder value
+    is_missing = shp[intersect_hruId_var].isna().values
+    for attribute_hru in attribute_hrus[is_missing]:
+        print('No land class histogram found for HRU {}'.format(attribute_hru))
     
-        # Find the row in the shapefile that contains info for this HRU
-        shp_mask = (shp[intersect_hruId_var].astype(int) == attribute_hru)
-        
-        # Extract the histogram values
-        tmp_hist = []
-        for j in range (1,18):
-            if 'IGBP_' + str(j) in shp.columns:
-                tmp_hist.append(shp['IGBP_' + str(j)][shp_mask].values[0])
-            else:
-                tmp_hist.append(0)
-        
-        # Find the index with the most occurences
-        # Note: this assumes index == class, but at index 0 we find class 1. 
-        # Hence we need to increase this value with +1 
-        tmp_lc = np.argmax(np.asarray(tmp_hist)) + 1
-        
-        # Check the assumption that index == soilclass
-        if shp['IGBP_' + str(tmp_lc)][shp_mask].values != tmp_hist[tmp_lc - 1]:
-            print('Index and mode land class do not match at hru_id ' + \
-                  str(shp[intersect_hruId_var][shp_mask].values[0]))
-            tmp_lc = -999
-        
-        # Handle the case where we have water (IGBP = 17)
-        if tmp_lc == 17:
-            if any(val > 0 for val in tmp_hist[0:-1]): # HRU is mostly water but other land classes are present
-                tmp_lc = np.argmax(np.asarray(tmp_hist[0:-1])) + 1 # select 2nd-most common class
-            else:
-                is_water += 1 # HRU is exclusively water
-        
-        # Replace the value
-        print('Replacing land class {} with {} at HRU {}'.format(att['vegTypeIndex'][idx],tmp_lc,attribute_hru))
-        att['vegTypeIndex'][idx] = tmp_lc
+    # Find the mode land class of each HRU, with special handling of water (see attributes_nc.py)
+    tmp_lc, is_water = mode_land_class(shp, attribute_hrus, is_missing)
+    
+    # Replace the values
+    tmp_lc = np.where(is_missing, att['vegTypeIndex'][:], tmp_lc)
+    print('Replacing land classes at {} HRUs'.format((~is_missing).sum()))
+    att['vegTypeIndex'][:] = tmp_lc
         
     # Print water counts
-    print('{} HRUs were identified as containing only open water. Note that SUMMA skips hydrologic calculations for such HRUs.'.format(is_water))
+    print('{} HRUs were identified as containing only open water. Note that SUMMA skips hydrologic calculations for such HRUs.'.format(is_water.sum()))
     
     
 # --- Code provenance
@@ -144,9 +123,10 @@ log_suffix = '_add_veg_to_attributes.txt'
 logFolder = '_workflow_log'
 Path( logPath / logFolder ).mkdir(parents=True, exist_ok=True)
 
-# Copy this script
+# Copy this script and the shared attributes code it uses
 thisFile = '2b_insert_landclass_from_hist_into_attributes.py'
 copyfile(thisFile, logPath / logFolder / thisFile);
+copyfile('attributes_nc.py', logPath / logFolder / 'attributes_nc.py');
 
 # Get current date and time
 now = datetime.now()
@@ -1,7 +1,9 @@
 # Insert MERIT Hydro elevation in SUMMA set up
 # Inserts elevation of each HRU into the attributes `.nc` file. The intersection code stores this value in field `elev_mean`. 
 #
-# If the field `settings_summa_connect_HRUs` is set to `yes` in the control file, this script also finds the downslope HRU (attribute `downHRUindex`) for the HRUs within each GRU. The most downstream HRU (i.e. the GRU outlet) is set to `0` to follow SUMMA conventions. If `settings_summa_connect_HRUs` is set to `no`, all HRUs are modelled as indepdendent columns and outflow from all HRUs inside each GRU is combined into basin-average outflow. No further action is needed, as `downHRUindex` for each HRU has already been set to `0`.
+# The intersection code also derives the mean tangent slope (field `tan_slope`) and contour length (field `cont_len`) of each HRU from the DEM. These replace the default values of `tan_slope` and `contourLength` in the attributes `.nc` file. 
+#
+# If the field `settings_summa_connect_HRUs` is set to `yes` in the control file, this script also finds the downslope HRU (attribute `downHRUindex`) for the HRUs within each GRU. HRUs are connected in a single chain from the highest to the lowest mean elevation. The most downstream HRU (i.e. the GRU outlet) is set to `0` to follow SUMMA conventions. If `settings_summa_connect_HRUs` is set to `no`, all HRUs are modelled as indepdendent columns and outflow from all HRUs inside each GRU is combined into basin-average outflow. No further action is needed, as `downHRUindex` for each HRU has already been set to `0`.
 
 # modules
 import os
@@ -11,6 +13,7 @@ import geopandas as gpd
 from pathlib import Path
 from shutil import copyfile
 from datetime import datetime
+from attributes_nc import connect_hrus_by_elevation
 
 
 # --- Control file handling
@@ -98,67 +101,45 @@ do_downHRUindex = read_from_control(controlFolder/controlFile,'settings_summa_co
 # Find the downHRUindex value if requested
 if do_downHRUindex.lower() == 'yes':
     
-    # Find the unique GRU IDs
-    gru_ids = shp[intersect_gruId_var].unique()
-    
-    # Make hruId the index
-    shp.set_index(intersect_hruId_var, inplace=True)
-    
-    # Loop over the GRUs
-    for gru_id in gru_ids:
-    
-        # Select only the GRU we're currently working on
-        gru_mask = (shp[intersect_gruId_var] == gru_id)
-    
-        # Find the soring order of HRUs in this GRU based on their elevations
-        tmp_sort = shp[gru_mask]['elev_mean'].argsort()
-    
-        # Loop over the HRUs in this GRU and set their downHRUindex in the shapefile
-        HRUs_seen = 0
-        last_HRU = 0
-        for HRU,order in tmp_sort.iteritems():
-            if order == 0: 
-                # most downstream HRU
-                print('Filling downHRUindex of HRU {} with HRU {}'.format(last_HRU,HRU)) 
-                print('Filling downHRUindex of HRU {} with HRU {}'.format(HRU,0)) 
-                if last_HRU != 0: # If there are more HRUs in this GRU ...
-                    shp.at[last_HRU, 'downHRUindex'] = int(HRU) # fill the second-to last and also ...
-                shp.at[HRU,      'downHRUindex'] = 0   # fill the last (possibly only) HRU
-            elif HRUs_seen > 0:
-                # not the first iteration
-                print('Filling downHRUindex of HRU {} with HRU {}'.format(last_HRU,HRU))        
-                shp.at[last_HRU, 'downHRUindex'] = int(HRU)
-            HRUs_seen += 1
-            last_HRU = HRU
-            
-    # Reset the index
-    shp.reset_index(inplace=True)
+    # Connect the HRUs in each GRU from the highest to the lowest mean elevation (see attributes_nc.py)
+    shp['downHRUindex'] = connect_hrus_by_elevation(shp[intersect_hruId_var].values, shp[intersect_gruId_var].values, shp['elev_mean'].values)
     
     
 # --- Open the attributes file and fill the placeholder values in the attributes file
+# Make the HRU ID the index, so that HRUs can be found without searching the whole table
+shp = shp.set_index(shp[intersect_hruId_var].astype(int))
+
 # Open the netcdf file for reading+writing
 with nc4.Dataset(attribute_path/attribute_name, "r+") as att:
     
-    # Loop over the HRUs in the attributes
-    for idx in range(0,len(att['hruId'])):
-        
-        # Find the HRU ID (attributes file) at this index
-        attribute_hru = att['hruId'][idx]
-    
-        # Find the row in the shapefile that contains info for this HRU
-        shp_mask = (shp[intersect_hruId_var].astype(int) == attribute_hru)
-        
-        # Find the elevation & downHRUindex
-        tmp_elev = shp['elev_mean'][shp_mask].values[0]
-        tmp_down = shp['downHRUindex'][shp_mask].values[0]
-        
-        # Replace the value
-        print('Replacing elevation {} [m] with {} [m] at HRU {}'.format(att['elevation'][idx],tmp_elev,attribute_hru))
-        att['elevation'][idx] = tmp_elev
+    # Put the shapefile rows in the same order as the HRUs in the attributes
+    attribute_hrus = att['hruId'][:].astype(int)
+    shp = shp.reindex(attribute_hrus)
+    
+    # Find HRUs that are missing in the shapefile; these keep their placeholder values
+    is_missing = shp[intersect_hruId_var].isna().values
+    for attribute_hru in attribute_hrus[is_missing]:
+        print('No elevation found for HRU {}'.format(attribute_hru))
+    
+    # Find the elevation, slope, contour length & downHRUindex
+    tmp_elev  = shp['elev_mean'].values
+    tmp_slope = shp['tan_slope'].values
+    tmp_clen  = shp['cont_len'].values
+    tmp_down  = shp['downHRUindex'].values
+    
+    # Replace the values
+    print('Replacing elevation at {} HRUs'.format((~is_missing).sum()))
+    att['elevation'][:] = np.where(is_missing, att['elevation'][:], tmp_elev)
+    
+    # Replace the slope and contour length defaults, if these could be derived from the DEM
+    has_slope = np.isfinite(tmp_slope) & np.isfinite(tmp_clen)
+    print('Replacing tan_slope and contourLength at {} HRUs'.format(has_slope.sum()))
+    att['tan_slope'][:] = np.where(has_slope, tmp_slope, att['tan_slope'][:])
+    att['contourLength'][:] = np.where(has_slope, tmp_clen, att['contourLength'][:])
         
-        if do_downHRUindex.lower() == 'yes':
-            print('Replacing downHRUindex {} with {} at HRU {}'.format(att['downHRUindex'][idx],tmp_down,attribute_hru))
-            att['downHRUindex'][idx] = tmp_down
+    if do_downHRUindex.lower() == 'yes':
+        print('Replacing downHRUindex at {} HRUs'.format((~is_missing).sum()))
+        att['downHRUindex'][:] = np.where(is_missing, att['downHRUindex'][:], tmp_down)
             
             
 # --- Code provenance
@@ -172,9 +153,10 @@ log_suffix = '_add_elevation_to_attributes.txt'
 logFolder = '_workflow_log'
 Path( logPath / logFolder ).mkdir(parents=True, exist_ok=True)
 
-# Copy this script
+# Copy this script and the shared attributes code it uses
 thisFile = '2c_insert_elevation_into_attributes.py'
 copyfile(thisFile, logPath / logFolder / thisFile);
+copyfile('attributes_nc.py', logPath / logFolder / 'attributes_nc.py');
 
 # Get current date and time
 now = datetime.now()
@@ -184,6 +166,6 @@ logFile = now.strftime('%Y%m%d') + log_suffix
 with open( logPath / logFolder / logFile, 'w') as file:
     
     lines = ['Log generated by ' + thisFile + ' on ' + now.strftime('%Y/%m/%d %H:%M:%S') + '\n',
-             'Added elevation to attributes .nc file.']
+             'Added elevation, tan_slope and contourLength to attributes .nc file.']
     for txt in lines:
         file.write(txt) 
\ No newline at end of file
@@ -0,0 +1,309 @@
+# Build attributes.nc in a single pass
+# Creates the attributes `.nc` file in one go from the catchment shapefile and the intersections with the DEM, soil and land classes. See: https://summa.readthedocs.io/en/master/input_output/SUMMA_input/
+#
+# This script gives the same result as running `1_initialize_attributes_nc.py` followed by `2a`, `2b` and `2c`. Instead of creating the file with placeholder values and 
+# filling these in three further steps, all information is first gathered in a single table that is sorted in the HRU order of the forcing files. Each 
+# variable is then written to the new file with a single call. 
+#
+# Fill values
+# | Variable       | Value |
+# |:---------------|:------|
+# | hruId          | taken from the shapefile index values |
+# | gruId          | taken from the shapefile index values |
+# | hru2gruId      | taken from the shapefile index values |
+# | downHRUindex   | 0 (each HRU is independent column), or derived from relative HRU elevations if `settings_summa_connect_HRUs` is `yes` |
+# | longitude      | taken from the shapefile geometry |
+# | latitude       | taken from the shapefile geometry |
+# | elevation      | mean elevation from the MERIT Hydro DEM intersection (field `elev_mean`) |
+# | HRUarea        | taken from the shapefile attributes |
+# | tan_slope      | mean tangent slope from the MERIT Hydro DEM intersection (field `tan_slope`), 0.1 [-] if not available |
+# | contourLength  | contour length from the MERIT Hydro DEM intersection (field `cont_len`), 30 [m] if not available |
+# | slopeTypeIndex | unused in current set up, fixed at 1 [-] |
+# | soilTypeIndex  | mode soil class from the SOILGRIDS intersection (fields `USGS_{0,1,...,12}`) |
+# | vegTypeIndex   | mode land class from the MODIS intersection (fields `IGBP_{1,...,17}`) |
+# | mHeight        | forcing measurement height from the control file |
+#
+# The rules used to select soil classes, land classes and downHRUindex values are shared with scripts `2a`, `2b` and `2c` (see `attributes_nc.py`). HRUs that cannot be
+# found in one of the intersections get the placeholder values of script `1` (-999 for elevation, soil and land class) and are not connected to other HRUs.
+
+# modules
+import os
+import numpy as np
+import pandas as pd
+import xarray as xr
+import geopandas as gpd
+from pathlib import Path
+from shutil import copyfile
+from datetime import datetime
+from attributes_nc import create_attributes_file, mode_soil_class, mode_land_class, connect_hrus_by_elevation
+
+
+# --- Control file handling
+# Easy access to control file folder
+controlFolder = Path('../../../0_control_files')
+
+# Store the name of the 'active' file in a variable
+controlFile = 'control_active.txt'
+
+# Function to extract a given setting from the control file
+def read_from_control( file, setting ):
+    
+    # Open 'control_active.txt' and ...
+    with open(file) as contents:
+        for line in contents:
+            
+            # ... find the line with the requested setting
+            if setting in line and not line.startswith('#'):
+                break
+    
+    # Extract the setting's value
+    substring = line.split('|',1)[1]      # Remove the setting's name (split into 2 based on '|', keep only 2nd part)
+    substring = substring.split('#',1)[0] # Remove comments, does nothing if no '#' is found
+    substring = substring.strip()         # Remove leading and trailing whitespace, tabs, newlines
+       
+    # Return this value    
+    return substring
+    
+# Function to specify a default path
+def make_default_path(suffix):
+    
+    # Get the root path
+    rootPath = Path( read_from_control(controlFolder/controlFile,'root_path') )
+    
+    # Get the domain folder
+    domainName = read_from_control(controlFolder/controlFile,'domain_name')
+    domainFolder = 'domain_' + domainName
+    
+    # Specify the forcing path
+    defaultPath = rootPath / domainFolder / suffix
+    
+    return defaultPath
+    
+    
+# --- Find shapefile locations and names
+# Catchment shapefile path & name
+catchment_path = read_from_control(controlFolder/controlFile,'catchment_shp_path')
+catchment_name = read_from_control(controlFolder/controlFile,'catchment_shp_name')
+
+# Specify default path if needed
+if catchment_path == 'default':
+    catchment_path = make_default_path('shapefiles/catchment') # outputs a Path()
+else:
+    catchment_path = Path(catchment_path) # make sure a user-specified path is a Path()
+    
+# Variable names used in shapefile
+catchment_hruId_var = read_from_control(controlFolder/controlFile,'catchment_shp_hruid')
+catchment_gruId_var = read_from_control(controlFolder/controlFile,'catchment_shp_gruid')
+catchment_area_var = read_from_control(controlFolder/controlFile,'catchment_shp_area')
+catchment_lat_var = read_from_control(controlFolder/controlFile,'catchment_shp_lat')
+catchment_lon_var = read_from_control(controlFolder/controlFile,'catchment_shp_lon')
+
+# Path to and name of shapefile with intersection between catchment and DEM
+intersect_dem_path = read_from_control(controlFolder/controlFile,'intersect_dem_path')
+intersect_dem_name = read_from_control(controlFolder/controlFile,'intersect_dem_name')
+
+# Specify default path if needed
+if intersect_dem_path == 'default':
+    intersect_dem_path = make_default_path('shapefiles/catchment_intersection/with_dem') # outputs a Path()
+else:
+    intersect_dem_path = Path(intersect_dem_path) # make sure a user-specified path is a Path()
+    
+# Path to and name of shapefile with intersection between catchment and soil classes
+intersect_soil_path = read_from_control(controlFolder/controlFile,'intersect_soil_path')
+intersect_soil_name = read_from_control(controlFolder/controlFile,'intersect_soil_name')
+
+# Specify default path if needed
+if intersect_soil_path == 'default':
+    intersect_soil_path = make_default_path('shapefiles/catchment_intersection/with_soilgrids') # outputs a Path()
+else:
+    intersect_soil_path = Path(intersect_soil_path) # make sure a user-specified path is a Path()
+    
+# Path to and name of shapefile with intersection between catchment and land classes
+intersect_land_path = read_from_control(controlFolder/controlFile,'intersect_land_path')
+intersect_land_name = read_from_control(controlFolder/controlFile,'intersect_land_name')
+
+# Specify default path if needed
+if intersect_land_path == 'default':
+    intersect_land_path = make_default_path('shapefiles/catchment_intersection/with_modis') # outputs a Path()
+else:
+    intersect_land_path = Path(intersect_land_path) # make sure a user-specified path is a Path()
+    
+    
+# --- Find forcing location and an example file
+# Forcing path
+forcing_path = read_from_control(controlFolder/controlFile,'forcing_summa_path')
+
+# Specify default path if needed
+if forcing_path == 'default':
+    forcing_path = make_default_path('forcing/4_SUMMA_input') # outputs a Path()
+else:
+    forcing_path = Path(forcing_path) # make sure a user-specified path is a Path()
+    
+# Find a list of forcing files
+_,_,forcing_files = next(os.walk(forcing_path))
+
+# Select a random file as a template for hruId order
+forcing_name = forcing_files[0]
+
+# Find the forcing measurement height
+forcing_measurement_height = float(read_from_control(controlFolder/controlFile,'forcing_measurement_height'))
+
+
+# --- Find where the attributes need to go
+# Attribute path & name
+attribute_path = read_from_control(controlFolder/controlFile,'settings_summa_path')
+attribute_name = read_from_control(controlFolder/controlFile,'settings_summa_attributes')
+
+# Specify default path if needed
+if attribute_path == 'default':
+    attribute_path = make_default_path('settings/SUMMA') # outputs a Path()
+else:
+    attribute_path = Path(attribute_path) # make sure a user-specified path is a Path()
+    
+# Make the folder if it doesn't exist
+attribute_path.mkdir(parents=True, exist_ok=True)
+
+
+# --- Load the catchment shapefile and sort it based on HRU order in the forcing file
+# Open the catchment shapefile
+shp = gpd.read_file(catchment_path/catchment_name)
+
+# Open the forcing file
+forc = xr.open_dataset(forcing_path/forcing_name)
+
+# Get the sorting order from the forcing file
+forcing_hruIds = forc['hruId'].values.astype(int) # 'hruId' is prescribed by SUMMA so this variable must exist
+
+# Make the hruId variable in the shapefile the index
+shp = shp.set_index(catchment_hruId_var)
+
+# Enforce index as integers
+shp.index = shp.index.astype(int)
+
+# Sort the shape based on the forcing HRU order
+shp = shp.loc[forcing_hruIds]
+
+# Reset the index so that we reference each row properly in later code
+shp = shp.reset_index()
+
+
+# --- Find number of GRUs and HRUs
+# Extract HRU IDs and count unique occurence (should be equal to length of shapefile)
+hru_ids = shp[catchment_hruId_var].values.astype(int)
+num_hru = len(pd.unique(hru_ids))
+
+gru_ids = pd.unique(shp[catchment_gruId_var].values)
+num_gru = len(gru_ids)
+
+
+# --- Function definition
+# Loads an intersection shapefile and puts its rows in the HRU order of the catchment shapefile
+def load_intersection(file, hru_ids, name):
+    
+    # Open the shapefile and make the HRU ID the index
+    tmp = gpd.read_file(file)
+    tmp = tmp.set_index(tmp[catchment_hruId_var].astype(int))
+    
+    # Reorder to match the catchment shapefile
+    tmp = tmp.reindex(hru_ids)
+    
+    # Report HRUs that are not in the intersection; these get the placeholder values of script 1
+    is_missing = tmp[catchment_hruId_var].isna().values
+    for hru in hru_ids[is_missing]:
+        print('No {} found for HRU {}'.format(name, hru))
+    
+    return tmp, is_missing
+    
+    
+# --- Elevation, slope and contour length
+# Load the DEM intersection
+dem, is_missing = load_intersection(intersect_dem_path/intersect_dem_name, hru_ids, 'elevation')
+
+# Mean elevation
+elevation = np.where(is_missing, -999, dem['elev_mean'].values)
+
+# Slope and contour length, if these could be derived from the DEM. Only used in qbaseTopmodel modelling decision
+has_slope = np.isfinite(dem['tan_slope'].values) & np.isfinite(dem['cont_len'].values)
+tan_slope = np.where(has_slope, dem['tan_slope'].values, 0.1)
+contour_length = np.where(has_slope, dem['cont_len'].values, 30)
+
+
+# --- Define downHRUindex values if requested
+# All HRUs modeled as independent columns unless requested otherwise
+down_hru = np.zeros(num_hru, dtype=int)
+
+# Find if this is requested by the user
+do_downHRUindex = read_from_control(controlFolder/controlFile,'settings_summa_connect_HRUs')
+
+# Connect the HRUs in each GRU from the highest to the lowest mean elevation, as script 2c does (see attributes_nc.py).
+# HRUs that are missing from the DEM intersection are not part of the chain and keep downHRUindex = 0.
+if do_downHRUindex.lower() == 'yes':
+    down_hru[~is_missing] = connect_hrus_by_elevation(hru_ids[~is_missing], 
+                                                      shp[catchment_gruId_var].values[~is_missing], 
+                                                      dem['elev_mean'].values[~is_missing])
+    
+    
+# --- Soil class
+# Load the soil intersection and find the mode soil class of each HRU, as script 2a does (see attributes_nc.py)
+soil, is_missing = load_intersection(intersect_soil_path/intersect_soil_name, hru_ids, 'soil class histogram')
+soil_class = np.where(is_missing, -999, mode_soil_class(soil, hru_ids, is_missing))
+
+
+# --- Land class
+# Load the land intersection and find the mode land class of each HRU, as script 2b does (see attributes_nc.py)
+land, is_missing = load_intersection(intersect_land_path/intersect_land_name, hru_ids, 'land class histogram')
+land_class, is_water = mode_land_class(land, hru_ids, is_missing)
+land_class = np.where(is_missing, -999, land_class)
+
+# Print water counts
+print('{} HRUs were identified as containing only open water. Note that SUMMA skips hydrologic calculations for such HRUs.'.format(is_water.sum()))
+
+
+# --- Create the new attributes file
+# HRU variables; due to pre-sorting, these are already in the same order as the forcing files
+hru_values = {
+    'hruId':          hru_ids,
+    'HRUarea':        shp[catchment_area_var].values,
+    'latitude':       shp[catchment_lat_var].values,
+    'longitude':      shp[catchment_lon_var].values,
+    'hru2gruId':      shp[catchment_gruId_var].values,
+    'downHRUindex':   down_hru,
+    'elevation':      elevation,
+    'tan_slope':      tan_slope,
+    'contourLength':  contour_length,
+    'slopeTypeIndex': np.full(num_hru, 1),                          # Needs to be set but not used
+    'soilTypeIndex':  soil_class,
+    'vegTypeIndex':   land_class,
+    'mHeight':        np.full(num_hru, forcing_measurement_height)} # Forcing data height; used in some scaling equations
+
+# Create the new .nc file and write all variables (see attributes_nc.py)
+create_attributes_file(attribute_path/attribute_name, gru_ids, hru_values)
+        
+        
+# --- Code provenance
+# Generates a basic log file in the domain folder and copies the control file and itself there.
+
+# Set the log path and file name
+logPath = attribute_path
+log_suffix = '_build_attributes.txt'
+
+# Create a log folder
+logFolder = '_workflow_log'
+Path( logPath / logFolder ).mkdir(parents=True, exist_ok=True)
+
+# Copy this script and the shared attributes code it uses
+thisFile = '3_build_attributes_nc.py'
+copyfile(thisFile, logPath / logFolder / thisFile);
+copyfile('attributes_nc.py', logPath / logFolder / 'attributes_nc.py');
+
+# Get current date and time
+now = datetime.now()
+
+# Create a log file 
+logFile = now.strftime('%Y%m%d') + log_suffix
+with open( logPath / logFolder / logFile, 'w') as file:
+    
+    lines = ['Log generated by ' + thisFile + ' on ' + now.strftime('%Y/%m/%d %H:%M:%S') + '\n',
+             'Built the attributes .nc file with elevation, soil and land classes in a single pass.']
+    for txt in lines:
+        file.write(txt)
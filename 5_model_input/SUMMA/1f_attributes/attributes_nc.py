@@ -0,0 +1,164 @@
+# Code shared by the scripts that create and fill the attributes `.nc` file
+# Script `1` and `3` use `create_attributes_file` to define and write the variables. Scripts `2a`, `2b` and `2c` and
+# script `3` use the same rules to select soil classes, land classes and downHRUindex values, so that the step-by-step
+# and single-pass approaches give the same result.
+
+# modules
+import sys
+import numpy as np
+import pandas as pd
+import netCDF4 as nc4
+from datetime import datetime
+
+
+# --- Attributes file
+# Names, dimensions, data types, units and long names of the variables in the attributes file
+attribute_variables = {
+    'hruId':          ('hru', 'i4', '-',                    'Index of hydrological response unit (HRU)'),
+    'gruId':          ('gru', 'i4', '-',                    'Index of grouped response unit (GRU)'),
+    'hru2gruId':      ('hru', 'i4', '-',                    'Index of GRU to which the HRU belongs'),
+    'downHRUindex':   ('hru', 'i4', '-',                    'Index of downslope HRU (0 = basin outlet)'),
+    'longitude':      ('hru', 'f8', 'Decimal degree east',  'Longitude of HRU''s centroid'),
+    'latitude':       ('hru', 'f8', 'Decimal degree north', 'Latitude of HRU''s centroid'),
+    'elevation':      ('hru', 'f8', 'm',                    'Mean HRU elevation'),
+    'HRUarea':        ('hru', 'f8', 'm^2',                  'Area of HRU'),
+    'tan_slope':      ('hru', 'f8', 'm m-1',                'Average tangent slope of HRU'),
+    'contourLength':  ('hru', 'f8', 'm',                    'Contour length of HRU'),
+    'slopeTypeIndex': ('hru', 'i4', '-',                    'Index defining slope'),
+    'soilTypeIndex':  ('hru', 'i4', '-',                    'Index defining soil type'),
+    'vegTypeIndex':   ('hru', 'i4', '-',                    'Index defining vegetation type'),
+    'mHeight':        ('hru', 'f8', 'm',                    'Measurement height above bare ground')}
+
+# Creates the attributes file and writes the GRU IDs and the given HRU variables, each with a single call
+def create_attributes_file(file, gru_ids, hru_values):
+
+    num_hru = len(hru_values['hruId'])
+    with nc4.Dataset(file, "w", format="NETCDF4") as att:
+
+        # General attributes
+        now = datetime.now()
+        att.setncattr('Author', "Created by SUMMA workflow scripts")
+        att.setncattr('History','Created ' + now.strftime('%Y/%m/%d %H:%M:%S'))
+
+        # Define the dimensions
+        att.createDimension('hru',num_hru)
+        att.createDimension('gru',len(gru_ids))
+
+        # Define the variables
+        for var,(dim,datatype,units,long_name) in attribute_variables.items():
+            att.createVariable(var, datatype, dim, fill_value = False)
+            att[var].setncattr('units', units)
+            att[var].setncattr('long_name', long_name)
+
+        # GRU variable
+        att['gruId'][:] = gru_ids
+
+        # Write the HRU variables
+        for progress,(var,values) in enumerate(hru_values.items()):
+            att[var][:] = values
+
+            # Show a progress report
+            print('{} out of {} HRU variables written ({} HRUs).'.format(progress+1, len(hru_values), num_hru))
+
+
+# --- Soil and land classes
+# Finds the mode soil class of each HRU from the histogram fields `USGS_{0,1,...,12}` of the soil intersection.
+# 'shp' has one row per HRU, in the order of 'hru_ids'. Values for HRUs that are missing from the intersection
+# ('is_missing') are meaningless and need to be replaced by the caller.
+def mode_soil_class(shp, hru_ids, is_missing):
+
+    # Extract the histogram values as [HRU x class] array; classes without a column have 0 occurences
+    hist_columns = ['USGS_' + str(j) for j in range(0,13)]
+    has_column = np.array([col in shp.columns for col in hist_columns])
+    tmp_hist = shp.reindex(columns=hist_columns).fillna(0).to_numpy(copy=True)
+
+    # Set the '0' class to having -1 occurences -> that must make some other class the most occuring one.
+    # Using -1 also accounts for cases where SOILGRIDS has no sand/silt/clay data (oceans, glaciers, open water)
+    # and returns soil class =0. In such cases we default to the soilclass with the second most occurences. If
+    # tied, we use the first in the list. We should never return soilclass = 0 in this way.
+    tmp_hist[:,0] = -1
+
+    # Find the index with the most occurences
+    # Note: this assumes that we have USGS_0 to USGS_12 and thus that index == soilclass.
+    tmp_sc = np.argmax(tmp_hist, axis=1)
+
+    # Check the assumption that index == soilclass
+    is_mismatch = ~has_column[tmp_sc] & ~is_missing
+    for hru in hru_ids[is_mismatch]:
+        print('Index and mode soil class do not match at hru_id ' + str(hru))
+    tmp_sc[is_mismatch] = -999
+
+    return tmp_sc
+
+# Finds the mode land class of each HRU from the histogram fields `IGBP_{1,...,17}` of the land intersection.
+# HRUs that are mostly, but not only, water (IGBP = 17) get their most common other land class instead.
+# Returns the land classes and which HRUs contain only open water. Values for HRUs that are missing from the
+# intersection ('is_missing') are meaningless and need to be replaced by the caller.
+def mode_land_class(shp, hru_ids, is_missing):
+
+    # Extract the histogram values as [HRU x class] array; classes without a column have 0 occurences
+    hist_columns = ['IGBP_' + str(j) for j in range(1,18)]
+    has_column = np.array([col in shp.columns for col in hist_columns])
+    tmp_hist = shp.reindex(columns=hist_columns).fillna(0).to_numpy(copy=True)
+
+    # Find the index with the most occurences
+    # Note: this assumes index == class, but at index 0 we find class 1.
+    # Hence we need to increase this value with +1
+    tmp_lc = np.argmax(tmp_hist, axis=1) + 1
+
+    # Check the assumption that index == landclass
+    is_mismatch = ~has_column[tmp_lc - 1] & ~is_missing
+    for hru in hru_ids[is_mismatch]:
+        print('Index and mode land class do not match at hru_id ' + str(hru))
+    tmp_lc[is_mismatch] = -999
+
+    # Handle the case where we have water (IGBP = 17)
+    is_water = (tmp_lc == 17) & ~is_missing
+    is_mixed = is_water & (tmp_hist[:,0:-1] > 0).any(axis=1) # HRU is mostly water but other land classes are present
+    tmp_lc[is_mixed] = np.argmax(tmp_hist[is_mixed,0:-1], axis=1) + 1 # select 2nd-most common class
+    is_water = is_water & ~is_mixed # HRU is exclusively water
+
+    return tmp_lc, is_water
+
+
+# --- Connected HRUs
+# Connects the HRUs within each GRU in a single chain from the highest to the lowest mean elevation. Each HRU drains
+# into the next (lower) HRU in the same GRU; the lowest HRU is the GRU outlet (0). Ties keep the given order of the
+# HRUs. Returns the downHRUindex of each HRU and stops if the result is not a single chain per GRU.
+def connect_hrus_by_elevation(hru_ids, gru_ids, elevation):
+
+    # Sort the HRUs by GRU and, within each GRU, from highest to lowest elevation
+    hrus = pd.DataFrame({'hru': hru_ids, 'gru': gru_ids, 'elev': elevation})
+    hrus_sorted = hrus.sort_values(['gru','elev'], ascending=[True,False], kind='mergesort')
+
+    # Each HRU drains into the next (lower) HRU in the same GRU; the lowest HRU is the GRU outlet (0)
+    next_hru = hrus_sorted['hru'].shift(-1)
+    next_gru = hrus_sorted['gru'].shift(-1)
+    down_hru = np.zeros(len(hrus), dtype=int)
+    down_hru[hrus_sorted.index.values] = np.where(next_gru == hrus_sorted['gru'], next_hru, 0).astype(int)
+
+    # Validate the result: each GRU must form a single chain of HRUs that ends at 0
+    # Position of the downslope HRU of each HRU (-1 = GRU outlet, -2 = unknown HRU ID)
+    hru_pos = pd.Series(np.arange(len(hrus)), index=np.asarray(hru_ids).astype(int))
+    down_pos = hru_pos.reindex(down_hru).fillna(-2).values.astype(int)
+    down_pos[down_hru == 0] = -1
+
+    # Check the number of outlets per GRU and whether the downslope HRU is in the same GRU
+    gru_vals = np.asarray(gru_ids)
+    outlets_per_gru = pd.Series(down_pos == -1).groupby(gru_vals).sum()
+    is_wrong_gru = (down_pos >= 0) & (gru_vals[np.maximum(down_pos,0)] != gru_vals)
+
+    # Follow the chains by pointer doubling; HRUs that have not reached an outlet at the end are part of a cycle
+    reach = down_pos.copy()
+    for _ in range(int(np.ceil(np.log2(max(len(hrus),2)))) + 1):
+        in_chain = reach >= 0
+        reach[in_chain] = reach[reach[in_chain]]
+
+    # Stop if any of the checks failed
+    if (outlets_per_gru != 1).any() or is_wrong_gru.any() or (reach != -1).any():
+        sys.exit('Error: downHRUindex does not form a single chain ending at 0 in GRU(s) {}'.format(
+                 np.unique(np.concatenate([outlets_per_gru.index[outlets_per_gru != 1].values,
+                                           gru_vals[is_wrong_gru], gru_vals[reach != -1]]))))
+    print('Connected {} HRUs in {} GRUs by relative elevation'.format(len(hrus), len(outlets_per_gru)))
+
+    return down_hru
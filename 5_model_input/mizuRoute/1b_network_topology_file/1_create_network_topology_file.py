@@ -5,6 +5,8 @@
 
 # modules
 import os
+import sys
+import numpy as np
 import pandas as pd
 import netCDF4 as nc4
 import geopandas as gpd
@@ -137,6 +139,37 @@ if enforce_outlets:
         else:
             print('outlet_id {} not found in {}'.format(outlet_id,river_seg_id))
 
+# Function to find segments that (eventually) drain into themselves. Segments without upstream segments are removed
+# one by one; segments that are never removed are part of a cycle. See 0_tools/MIZUROUTE_validate_network_topology.py.
+def find_cycle_segments(seg_ids, down_ids):
+    down_index = pd.Index(seg_ids).get_indexer(down_ids).tolist()
+    num_up = [0] * len(seg_ids)
+    for down in down_index:
+        if down >= 0:
+            num_up[down] += 1
+    stack = [seg for seg in range(len(seg_ids)) if num_up[seg] == 0]
+    removed = np.zeros(len(seg_ids), dtype=bool)
+    while stack:
+        seg = stack.pop()
+        removed[seg] = True
+        down = down_index[seg]
+        if down >= 0:
+            num_up[down] -= 1
+            if num_up[down] == 0:
+                stack.append(down)
+    return seg_ids[~removed]
+
+# Check that every segment drains to an outlet. mizuRoute cannot handle cycles; segments with a downstream ID that is
+# not in the network are treated as outlets, which may be unintended
+seg_ids  = shp_river[river_seg_id].values.astype(int)
+down_ids = shp_river[river_down_seg_id].values.astype(int)
+dangling_ids = seg_ids[(down_ids > 0) & ~np.isin(down_ids, seg_ids)]
+if len(dangling_ids) > 0:
+    print('Warning: {} segment(s) drain to a {} not found in {}, e.g. segment(s) {}'.format(len(dangling_ids), river_down_seg_id, river_seg_id, dangling_ids[:5]))
+cycle_ids = find_cycle_segments(seg_ids, down_ids)
+if len(cycle_ids) > 0:
+    sys.exit('Error: {} segment(s) are part of a cycle in the river network, e.g. segment(s) {}. Use 0_tools/MIZUROUTE_validate_network_topology.py to find and repair these.'.format(len(cycle_ids), cycle_ids[:5]))
+
 # Function to create new nc variables
 def create_and_fill_nc_var(ncid, var_name, var_type, dim, fill_val, fill_data, long_name, units):
     
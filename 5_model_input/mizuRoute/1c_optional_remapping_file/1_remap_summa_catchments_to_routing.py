@@ -4,8 +4,7 @@
 # **_This code assumes routing occurs at the GRU level of SUMMA outputs. SUMMA-HRU-level routing is not supported._**
 
 # modules
-import itertools
-import pandas as pd
+import numpy as np
 import netCDF4 as nc4
 import geopandas as gpd
 from pathlib import Path
@@ -154,28 +153,36 @@ int_rm_id = 'S_1_' + rm_shp_hru_id
 int_hm_id = 'S_2_' + hm_shp_gru_id
 int_weight = 'AP1N'
 
-# Sort the intersected shape by RM ID first, and HM ID second. This means all info per RM ID is in consecutive rows
-intersected_shape = intersected_shape.sort_values(by=[int_rm_id,int_hm_id])
+# Sort the intersection pieces by RM ID first, and HM ID second. This means all info per RM ID is in consecutive rows
+rm_ids = intersected_shape[int_rm_id].values.astype(int)
+hm_ids = intersected_shape[int_hm_id].values.astype(int)
+order = np.lexsort((hm_ids,rm_ids))
 
-# Routing Network HRU ID
-nc_rnhruid = intersected_shape.groupby(int_rm_id).agg({int_rm_id: pd.unique}).values.astype(int)
-
-# Number of Hydrologic Model elements (GRUs in SUMMA's case) per Routing Network catchment
-nc_noverlaps = intersected_shape.groupby(int_rm_id).agg({int_hm_id: 'count'}).values.astype(int)
+# Routing Network HRU ID and the number of Hydrologic Model elements (GRUs in SUMMA's case) per Routing Network catchment
+nc_rnhruid, nc_noverlaps = np.unique(rm_ids[order], return_counts=True)
 
 # Hydrologic Model GRU IDs that are associated with each part of the overlap
-multi_nested_list = intersected_shape.groupby(int_rm_id).agg({int_hm_id: list}).values.tolist() # Get the data
-nc_hmgruid = list(itertools.chain.from_iterable(itertools.chain.from_iterable(multi_nested_list))) # Combine 3 nested list into 1
+nc_hmgruid = hm_ids[order]
 
 # Areal weight of each HM GRU per part of the overlaps
-multi_nested_list = intersected_shape.groupby(int_rm_id).agg({int_weight: list}).values.tolist() 
-nc_weight = list(itertools.chain.from_iterable(itertools.chain.from_iterable(multi_nested_list))) 
+nc_weight = intersected_shape[int_weight].values.astype(float)[order]
+
+# Check that the weights of each Routing Network catchment sum to one. Weights sum to less than one for catchments
+# that are only partly covered by the Hydrologic Model catchments
+weight_sum = np.add.reduceat(nc_weight, np.cumsum(nc_noverlaps) - nc_noverlaps)
+incomplete = np.abs(weight_sum - 1) > 1e-3
+if incomplete.any():
+    print('Warning: weights of {} RN HRU(s) do not sum to one (min: {:.3f}, max: {:.3f}), e.g. RN HRU(s) {}'.format(
+          incomplete.sum(), weight_sum.min(), weight_sum.max(), nc_rnhruid[incomplete][:5]))
+missing = ~rm_shape[rm_shp_hru_id].astype(int).isin(nc_rnhruid)
+if missing.any():
+    print('Warning: {} RN HRU(s) do not overlap any HM catchment and are not part of the remap file'.format(missing.sum()))
 
 
 # --- Make the `.nc` file
 # Find the dimension sizes
-num_hru  = len(rm_shape)
-num_data = len(intersected_shape)
+num_hru  = len(nc_rnhruid)
+num_data = len(nc_hmgruid)
 
 # Function to create new nc variables
 def create_and_fill_nc_var(ncid, var_name, var_type, dim, fill_val, fill_data, long_name, units):
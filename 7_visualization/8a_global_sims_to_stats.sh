@@ -1,5 +1,5 @@
 #!/bin/bash
-module load StdEnv/2020 intel/2020.1.217 openmpi/4.0.3 cdo/1.9.8
+# Statistics are computed with ../0_tools/SUMMA_timeseries_to_statistics_parallel.py
 
 # Define the simulation paths
 root_path="/gpfs/tp/gwf/gwf_cmt/wknoben/CWARHM_data/domain_"
@@ -27,6 +27,6 @@ do
   #echo "index: $i, SUMMA out: $mizur_out"
   
   echo "Working on ${domain_name[$i]}"
-  cdo timmean -select,name=scalarTotalET,scalarTotalRunoff,gruId,hruId ${summa_in} ${summa_out}
-  cdo timmean -select,name=IRFroutedRunoff,reachID ${mizur_in} ${mizur_out}
+  python ../0_tools/SUMMA_timeseries_to_statistics_parallel.py ${summa_in} ${summa_out} scalarTotalET,scalarTotalRunoff mean
+  python ../0_tools/SUMMA_timeseries_to_statistics_parallel.py ${mizur_in} ${mizur_out} IRFroutedRunoff mean
 done